@@ -27,9 +27,16 @@ from sqlalchemy import event
 from sqlalchemy.engine import Engine
 
 from .config import config
+from .email_queue import EmailQueue
 from .errors import register_error_handlers
-from .filters import log_class
+from .filters import log_class, log_time
+from .identity_cache import IdentityCache
+from .last_seen import LastSeenBuffer
+from .lazy_loads import setup_lazy_load_logging
 from .logger import setup_logger
+from .metrics import Metrics
+from .passwords import PasswordHasher
+from .sql_trace import SqlTracer
 from .utils import inject_permissions
 
 toolbar = DebugToolbarExtension()
@@ -38,6 +45,12 @@ mail = Mail()
 moment = Moment()
 db = SQLAlchemy()
 migrate = Migrate()
+last_seen_buffer = LastSeenBuffer()
+identity_cache = IdentityCache()
+password_hasher = PasswordHasher()
+email_queue = EmailQueue()
+metrics = Metrics()
+sql_tracer = SqlTracer()
 
 # Инициализация Flask-Login и настройка
 login_manager = LoginManager()
@@ -77,10 +90,17 @@ def create_app(config_name=None):
 
     bootstrap.init_app(app)
     mail.init_app(app)
+    email_queue.init_app(app)
     moment.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
+    last_seen_buffer.init_app(app)
+    identity_cache.init_app(app)
+    password_hasher.init_app(app)
+    setup_lazy_load_logging(app)
+    metrics.init_app(app)
+    sql_tracer.init_app(app)
 
     # Рег. макетов приложения
     from .main import main_bp
@@ -97,6 +117,7 @@ def create_app(config_name=None):
 
     # Регистрируем фильтр Jinja2
     app.jinja_env.filters["log_class"] = log_class
+    app.jinja_env.filters["log_time"] = log_time
 
     # Регистрация контекстного процессора
     app.context_processor(inject_permissions)
@@ -0,0 +1,91 @@
+"""
+Пагинация списков API v1 по непрозрачным подписанным курсорам.
+
+Курсор - это подписанный (itsdangerous) ключ `(timestamp, id)` крайнего элемента
+страницы вместе с направлением навигации. Клиент получает `next_cursor`/`prev_cursor`
+и передаёт их обратно в параметре `?cursor=`. Каждая страница выбирается условием
+по ключу (см. `app.pagination.keyset_paginate`), поэтому стоимость запроса постоянна
+на любой глубине, а общее количество элементов считается только по запросу `?count=true`.
+
+Ссылки вида `?page=N` по-прежнему обслуживаются постраничной навигацией.
+"""
+
+from collections import OrderedDict
+
+from flask import abort, current_app, request, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import func, select
+
+from app import db
+from app.pagination import keyset_paginate
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='api-cursor-salt')
+
+
+def sign_cursor(cursor, direction):
+    """Подписывает курсор keyset-пагинации и направление ('after' или 'before')."""
+    if cursor is None:
+        return None
+    return _serializer().dumps({direction: cursor})
+
+
+def unsign_cursor(token):
+    """Проверяет подпись курсора. Возвращает пару курсоров (after, before)."""
+    try:
+        data = _serializer().loads(token)
+    except BadSignature:
+        abort(400, description='Неверный курсор пагинации')
+    return data.get('after'), data.get('before')
+
+
+def count_requested():
+    """Клиент явно запросил общее количество элементов (`?count=true`)."""
+    return request.args.get('count', '').lower() in ('1', 'true', 'yes')
+
+
+def paginate_list(stmt, timestamp_col, id_col, per_page, endpoint, count_field, descending=True, key=None,
+                  **url_kwargs):
+    """Выбирает страницу списка API и формирует поля навигации для ответа.
+
+    Args:
+        stmt (Select): Запрос элементов списка.
+        timestamp_col, id_col: Колонки ключа сортировки (timestamp, id).
+        per_page (int): Количество элементов на странице.
+        endpoint (str): Эндпоинт для построения ссылок на соседние страницы.
+        count_field (str): Имя поля с общим количеством элементов ('posts_count', 'comments_count').
+        descending (bool): Сортировка от новых к старым.
+        key (callable | None): Получение ключа (timestamp, id) из элемента (см. keyset_paginate).
+        **url_kwargs: Параметры эндпоинта (например, username).
+
+    Returns:
+        tuple[list, OrderedDict]: Элементы страницы и поля навигации для ответа.
+    """
+    meta = OrderedDict()
+
+    if 'page' in request.args and 'cursor' not in request.args:
+        page = request.args.get('page', 1, type=int)
+        pagination = db.paginate(stmt, page=page, per_page=per_page, error_out=False)
+        meta['page'] = f'{page} of {pagination.pages}'
+        meta['prev_page'] = url_for(endpoint, page=page - 1, _external=True, **url_kwargs) if pagination.has_prev else None
+        meta['next_page'] = url_for(endpoint, page=page + 1, _external=True, **url_kwargs) if pagination.has_next else None
+        meta[count_field] = pagination.total
+        return pagination.items, meta
+
+    cursor = request.args.get('cursor')
+    after, before = unsign_cursor(cursor) if cursor else (None, None)
+    pagination = keyset_paginate(stmt, timestamp_col, id_col, per_page=per_page,
+                                 after=after, before=before, descending=descending, key=key)
+
+    next_cursor = sign_cursor(pagination.next_cursor, 'after')
+    prev_cursor = sign_cursor(pagination.prev_cursor, 'before')
+    meta['next_cursor'] = next_cursor
+    meta['prev_cursor'] = prev_cursor
+    meta['next_page'] = url_for(endpoint, cursor=next_cursor, _external=True, **url_kwargs) if next_cursor else None
+    meta['prev_page'] = url_for(endpoint, cursor=prev_cursor, _external=True, **url_kwargs) if prev_cursor else None
+
+    if count_requested():
+        meta[count_field] = db.session.scalar(select(func.count()).select_from(stmt.order_by(None).subquery()))
+
+    return pagination.items, meta
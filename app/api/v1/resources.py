@@ -4,17 +4,34 @@ from flask import (abort, current_app, g, json, jsonify, make_response,
                    request, url_for)
 from flask_httpauth import HTTPBasicAuth
 from sqlalchemy import select
+from sqlalchemy.orm import contains_eager, lazyload
 
-from app.models import AnonymousUser, Comment, Permission, Post, User, db
+from app.models import (AnonymousUser, Comment, Follow, Permission, Post, User,
+                        db)
 
 from . import api_v1_bp
 from .decorators import permission_required
+from .pagination import paginate_list
+from .serializers import (serialize_comment, serialize_comments,
+                          serialize_follows, serialize_post, serialize_posts)
+from .tokens import token_registry
 
 # Расширение Flask-HTTPAuth инициализируется в пакете этого макета, а не в пакете приложения,
 # т.к. этот тип аутентификации будет использоваться только в рамках макета API.
 auth = HTTPBasicAuth()
 
 
+def posts_to_json(posts):
+    """Сериализует страницу постов для списков API: превью текста и последние комментарии.
+
+    Авторы и превью комментариев всех постов страницы загружаются пакетно (см. `serializers`).
+    """
+    return serialize_posts(posts,
+                           include_disabled_comments=g.current_user.can(Permission.ADMINISTER),
+                           excerpt=True,
+                           comments_limit=current_app.config['COMMENTS_PREVIEW_COUNT'])
+
+
 @api_v1_bp.before_request
 @auth.login_required
 def before_request():
@@ -49,9 +66,10 @@ def verify_password(email_or_token, password) -> bool:
         - Устанавливает глобальные объекты Flask:
             - `g.current_user`: объект пользователя (User/AnonymousUser).
             - `g.token_used`: флаг (True, если аутентификация по токену).
+            - `g.token_data`: данные проверенного токена (только при аутентификации по токену).
 
     Raises:
-        - Неявно: может вызывать исключения из `User.verify_auth_token()` или SQLAlchemy.
+        - Неявно: может вызывать исключения из `User.decode_auth_token()` или SQLAlchemy.
 
     Examples:
         #### Анонимный доступ (публичный API)
@@ -77,7 +95,8 @@ def verify_password(email_or_token, password) -> bool:
         return True
 
     if password == '':
-        g.current_user = User.verify_auth_token(email_or_token)
+        # Быстрый путь: кеш проверенных токенов и учётных данных, см. `tokens`
+        g.current_user, g.token_data = token_registry().authenticate(email_or_token)
         g.token_used = True
         return g.current_user is not None
 
@@ -101,30 +120,47 @@ def get_token():
         'expiration': 216000})
 
 
+@api_v1_bp.route('/token', methods=['DELETE'])
+def revoke_token():
+    """Досрочно отзывает токен, которым аутентифицирован запрос."""
+    if not g.get('token_used'):
+        return abort(401)
+
+    # Данные токена сохранены при аутентификации: повторная проверка не нужна
+    token_registry().revoke(g.token_data)
+
+    return '', 204
+
+
+@api_v1_bp.route('/token/usage')
+def get_token_usage():
+    """Статистика использования текущего токена (в пределах процесса)."""
+    if not g.get('token_used'):
+        return abort(401)
+
+    data = g.token_data
+    usage = token_registry().usage(data['jti']) or {'count': 0, 'last_used': None}
+
+    return jsonify({
+        'count': usage['count'],
+        'last_used': usage['last_used'],
+        'expires_at': data['expires_at']})
+
+
 @api_v1_bp.route('/posts')
 def get_posts():
-    page = request.args.get('page', 1, type=int)
-
-    pagination = db.paginate(
-        select(Post).order_by(Post.timestamp.desc()),
-        page=page,
+    posts, meta = paginate_list(
+        select(Post),
+        Post.timestamp, Post.id,
         per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False
+        endpoint='api_v1.get_posts',
+        count_field='posts_count'
     )
 
-    prev_page = url_for('api_v1.get_posts', page=page - 1, _external=True) if pagination.has_prev else None
-    next_page = url_for('api_v1.get_posts', page=page + 1, _external=True) if pagination.has_next else None
-
     data = OrderedDict([
-        ('posts', [
-            post.to_json(include_disabled_comments=g.current_user.can(Permission.ADMINISTER), only_few_comments=True)
-            for post in pagination.items
-        ]),
-        ('page', f'{page} of {pagination.pages}'),
-        ('prev_page', prev_page),
-        ('next_page', next_page),
-        ('posts_count', pagination.total)
+        ('posts', posts_to_json(posts)),
     ])
+    data.update(meta)
 
     # Сохраняем порядок атрибутов в ответе
     response = make_response(json.dumps(data, ensure_ascii=False, sort_keys=False), 200)
@@ -155,9 +191,9 @@ def get_post(id):
         error_out=False
     )
 
-    post_data = post.to_json()
-    # Переопределяем комменты для их пагинации
-    post_data['comments'] = [comment.to_json() for comment in pagination.items]
+    # Комменты поста пагинируются, поэтому сериализуются отдельно
+    post_data = serialize_post(post, with_comments=False)
+    post_data['comments'] = serialize_comments(pagination.items)
     post_data['pages'] = f'{page} of {pagination.pages}'
     post_data['comments_count'] = pagination.total
     post_data['next_page'] = url_for('api_v1.get_post', id=id, page=page + 1, _external=True) if pagination.has_next else None
@@ -174,7 +210,7 @@ def new_post():
     db.session.add(post)
     db.session.commit()
 
-    response = make_response(jsonify(post.to_json()), 201)
+    response = make_response(jsonify(serialize_post(post)), 201)
     response.headers['Location'] = url_for('api_v1.get_post', id=post.id, _external=True)
 
     return response
@@ -193,7 +229,7 @@ def edit_post(id):
     db.session.add(post)
     db.session.commit()
 
-    return jsonify(post.to_json()), 200
+    return jsonify(serialize_post(post)), 200
 
 
 @api_v1_bp.route('/profile/<username>')
@@ -202,15 +238,7 @@ def get_user_profile(username):
     if user is None:
         return abort(404)
 
-    user_data = user.to_json()
-
-    # Исключение самого себя из подписчиков/подписок
-    following_list = [u for u in user_data['following_list'] if u != user.username]
-    followers_list = [u for u in user_data['followers_list'] if u != user.username]
-    user_data['following_list'] = following_list
-    user_data['followers_list'] = followers_list
-
-    return jsonify(user_data), 200
+    return jsonify(user.to_json()), 200
 
 
 @api_v1_bp.route('/profile/<username>/posts')
@@ -220,26 +248,18 @@ def get_user_posts(username):
     if not user:
         abort(404)
 
-    page = request.args.get('page', 1, type=int)
-    pagination = db.paginate(
-        select(Post).where(Post.author_id == user.id).order_by(Post.timestamp.desc()),
-        page=page,
+    posts, meta = paginate_list(
+        select(Post).where(Post.author_id == user.id),
+        Post.timestamp, Post.id,
         per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False
+        endpoint='api_v1.get_user_posts',
+        count_field='posts_count',
+        username=username
     )
 
-    next_page = url_for('api_v1.get_user_posts', username=username, page=page + 1, _external=True) if pagination.has_next else None
-    prev_page = url_for('api_v1.get_user_posts', username=username, page=page - 1, _external=True) if pagination.has_prev else None
-
     return jsonify({
-        'posts': [
-            post.to_json(include_disabled_comments=g.current_user.can(Permission.ADMINISTER), only_few_comments=True)
-            for post in pagination.items
-        ],
-        'page': f'{page} of {pagination.pages}',
-        'prev_page': prev_page,
-        'next_page': next_page,
-        'posts_count': pagination.total,
+        'posts': posts_to_json(posts),
+        **meta,
     }), 200
 
 
@@ -249,26 +269,78 @@ def get_user_feed(username):
     if not user:
         abort(404)
 
-    page = request.args.get('page', 1, type=int)
-    pagination = db.paginate(
-        user.feed_posts,
-        page=page,
+    stmt, timestamp_col, id_col = user.feed_timeline()
+    posts, meta = paginate_list(
+        stmt,
+        timestamp_col, id_col,
         per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False
+        endpoint='api_v1.get_user_feed',
+        count_field='posts_count',
+        key=lambda post: (post.timestamp, post.id),
+        username=username
     )
 
-    next_page = url_for('api_v1.get_user_posts', username=username, page=page + 1, _external=True) if pagination.has_next else None
-    prev_page = url_for('api_v1.get_user_posts', username=username, page=page - 1, _external=True) if pagination.has_prev else None
+    return jsonify({
+        'posts': posts_to_json(posts),
+        **meta,
+    }), 200
+
+
+def follows_page(username, endpoint, user_attr):
+    """Страница подписчиков или подписок пользователя.
+
+    Из БД читаются только строки подписок текущей страницы и имена пользователей,
+    а не все связанные пользователи целиком.
+
+    Args:
+        username (str): Имя пользователя, чей список запрошен.
+        endpoint (str): Эндпоинт для ссылок на соседние страницы.
+        user_attr (str): 'follower' - подписчики пользователя, 'followed' - его подписки.
+    """
+    user = db.session.scalar(select(User).where(User.username == username))
+    if not user:
+        abort(404)
+
+    if user_attr == 'follower':
+        user_col, other_user, count_field = Follow.follower_id, Follow.followed, 'followers_count'
+        stmt = select(Follow).where(Follow.followed_id == user.id)
+    else:
+        user_col, other_user, count_field = Follow.followed_id, Follow.follower, 'following_count'
+        stmt = select(Follow).where(Follow.follower_id == user.id)
+
+    relationship = getattr(Follow, user_attr)
+    stmt = (stmt.join(relationship)
+            .options(contains_eager(relationship).load_only(User.username), lazyload(other_user)))
+
+    follows, meta = paginate_list(
+        stmt,
+        Follow.timestamp, user_col,
+        per_page=current_app.config['FOLLOWERS_PER_PAGE'],
+        endpoint=endpoint,
+        count_field=count_field,
+        username=username
+    )
+
+    return follows, meta
+
+
+@api_v1_bp.route('/profile/<username>/followers')
+def get_user_followers(username):
+    follows, meta = follows_page(username, 'api_v1.get_user_followers', 'follower')
 
     return jsonify({
-        'posts': [
-            post.to_json(include_disabled_comments=g.current_user.can(Permission.ADMINISTER), only_few_comments=True)
-            for post in pagination.items
-        ],
-        'page': f'{page} of {pagination.pages}',
-        'prev_page': prev_page,
-        'next_page': next_page,
-        'posts_count': pagination.total,
+        'followers': serialize_follows(follows, 'follower'),
+        **meta,
+    }), 200
+
+
+@api_v1_bp.route('/profile/<username>/following')
+def get_user_following(username):
+    follows, meta = follows_page(username, 'api_v1.get_user_following', 'followed')
+
+    return jsonify({
+        'following': serialize_follows(follows, 'followed'),
+        **meta,
     }), 200
 
 
@@ -284,25 +356,20 @@ def get_post_comments(id):
         # Исключаем отключенные комменты для неадминов
         stmt = stmt.where(Comment.disabled.isnot(True))
 
-    stmt = stmt.order_by(Comment.created_at.asc())
-    page = request.args.get('page', 1, type=int)
-    pagination = db.paginate(
+    # Комментарии поста - от старых к новым
+    comments, meta = paginate_list(
         stmt,
-        page=page,
+        Comment.created_at, Comment.id,
         per_page=current_app.config["COMMENTS_PER_PAGE"],
-        error_out=False
+        endpoint='api_v1.get_post_comments',
+        count_field='comments_count',
+        descending=False,
+        id=id
     )
 
-    prev_page = url_for('api_v1.get_comments', page=page - 1, _external=True) if pagination.has_prev else None
-    next_page = url_for('api_v1.get_comments', page=page + 1, _external=True) if pagination.has_next else None
-
     return jsonify({
-        'comments': [comment.to_json() for comment in pagination.items],
-        'next_page': next_page,
-        'page': f'{page} of {pagination.pages}',
-        'prev_page': prev_page,
-        'next_page': next_page,
-        'comments_count': pagination.total
+        'comments': serialize_comments(comments),
+        **meta,
     }), 200
 
 
@@ -340,7 +407,7 @@ def new_post_comment(id):
         current_app.logger.warning(f'Ошибка при создании коммента: {e}')
         abort(500, 'Ошибка БД при создании комментария')
 
-    response = make_response(jsonify(comment.to_json()), 201)
+    response = make_response(jsonify(serialize_comment(comment)), 201)
     response.headers['Location'] = url_for('api_v1.get_comment', id=comment.id, _external=True)
     response.headers['Content-Type'] = 'application/json'
 
@@ -355,26 +422,17 @@ def get_comments():
         # Исключаем отключенные комменты для неадминов
         stmt = stmt.where(Comment.disabled.isnot(True))
 
-    stmt = stmt.order_by(Comment.created_at.desc())
-
-    page = request.args.get('page', 1, type=int)
-    pagination = db.paginate(
+    comments, meta = paginate_list(
         stmt,
-        page=page,
+        Comment.created_at, Comment.id,
         per_page=current_app.config["COMMENTS_PER_PAGE"],
-        error_out=False
+        endpoint='api_v1.get_comments',
+        count_field='comments_count'
     )
 
-    prev_page = url_for('api_v1.get_comments', page=page - 1, _external=True) if pagination.has_prev else None
-    next_page = url_for('api_v1.get_comments', page=page + 1, _external=True) if pagination.has_next else None
-
     return jsonify({
-        'comments': [comment.to_json() for comment in pagination.items],
-        'next_page': next_page,
-        'page': f'{page} of {pagination.pages}',
-        'prev_page': prev_page,
-        'next_page': next_page,
-        'comments_count': pagination.total
+        'comments': serialize_comments(comments),
+        **meta,
     }), 200
 
 
@@ -387,7 +445,7 @@ def get_comment(id):
     if comment.disabled and not g.current_user.can(Permission.ADMINISTER):
         abort(403)
 
-    return jsonify(comment.to_json()), 200
+    return jsonify(serialize_comment(comment)), 200
 
 
 @api_v1_bp.route('comments/<int:id>/delete', methods=['DELETE'])
@@ -0,0 +1,165 @@
+"""
+Пакетная сериализация постов и комментариев для ответов API v1.
+
+Единственное место, где задан JSON-формат постов и комментариев: `Post.to_json()` и
+`Comment.to_json()` вызывают эти же функции для одного объекта. Все связанные данные
+страницы загружаются заранее фиксированным числом запросов, независимо от её размера,
+а не отложенными (lazy) запросами к связям `author`, `post` и `comments` каждого объекта:
+
+    - комментарии постов (превью - одним оконным запросом, см. `Post.load_comment_previews`);
+    - имена авторов всех постов и комментариев - одним запросом;
+    - начала текстов постов для комментариев - одним запросом.
+"""
+
+from flask import url_for
+from sqlalchemy import select
+
+from app.models import Comment, Post, User, db
+
+
+def _load_usernames(user_ids):
+    """Имена пользователей по их id одним запросом."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    return dict(db.session.execute(select(User.id, User.username).where(User.id.in_(user_ids))).all())
+
+
+def _load_post_titles(post_ids, length=40):
+    """Начала текстов постов (первые `length` символов) по их id одним запросом."""
+    post_ids = set(post_ids)
+    if not post_ids:
+        return {}
+    stmt = select(Post.id, db.func.substr(Post.body, 1, length)).where(Post.id.in_(post_ids))
+    return dict(db.session.execute(stmt).all())
+
+
+def _load_comments(post_ids, limit, include_disabled):
+    """Комментарии постов в хронологическом порядке: все (limit=None) или последние `limit`."""
+    if limit is not None:
+        return Post.load_comment_previews(post_ids, limit=limit, include_disabled=include_disabled)
+
+    comments = {post_id: [] for post_id in post_ids}
+    if not comments:
+        return comments
+
+    stmt = select(Comment).where(Comment.post_id.in_(post_ids))
+    if not include_disabled:
+        stmt = stmt.where(Comment.disabled.isnot(True))
+    for comment in db.session.scalars(stmt.order_by(Comment.post_id, Comment.created_at, Comment.id)):
+        comments[comment.post_id].append(comment)
+
+    return comments
+
+
+def _profile_url(usernames, user_id):
+    return url_for('api_v1.get_user_profile', username=usernames[user_id], _external=True)
+
+
+def _comment_json(comment, usernames, post_titles=None):
+    json_comment = {
+        'url': url_for('api_v1.get_comment', id=comment.id, _external=True),
+        'body': comment.body,
+        'created_at': comment.created_at,
+        'author': _profile_url(usernames, comment.author_id)
+    }
+
+    if post_titles is not None:
+        json_comment['post_url'] = url_for('api_v1.get_post', id=comment.post_id, _external=True)
+        json_comment['post'] = post_titles[comment.post_id]
+
+    return json_comment
+
+
+def serialize_comments(comments, include_post_info=True):
+    """Сериализует список комментариев.
+
+    Args:
+        comments (list[Comment]): Комментарии страницы.
+        include_post_info (bool): Добавлять ссылку на пост и начало его текста.
+
+    Returns:
+        list[dict]: Сериализованные комментарии. Выполняется не более двух запросов.
+    """
+    usernames = _load_usernames(comment.author_id for comment in comments)
+    post_titles = _load_post_titles(comment.post_id for comment in comments) if include_post_info else None
+
+    return [_comment_json(comment, usernames, post_titles) for comment in comments]
+
+
+def serialize_posts(posts, include_disabled_comments=False, excerpt=False, comments_limit=None,
+                    with_comments=True):
+    """Сериализует список постов.
+
+    Args:
+        posts (list[Post]): Посты страницы.
+        include_disabled_comments (bool): Включать заблокированные комментарии.
+        excerpt (bool): Отдавать сохранённое превью текста вместо полного текста.
+        comments_limit (int | None): Сколько последних комментариев отдавать на пост
+            (None - все комментарии).
+        with_comments (bool): Загружать комментарии. Если False, поле 'comments' остаётся
+            пустым (например, когда комментарии пагинируются отдельно).
+
+    Returns:
+        list[dict]: Сериализованные посты. Выполняется не более двух запросов.
+    """
+    post_ids = [post.id for post in posts]
+    if with_comments:
+        comments = _load_comments(post_ids, comments_limit, include_disabled_comments)
+    else:
+        comments = {post_id: [] for post_id in post_ids}
+
+    author_ids = {post.author_id for post in posts}
+    author_ids.update(comment.author_id for post_comments in comments.values() for comment in post_comments)
+    usernames = _load_usernames(author_ids)
+
+    serialized = []
+    for post in posts:
+        if excerpt:
+            body, truncated = post.get_excerpt()
+        else:
+            body, truncated = post.body, False
+
+        serialized.append({
+            'url': url_for('api_v1.get_post', id=post.id, _external=True),
+            'body': body,
+            'body_truncated': truncated,
+            'timestamp': post.timestamp,
+            'author': _profile_url(usernames, post.author_id),
+            'comments': [_comment_json(comment, usernames) for comment in comments[post.id]],
+            'comments_count (including disabled)': post.comments_count
+        })
+
+    return serialized
+
+
+def serialize_post(post, **kwargs):
+    """Сериализует один пост (см. `serialize_posts`)."""
+    return serialize_posts([post], **kwargs)[0]
+
+
+def serialize_comment(comment, **kwargs):
+    """Сериализует один комментарий (см. `serialize_comments`)."""
+    return serialize_comments([comment], **kwargs)[0]
+
+
+def serialize_follows(follows, user_attr):
+    """Сериализует страницу подписок.
+
+    Args:
+        follows (list[Follow]): Подписки с заранее загруженными пользователями.
+        user_attr (str): Какого пользователя подписки отдавать: 'follower' или 'followed'.
+
+    Returns:
+        list[dict]: Имя пользователя, ссылка на его профиль и время подписки.
+    """
+    serialized = []
+    for follow in follows:
+        username = getattr(follow, user_attr).username
+        serialized.append({
+            'username': username,
+            'url': url_for('api_v1.get_user_profile', username=username, _external=True),
+            'timestamp': follow.timestamp
+        })
+
+    return serialized
@@ -0,0 +1,248 @@
+"""
+Быстрая аутентификация по токенам API.
+
+Машинные клиенты API передают токен в каждом запросе. Раньше на каждый вызов
+заново проверялась подпись itsdangerous и выполнялся `db.session.get(User, id)`.
+Теперь:
+
+    - проверенный токен кешируется на `API_TOKEN_CACHE_TTL` секунд (но не дольше срока
+      действия самого токена), а пользователь берётся из кеша учётных данных
+      (`app.identity_cache`), поэтому повторные вызовы не обращаются к БД;
+    - токены можно отозвать досрочно (`DELETE /api/v1/token`). Отозванные `jti`
+      хранятся в таблице `revoked_tokens`, а на каждый запрос проверяются по фильтру
+      Блума в памяти. БД запрашивается только при срабатывании фильтра. Отзывы,
+      сделанные другими процессами, подгружаются раз в `API_REVOCATION_REFRESH_INTERVAL`
+      секунд (с перекрытием в `API_REVOCATION_REFRESH_OVERLAP` секунд, см. `_refresh_revoked`);
+    - для каждого токена считается количество запросов и время последнего
+      использования (`GET /api/v1/token/usage`). Счётчики локальны для процесса.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app import identity_cache
+from app.models import RevokedToken, User, db
+
+from . import api_v1_bp
+
+
+class BloomFilter:
+    """Компактное вероятностное множество строк.
+
+    Отвечает «точно нет» или «возможно, да»; доля ложных срабатываний не превышает
+    `error_rate`, пока элементов не больше `capacity`.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # Двойное хеширование: k позиций из двух независимых половин одного дайджеста
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TokenRegistry:
+    """Кеш проверенных токенов, список отзыва и счётчики использования одного приложения."""
+
+    def __init__(self, cache_ttl, cache_size, refresh_interval, bloom_capacity, bloom_error_rate,
+                 refresh_overlap=300):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self.refresh_overlap = timedelta(seconds=refresh_overlap)
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+
+        self._lock = threading.Lock()
+        self._verified = OrderedDict()  # токен -> (годен до, данные токена)
+        self._usage = OrderedDict()     # jti -> {'user_id', 'count', 'last_used'}
+        self._revoked = None            # BloomFilter, загружается при первом запросе
+        self._revoked_watermark = None  # наибольший загруженный revoked_at
+        self._refreshed_at = 0.0
+        # Попадания и промахи кеша проверенных токенов (см. app/metrics.py)
+        self.hits = 0
+        self.misses = 0
+
+    # Кеш проверенных токенов
+
+    def _cached(self, token):
+        with self._lock:
+            entry = self._verified.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            valid_until, data = entry
+            if valid_until < time.monotonic():
+                del self._verified[token]
+                self.misses += 1
+                return None
+            self._verified.move_to_end(token)
+            self.hits += 1
+            return data
+
+    def stats(self):
+        """Размер кеша проверенных токенов, попадания и промахи."""
+        with self._lock:
+            return {'entries': len(self._verified), 'hits': self.hits, 'misses': self.misses}
+
+    def _remember(self, token, data):
+        # Запись в кеше не должна пережить сам токен
+        lifetime = (data['expires_at'] - datetime.now(timezone.utc)).total_seconds()
+        ttl = min(self.cache_ttl, lifetime)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._verified[token] = (time.monotonic() + ttl, data)
+            self._verified.move_to_end(token)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+
+    def _forget(self, jti):
+        with self._lock:
+            for token in [token for token, (_, data) in self._verified.items() if data['jti'] == jti]:
+                del self._verified[token]
+
+    # Список отзыва
+
+    def _refresh_revoked(self):
+        """Подгружает из БД отзывы, появившиеся после предыдущей загрузки.
+
+        `revoked_at` ставится до фиксации транзакции, поэтому отзыв, зафиксированный позже
+        уже загруженных, может иметь более раннее время. Подгрузка начинается с
+        `refresh_overlap` до наибольшего загруженного времени: такие записи читаются
+        повторно (добавление в фильтр идемпотентно), но не пропускаются.
+        """
+        if self._revoked is not None and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+
+        stmt = (select(RevokedToken.jti, RevokedToken.revoked_at)
+                .where(RevokedToken.expires_at >= datetime.now(timezone.utc)))
+        if self._revoked is None:
+            revoked = BloomFilter(self.bloom_capacity, self.bloom_error_rate)
+        else:
+            revoked = self._revoked
+            if self._revoked_watermark is not None:
+                stmt = stmt.where(RevokedToken.revoked_at >= self._revoked_watermark - self.refresh_overlap)
+
+        for jti, revoked_at in db.session.execute(stmt):
+            revoked.add(jti)
+            if self._revoked_watermark is None or revoked_at > self._revoked_watermark:
+                self._revoked_watermark = revoked_at
+
+        self._revoked = revoked
+        self._refreshed_at = time.monotonic()
+
+    def is_revoked(self, jti):
+        if jti is None:
+            # Токены, выданные до появления jti, отозвать нельзя
+            return False
+        self._refresh_revoked()
+        if jti not in self._revoked:
+            return False
+        # Фильтр Блума допускает ложные срабатывания - уточняем по таблице
+        return RevokedToken.is_revoked(jti)
+
+    def revoke(self, data):
+        """Отзывает токен (данные из `User.decode_auth_token`)."""
+        if data['jti'] is None or RevokedToken.is_revoked(data['jti']):
+            return
+        db.session.add(RevokedToken(jti=data['jti'], user_id=data['id'], expires_at=data['expires_at']))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Тот же токен одновременно отозван другим запросом
+            db.session.rollback()
+
+        self._refresh_revoked()
+        self._revoked.add(data['jti'])
+        self._forget(data['jti'])
+
+    # Счётчики использования
+
+    def _count_usage(self, data):
+        if data['jti'] is None:
+            return
+        with self._lock:
+            usage = self._usage.get(data['jti'])
+            if usage is None:
+                usage = self._usage[data['jti']] = {'user_id': data['id'], 'count': 0, 'last_used': None}
+            usage['count'] += 1
+            usage['last_used'] = datetime.now(timezone.utc)
+            self._usage.move_to_end(data['jti'])
+            while len(self._usage) > self.cache_size:
+                self._usage.popitem(last=False)
+
+    def usage(self, jti):
+        with self._lock:
+            usage = self._usage.get(jti)
+            return dict(usage) if usage is not None else None
+
+    # Аутентификация
+
+    def verify(self, token):
+        """Проверяет токен. Возвращает его данные или None, если токен недействителен или отозван."""
+        data = self._cached(token)
+        if data is None:
+            data = User.decode_auth_token(token)
+            if data is None:
+                return None
+            self._remember(token, data)
+
+        if self.is_revoked(data['jti']):
+            self._forget(data['jti'])
+            return None
+
+        return data
+
+    def authenticate(self, token):
+        """Проверяет токен и загружает его пользователя (при тёплых кешах - без запросов к БД).
+
+        Returns:
+            tuple[User | None, dict | None]: Пользователь и данные токена или (None, None).
+        """
+        data = self.verify(token)
+        if data is None:
+            return None, None
+
+        user = identity_cache.load(data['id'])
+        if user is None:
+            return None, None
+        self._count_usage(data)
+        return user, data
+
+
+@api_v1_bp.record_once
+def init_token_registry(state):
+    config = state.app.config
+    state.app.extensions['api_tokens'] = TokenRegistry(
+        cache_ttl=config['API_TOKEN_CACHE_TTL'],
+        cache_size=config['API_TOKEN_CACHE_MAX_SIZE'],
+        refresh_interval=config['API_REVOCATION_REFRESH_INTERVAL'],
+        bloom_capacity=config['API_REVOCATION_BLOOM_CAPACITY'],
+        bloom_error_rate=config['API_REVOCATION_BLOOM_ERROR_RATE'],
+        refresh_overlap=config['API_REVOCATION_REFRESH_OVERLAP'])
+
+
+def token_registry():
+    """Реестр токенов текущего приложения."""
+    return current_app.extensions['api_tokens']
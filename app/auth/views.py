@@ -8,8 +8,7 @@ from sqlalchemy import select
 from app.services.users import create_user
 
 from .. import db
-from ..email import create_and_send_email_async
-from ..models import User
+from ..models import EmailOutbox, User
 from . import auth_bp
 from .forms import LoginForm, RegistrationForm
 
@@ -49,8 +48,9 @@ def before_request():
 
     """
     if current_user.is_authenticated:
-        # Обновляем атрибут last_seen
-        current_user.ping()
+        # Обновляем атрибут last_seen (запись в БД - отложенная, статика не учитывается)
+        if request.endpoint != 'static':
+            current_user.ping()
         if (not current_user.confirmed
             # Загрузка статики без проверки
             and request.endpoint != 'static'
@@ -145,7 +145,8 @@ def register():
                 - Создается новый объект пользователя с введенными данными.
                 - Новый пользователь добавляется в базу данных.
                 - Генерируется токен для подтверждения аккаунта.
-                - Отправляется письмо с подтверждением на указанный email.
+                - Письмо с подтверждением сохраняется в outbox в той же транзакции,
+                  что и пользователь (отправляет его `flask send-outbox`).
                 - Отображается сообщение об успешной отправке письма с подтверждением.
                 - Перенаправление на главную страницу.
 
@@ -162,7 +163,7 @@ def register():
 
     Исключения:
         Нет явных исключений. В случае ошибок с базой данных или отправкой email они могут быть
-        обработаны в других частях приложения (например, в `create_and_send_email_async`).
+        обработаны в других частях приложения (например, в `flask send-outbox`).
 
     Примечания:
         Важно, чтобы пользователь подтвердил свой email для завершения регистрации.
@@ -182,14 +183,15 @@ def register():
             username=form.username.data,
             password=form.password.data
         )
-        db.session.commit()     # Новые пользователь не сохраняется в фабричной функции: только добавляется в сессию
         token = user.generate_confirmation_token()
-        create_and_send_email_async(
+        # Письмо сохраняется в той же транзакции, что и пользователь; отправляет его `flask send-outbox`
+        EmailOutbox.enqueue(
             user.email,
             'Подтверждение аккаунта.',
             'auth/email/confirm',
             user=user,
             token=token)
+        db.session.commit()     # Новые пользователь не сохраняется в фабричной функции: только добавляется в сессию
         flash('Письмо с подтверждением отправлено на почту, сэр!')
         return redirect(url_for('main.index'))
     return render_template('auth/register.html', form=form)
@@ -326,7 +328,8 @@ def resend_confirmation():
         1. Генерация нового токена для подтверждения email:
             - Для текущего пользователя генерируется новый токен подтверждения.
         2. Отправка письма с новым токеном:
-            - Письмо с инструкциями по подтверждению аккаунта отправляется на почтовый ящик пользователя.
+            - Письмо с инструкциями по подтверждению аккаунта сохраняется в outbox,
+              откуда его отправляет `flask send-outbox`.
         3. Показ сообщения о том, что письмо отправлено:
             - После успешной отправки письма пользователю показывается сообщение о том, что письмо отправлено.
 
@@ -345,10 +348,11 @@ def resend_confirmation():
         зарегистрированы для повторной отправки письма.
     """
     token = current_user.generate_confirmation_token()
-    create_and_send_email_async(current_user.email,
-                                'Подтвердите ваш email',
-                                'auth/email/confirm',
-                                user=current_user, token=token)
+    EmailOutbox.enqueue(current_user.email,
+                        'Подтвердите ваш email',
+                        'auth/email/confirm',
+                        user=current_user, token=token)
+    db.session.commit()
     flash('Новое письмо для подтверждения отправлено на почтовый ящик.')
 
     return redirect(url_for('main.index'))
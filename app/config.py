@@ -31,21 +31,63 @@ class Config:
     def MAIL_PORT(self):
         return os.getenv('MAIL_PORT')
 
+    @property
+    def METRICS_TOKEN(self):
+        return os.getenv('METRICS_TOKEN')
+
     FLASK_CONFIG = 'default'
 
     # Устар.
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    DEBUG_TB_ENABLED = True
-    DEBUG_TB_PROFILER_ENABLED = True
-
     # Отключение перехвата редиректов в режиме debug
     DEBUG_TB_INTERCEPT_REDIRECTS = False
 
+    # Записывать в лог неявные (lazy) загрузки связей ORM во время запросов.
+    # Помогает заметить N+1 запросы в представлениях и шаблонах (см. app/lazy_loads.py).
+    SQLALCHEMY_LOG_LAZY_LOADS = os.getenv('SQLALCHEMY_LOG_LAZY_LOADS', 'False') == 'True'
+
+    # Отложенная запись User.last_seen (см. app/last_seen.py): не чаще раза в минуту
+    # на пользователя, пакетами раз в несколько секунд, не больше N пользователей в памяти.
+    LAST_SEEN_MIN_INTERVAL = 60
+    LAST_SEEN_FLUSH_INTERVAL = 5
+    LAST_SEEN_MAX_PENDING = 10000
+
+    # Кеш учётных данных и ролей пользователей между запросами (см. app/identity_cache.py).
+    # Кеш локален для процесса: изменения из других процессов видны не позже, чем через TTL.
+    IDENTITY_CACHE_TTL = 300
+    IDENTITY_CACHE_MAX_SIZE = 10000
+
+    # Токены API (см. app/api/v1/tokens.py): кеш проверенных токенов и список отзыва.
+    # Отзывы из других процессов подгружаются раз в API_REVOCATION_REFRESH_INTERVAL секунд.
+    # Время отзыва ставится до фиксации транзакции, поэтому каждая подгрузка повторно читает
+    # последние API_REVOCATION_REFRESH_OVERLAP секунд: запоздавшие фиксации не теряются.
+    API_TOKEN_CACHE_TTL = 60
+    API_TOKEN_CACHE_MAX_SIZE = 10000
+    API_REVOCATION_REFRESH_INTERVAL = 30
+    API_REVOCATION_REFRESH_OVERLAP = 300
+    API_REVOCATION_BLOOM_CAPACITY = 100000
+    API_REVOCATION_BLOOM_ERROR_RATE = 0.001
+
+    # Хеширование паролей (см. app/passwords.py): алгоритм в формате werkzeug и пул процессов.
+    # При изменении алгоритма пароли перехешируются при следующем входе пользователя.
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    # Сколько задач хеширования может ожидать в пуле одновременно (0 - 4 на процесс пула)
+    PASSWORD_HASH_MAX_PENDING = 0
+
     POSTS_PER_PAGE = 4
     FOLLOWERS_PER_PAGE = 10
     COMMENTS_PER_PAGE = 25
+    # Сколько последних комментариев показывать у каждого поста в списках API
+    COMMENTS_PREVIEW_COUNT = 3
+
+    # Материализованные ленты (fan-out on write).
+    # Посты авторов, у которых подписчиков больше порога, не раскладываются по лентам,
+    # а подмешиваются при чтении. При подписке в ленту добавляются последние посты автора.
+    FEED_FANOUT_MAX_FOLLOWERS = 5000
+    FEED_BACKFILL_POSTS = 100
 
     # При импорте логических переменных важно ЯВНО привести их к логическому
     # типу. Иначе они будут интерпретированы как строка, что в свою очередь
@@ -56,6 +98,80 @@ class Config:
     MAIL_SENDER = os.getenv('MAIL_SENDER')
     ADMIN_EMAIL = os.getenv('ADMIN_EMAIL')
 
+    # Фоновая отправка email (см. app/email_queue.py), в том числе писем из outbox: пул
+    # потоков, каждый со своим SMTP-соединением; повторы с экспоненциальной задержкой
+    # и предохранитель.
+    EMAIL_WORKERS = 2
+    EMAIL_QUEUE_MAX_SIZE = 1000
+    EMAIL_MAX_PER_CONNECTION = 100
+    EMAIL_CONNECTION_IDLE_TIMEOUT = 30
+    EMAIL_MAX_RETRIES = 3
+    EMAIL_RETRY_BACKOFF = 1.0
+    EMAIL_BREAKER_THRESHOLD = 5
+    EMAIL_BREAKER_RESET_TIMEOUT = 60
+
+    # Доставка писем из outbox (`flask send-outbox`, см. app/services/outbox.py):
+    # размер пачки, аренда захваченных писем и повторы.
+    OUTBOX_BATCH_SIZE = 50
+    OUTBOX_LEASE = 300
+    OUTBOX_MAX_ATTEMPTS = 5
+    OUTBOX_RETRY_BACKOFF = 60
+
+    # Дайджесты новых постов из подписок (`flask send-digest`, см. app/services/digest.py)
+    DIGEST_DAYS = 7
+    DIGEST_POSTS_PER_USER = 10
+    DIGEST_CHUNK_SIZE = 1000
+    # Адрес сайта для ссылок в письмах: дайджест формируется вне HTTP-запроса
+    DIGEST_BASE_URL = os.getenv('DIGEST_BASE_URL', 'http://localhost:5000/')
+
+    # Логирование (см. app/logger.py): обработчики из logger.HANDLER_FACTORIES работают
+    # в отдельном потоке, ротация файла по размеру и по времени со сжатием старых файлов.
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_HANDLERS = ('console', 'file', 'sqlite', 'stream')
+    LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_ROTATE_INTERVAL = 24 * 60 * 60
+    LOG_BACKUP_COUNT = 14
+    LOG_COMPRESS = True
+    LOG_QUEUE_SIZE = 10000
+
+    # Хранилище структурированных логов (см. app/log_store.py): отдельная база SQLite,
+    # запись пачками по LOG_STORE_BATCH_SIZE, но не реже раза в LOG_STORE_FLUSH_INTERVAL секунд.
+    # Записи старше LOG_STORE_RETENTION_DAYS удаляет `flask prune-log-store`.
+    LOG_STORE_PATH = os.getenv('LOG_STORE_PATH', 'logs/app.db')
+    LOG_STORE_BATCH_SIZE = 500
+    LOG_STORE_FLUSH_INTERVAL = 2.0
+    LOG_STORE_RETENTION_DAYS = 30
+
+    # Трансляция новых записей на страницу логов (см. app/log_stream.py): буфер записей
+    # на зрителя, сколько последних записей хранить для переподключения, максимум зрителей
+    # и интервал пустых сообщений, поддерживающих соединение, секунд.
+    LOG_STREAM_BUFFER_SIZE = 1000
+    LOG_STREAM_BACKLOG = 1000
+    LOG_STREAM_MAX_CLIENTS = 50
+    LOG_STREAM_HEARTBEAT = 15
+
+    # Страница логов (см. app/log_reader.py): записей на странице и сколько байт файла
+    # просматривать за один запрос при фильтре по уровню
+    LOG_VIEW_PAGE_SIZE = 200
+    LOG_VIEW_MAX_SCAN_BYTES = 4 * 1024 * 1024
+    # На сколько интервалов делится период на графике страницы логов (хранилище логов)
+    LOG_VIEW_BUCKETS = 24
+
+    # Метрики в формате Prometheus (см. app/metrics.py). При нескольких процессах задайте
+    # общий каталог METRICS_DIR: процессы записывают туда снимки метрик не реже раза
+    # в METRICS_FLUSH_INTERVAL секунд, `/metrics` их складывает.
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 5
+
+    # Трассировка SQL (см. app/sql_trace.py): запросы дольше порога (секунд) пишутся в лог
+    # с планом выполнения; сводка запросов - на странице /admin/sql.
+    SQL_TRACE_ENABLED = os.getenv('SQL_TRACE_ENABLED', 'True') == 'True'
+    SQL_SLOW_QUERY_THRESHOLD = float(os.getenv('SQL_SLOW_QUERY_THRESHOLD', '0.1'))
+    SQL_EXPLAIN_TTL = 600
+    SQL_TRACE_MAX_STATEMENTS = 1000
+    SQL_TRACE_PAGE_SIZE = 50
+
     @staticmethod
     def init_app(app):
         pass
@@ -63,6 +179,9 @@ class Config:
 
 class DevelopmentConfig(Config):
     DEBUG = True
+    # Панель отладки и профилировщик замедляют каждый запрос - только при разработке
+    DEBUG_TB_ENABLED = True
+    DEBUG_TB_PROFILER_ENABLED = True
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{basedir / "instance/data.sqlite"}'
 
 
@@ -70,6 +189,13 @@ class TestingConfig(Config):
     TESTING = True
     # SQLALCHEMY_DATABASE_URI = f'sqlite:///{basedir / "instance/data-test.sqlite"}'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # Фиксированный ключ: токены, курсоры и сессии подписываются без переменной окружения
+    SECRET_KEY = 'testing-secret-key'
+    # Тесты создают пользователей десятками: без пула процессов и с дешёвым алгоритмом
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    # Тесты не пишут в файл логов приложения
+    LOG_HANDLERS = ('console',)
 
 
 config = {
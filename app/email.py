@@ -1,10 +1,8 @@
 
-from threading import Thread
-
 from flask import current_app, render_template
 from flask_mail import Message
 
-from . import mail
+from . import email_queue, mail
 
 
 def send_email(app, msg):
@@ -37,11 +35,12 @@ def send_email(app, msg):
 
 def create_and_send_email_async(to, subject, template, **kwargs):
     """
-    Создает и отправляет email-сообщение в фоновом потоке.
+    Создает email-сообщение и ставит его в очередь фоновой отправки.
 
     Эта функция создает объект email-сообщения с использованием заданных данных,
     таких как получатель, тема, отправитель и шаблон для рендеринга тела письма.
-    Письмо отправляется асинхронно в фоновом потоке, чтобы не блокировать основной процесс.
+    Письмо отправляется асинхронно ограниченным пулом рабочих потоков, которые
+    переиспользуют SMTP-соединения (см. `app/email_queue.py`).
 
     Аргументы:
         - to (str): Адрес получателя письма.
@@ -50,11 +49,12 @@ def create_and_send_email_async(to, subject, template, **kwargs):
         - kwargs (dict): Дополнительные параметры для рендеринга шаблона.
 
     Возвращает:
-        - threading.Thread: Поток, в котором выполняется асинхронная отправка письма.
+        - bool: True, если письмо поставлено в очередь; False, если очередь заполнена.
 
     Примечания:
         - Функция использует настройки приложения для получения префикса темы и отправителя.
-        - Отправка письма выполняется в отдельном потоке для повышения производительности.
+        - Повторы при временных ошибках SMTP и предохранитель при недоступности сервера
+          реализованы в очереди.
     """
 
     app = current_app._get_current_object()
@@ -68,8 +68,5 @@ def create_and_send_email_async(to, subject, template, **kwargs):
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
 
-    # Запускаем отправку email в фоновом потоке
-    thr = Thread(target=send_email, args=[app, msg])
-    thr.start()
-
-    return thr
+    # Ставим письмо в очередь фоновой отправки
+    return email_queue.submit(msg)
@@ -0,0 +1,325 @@
+"""
+Очередь отправки email с ограниченным пулом потоков.
+
+Раньше на каждое письмо запускался отдельный поток, открывавший новое SMTP-соединение,
+поэтому всплеск регистраций порождал сотни потоков и соединений. Теперь письма
+складываются в ограниченную очередь (`EMAIL_QUEUE_MAX_SIZE`), а отправляют их
+`EMAIL_WORKERS` фоновых потоков. Каждый поток держит одно SMTP-соединение
+(`mail.connect()`) и отправляет через него до `EMAIL_MAX_PER_CONNECTION` писем подряд;
+простаивающее дольше `EMAIL_CONNECTION_IDLE_TIMEOUT` секунд соединение закрывается.
+
+Ошибки:
+    - временные ошибки (обрыв соединения, отказ сервера) повторяются до
+      `EMAIL_MAX_RETRIES` раз с экспоненциальной задержкой от `EMAIL_RETRY_BACKOFF` секунд;
+    - после `EMAIL_BREAKER_THRESHOLD` ошибок подряд размыкается предохранитель (circuit
+      breaker): попытки отправки приостанавливаются на `EMAIL_BREAKER_RESET_TIMEOUT`
+      секунд, письма ждут в очереди. Затем одно пробное письмо проверяет, поднялся ли сервер;
+    - если очередь заполнена, новое письмо отбрасывается с записью в лог.
+
+Через эту же очередь отправляются письма из outbox (см. app/services/outbox.py): для них
+в `submit()` передаётся `Future`, куда записывается результат единственной попытки, а
+повторы планирует сам outbox. Пока предохранитель разомкнут, такие письма не ждут в
+очереди - `Future` сразу получает `CircuitOpenError`.
+
+Текущее состояние очереди возвращает `email_queue.stats()`. При завершении процесса
+оставшиеся в очереди письма отправляются (atexit).
+
+Пример использования:
+    email_queue = EmailQueue()
+    email_queue.init_app(app)
+
+    email_queue.submit(msg)  # False, если очередь заполнена
+"""
+
+import atexit
+import queue
+import smtplib
+import threading
+import time
+
+from flask import current_app
+
+# Ошибки, которые не исправятся при повторе того же письма
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+
+class CircuitOpenError(Exception):
+    """Письмо не отправлялось: предохранитель разомкнут."""
+
+
+class CircuitBreaker:
+    """Предохранитель: размыкается после серии ошибок подряд.
+
+    Состояния: 'closed' - попытки разрешены; 'open' - запрещены до истечения
+    `reset_timeout`; 'half_open' - разрешена одна пробная попытка.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Можно ли выполнить попытку сейчас."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            return False
+
+    def retry_after(self):
+        """Через сколько секунд имеет смысл снова вызвать `allow()`."""
+        with self._lock:
+            if self.state != 'open':
+                return 0
+            return max(0, self.reset_timeout - (self.clock() - self.opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = self.clock()
+
+
+class EmailWorkerPool:
+    """Очередь писем одного приложения и её рабочие потоки."""
+
+    def __init__(self, app, workers, max_size, max_per_connection, idle_timeout,
+                 max_retries, retry_backoff, breaker_threshold, breaker_reset_timeout):
+        self.app = app
+        self.workers = workers
+        self.max_per_connection = max_per_connection
+        self.idle_timeout = idle_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._counters = {'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0, 'connections': 0, 'in_flight': 0}
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self._counters[name] += delta
+
+    def submit(self, msg, future=None):
+        """Ставит письмо в очередь. Возвращает False, если очередь заполнена.
+
+        Если передан `future` (`concurrent.futures.Future`), письмо отправляется одной
+        попыткой, а её результат записывается в `future`: None или исключение.
+        """
+        try:
+            self._queue.put_nowait((msg, future))
+        except queue.Full:
+            self._count('dropped')
+            self.app.logger.error(f'Очередь email заполнена ({self._queue.maxsize}), '
+                                  f'письмо для {msg.recipients} не отправлено')
+            return False
+
+        self._ensure_started()
+        return True
+
+    def stats(self):
+        """Метрики очереди: глубина, письма в обработке, счётчики и состояние предохранителя."""
+        with self._lock:
+            return {'queued': self._queue.qsize(), **self._counters, 'breaker': self.breaker.state}
+
+    def join(self):
+        """Ждёт, пока все поставленные в очередь письма будут обработаны."""
+        self._queue.join()
+
+    def stop(self, timeout=30):
+        """Отправляет оставшиеся письма и останавливает рабочие потоки."""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
+
+    def _ensure_started(self):
+        if self._threads or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._threads = [threading.Thread(target=self._run, name=f'email-worker-{i}', daemon=True)
+                             for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        with self.app.app_context():
+            worker = _Worker(self)
+            try:
+                worker.run()
+            finally:
+                worker.close()
+
+
+class _Worker:
+    """Рабочий поток: одно SMTP-соединение на серию писем."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection = None
+        self.sent_on_connection = 0
+        self.last_used = 0.0
+
+    def run(self):
+        pool = self.pool
+        while True:
+            try:
+                msg, future = pool._queue.get(timeout=min(pool.idle_timeout, 1))
+            except queue.Empty:
+                if pool._stopped.is_set():
+                    return
+                self._close_if_idle()
+                continue
+
+            pool._count('in_flight')
+            try:
+                if future is None:
+                    self.deliver(msg)
+                else:
+                    self.deliver_once(msg, future)
+            finally:
+                pool._count('in_flight', -1)
+                pool._queue.task_done()
+
+    def deliver(self, msg):
+        pool = self.pool
+        attempt = 0
+        while True:
+            # Пока предохранитель разомкнут, письмо ждёт, а попытки не расходуются
+            while not pool.breaker.allow():
+                time.sleep(min(pool.breaker.retry_after() or 0.1, 1))
+
+            error = self.attempt(msg)
+            if error is None:
+                pool._count('sent')
+                return
+            if isinstance(error, PERMANENT_ERRORS):
+                pool._count('failed')
+                pool.app.logger.error(f'Письмо для {msg.recipients} отклонено сервером: {error}')
+                return
+
+            attempt += 1
+            if attempt > pool.max_retries:
+                pool._count('failed')
+                pool.app.logger.error(f'Error sending email: {error} (письмо для {msg.recipients}, '
+                                      f'попыток: {attempt})')
+                return
+            pool._count('retried')
+            time.sleep(pool.retry_backoff * 2 ** (attempt - 1))
+
+    def deliver_once(self, msg, future):
+        """Одна попытка отправки; результат записывается в `future`."""
+        pool = self.pool
+        if not future.set_running_or_notify_cancel():
+            return  # вызывающий код больше не ждёт письмо
+        if not pool.breaker.allow():
+            future.set_exception(CircuitOpenError('Отправка email приостановлена предохранителем'))
+            return
+
+        error = self.attempt(msg)
+        if error is None:
+            pool._count('sent')
+            future.set_result(None)
+        else:
+            pool._count('failed')
+            future.set_exception(error)
+
+    def attempt(self, msg):
+        """Отправляет письмо и сообщает результат предохранителю. Возвращает ошибку или None."""
+        breaker = self.pool.breaker
+        try:
+            self.send(msg)
+        except PERMANENT_ERRORS as e:
+            breaker.record_success()  # сервер доступен, отказано конкретному письму
+            return e
+        except Exception as e:
+            self.close()
+            breaker.record_failure()
+            return e
+        breaker.record_success()
+        return None
+
+    def send(self, msg):
+        from . import mail
+
+        if self.connection is None:
+            self.connection = mail.connect()
+            self.connection.__enter__()
+            self.sent_on_connection = 0
+            self.pool._count('connections')
+
+        self.connection.send(msg)
+        self.sent_on_connection += 1
+        self.last_used = time.monotonic()
+
+        if self.sent_on_connection >= self.pool.max_per_connection:
+            self.close()
+
+    def _close_if_idle(self):
+        if self.connection is not None and time.monotonic() - self.last_used >= self.pool.idle_timeout:
+            self.close()
+
+    def close(self):
+        connection, self.connection = self.connection, None
+        if connection is None or connection.host is None:
+            return
+        try:
+            connection.host.quit()
+        except Exception:
+            # Соединение уже разорвано - достаточно закрыть сокет
+            connection.host.close()
+
+
+class EmailQueue:
+    """Расширение Flask для фоновой отправки email.
+
+    Состояние хранится отдельно для каждого приложения в `app.extensions['email_queue']`.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['email_queue'] = EmailWorkerPool(
+            app,
+            workers=app.config['EMAIL_WORKERS'],
+            max_size=app.config['EMAIL_QUEUE_MAX_SIZE'],
+            max_per_connection=app.config['EMAIL_MAX_PER_CONNECTION'],
+            idle_timeout=app.config['EMAIL_CONNECTION_IDLE_TIMEOUT'],
+            max_retries=app.config['EMAIL_MAX_RETRIES'],
+            retry_backoff=app.config['EMAIL_RETRY_BACKOFF'],
+            breaker_threshold=app.config['EMAIL_BREAKER_THRESHOLD'],
+            breaker_reset_timeout=app.config['EMAIL_BREAKER_RESET_TIMEOUT'])
+
+    @property
+    def pool(self):
+        """Очередь текущего приложения."""
+        return current_app.extensions['email_queue']
+
+    def submit(self, msg, future=None):
+        return self.pool.submit(msg, future)
+
+    def stats(self):
+        return self.pool.stats()
@@ -2,14 +2,21 @@
 Молуль для создания кастомных фильтров Jinja.
 """
 
+from datetime import datetime
+
 
 def log_class(log):
     """Определяет CSS-класс для строки лога."""
     log = log.upper()  # Делаем регистр одинаковым
-    if "ERROR" in log:
+    if "ERROR" in log or "CRITICAL" in log:
         return "log-error"
     elif "WARNING" in log:
         return "log-warning"
     elif "INFO" in log:
         return "log-info"
     return ""
+
+
+def log_time(created):
+    """Форматирует время записи лога (секунды от эпохи) как в текстовом логе."""
+    return datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,193 @@
+"""
+Кеш учётных данных пользователей между запросами.
+
+На каждый запрос Flask-Login вызывает `load_user`, а первая проверка прав (`can()`)
+загружает роль пользователя. Кеш хранит неизменяемые поля аутентификации
+(`AUTH_FIELDS`) и роль с битовой маской разрешений. Из них собирается отсоединённый
+(detached) объект `User`, который присоединяется к сессии запроса через
+`session.merge(..., load=False)` без обращения к БД. Остальные поля пользователя
+помечены устаревшими и загружаются одним запросом при первом обращении к ним.
+
+Записи живут не дольше `IDENTITY_CACHE_TTL` секунд. Кеш локален для процесса, поэтому
+изменения, сделанные в другом процессе, видны после истечения TTL. Изменения в этом
+процессе сбрасывают запись сразу:
+    - при изменении кешируемых полей пользователя (события ORM);
+    - при изменении ролей (`Role.insert_roles()`, события ORM);
+    - явно через `identity_cache.invalidate(user_id)` / `identity_cache.clear()`.
+
+Пример использования:
+    identity_cache = IdentityCache()
+    identity_cache.init_app(app)
+
+    user = identity_cache.load(user_id)  # User в текущей сессии или None
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import select
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+# Поля пользователя, нужные для аутентификации и проверки прав на каждой странице
+AUTH_FIELDS = ('id', 'email', 'username', 'confirmed', 'role_id', 'last_seen')
+ROLE_FIELDS = ('id', 'name', 'permissions', 'default')
+
+
+def _detached(model, values):
+    """Собирает отсоединённый объект модели из значений колонок, не выполняя __init__."""
+    instance = model.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(instance, key, value)
+    return instance
+
+
+class CachedIdentities:
+    """Кеш учётных данных одного приложения: user_id -> (срок годности, отсоединённый User)."""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Попадания и промахи (см. app/metrics.py)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return user
+
+    def peek(self, user_id):
+        """Запись без учёта в попаданиях и промахах и без изменения порядка вытеснения."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def put(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Размер кеша, попадания и промахи."""
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class IdentityCache:
+    """Расширение Flask: кеш пользователей для `load_user`.
+
+    Состояние хранится отдельно для каждого приложения в `app.extensions['identity_cache']`.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['identity_cache'] = CachedIdentities(
+            ttl=app.config['IDENTITY_CACHE_TTL'],
+            max_size=app.config['IDENTITY_CACHE_MAX_SIZE'])
+
+    @property
+    def entries(self):
+        """Кеш текущего приложения (None вне контекста приложения)."""
+        if not has_app_context():
+            return None
+        return current_app.extensions.get('identity_cache')
+
+    def load(self, user_id):
+        """Возвращает пользователя, присоединённого к текущей сессии, или None.
+
+        При тёплом кеше запросов к БД не выполняется.
+        """
+        from . import db
+        from .models import User
+
+        # Объект уже есть в сессии (например, загружен ранее в этом запросе)
+        user = db.session.identity_map.get(db.inspect(User).identity_key_from_primary_key((user_id,)))
+        if user is not None:
+            return user
+
+        entries = self.entries
+        cached = entries.get(user_id) if entries is not None and entries.ttl > 0 else None
+        if cached is None:
+            cached = self._fetch(user_id)
+            if cached is None:
+                return None
+            if entries is not None and entries.ttl > 0:
+                entries.put(user_id, cached)
+
+        return db.session.merge(cached, load=False)
+
+    def _fetch(self, user_id):
+        """Читает поля аутентификации и роль одним запросом и собирает отсоединённый User."""
+        from . import db
+        from .models import Role, User
+
+        columns = [getattr(User, field) for field in AUTH_FIELDS]
+        role_columns = [getattr(Role, field) for field in ROLE_FIELDS]
+        row = db.session.execute(
+            select(*columns, *role_columns)
+            .outerjoin(User.role)
+            .where(User.id == user_id)).one_or_none()
+        if row is None:
+            return None
+
+        user = _detached(User, dict(zip(AUTH_FIELDS, row[:len(AUTH_FIELDS)])))
+        role_values = dict(zip(ROLE_FIELDS, row[len(AUTH_FIELDS):]))
+        role = None
+        if role_values['id'] is not None:
+            role = _detached(Role, role_values)
+            make_transient_to_detached(role)
+        set_committed_value(user, 'role', role)
+        make_transient_to_detached(user)
+
+        return user
+
+    def update_last_seen(self, user_id, last_seen):
+        """Обновляет время посещения в кешированной записи (см. `User.ping()`)."""
+        entries = self.entries
+        # Служебное обновление, а не обращение к кешу: статистика попаданий не меняется
+        cached = entries.peek(user_id) if entries is not None else None
+        if cached is not None:
+            set_committed_value(cached, 'last_seen', last_seen)
+
+    def invalidate(self, user_id):
+        entries = self.entries
+        if entries is not None:
+            entries.invalidate(user_id)
+
+    def clear(self):
+        entries = self.entries
+        if entries is not None:
+            entries.clear()
@@ -0,0 +1,164 @@
+"""
+Отложенная запись времени последнего посещения пользователей (write-behind).
+
+Раньше `User.ping()` выполнял UPDATE и COMMIT на каждый запрос аутентифицированного
+пользователя, а в SQLite каждая такая транзакция блокирует всех остальных писателей.
+Теперь время посещения запоминается в памяти процесса, а фоновый поток раз в
+`LAST_SEEN_FLUSH_INTERVAL` секунд записывает все накопленные значения одним пакетным
+UPDATE. Оставшиеся значения записываются и при завершении процесса (atexit).
+
+Ограничения:
+    - для одного пользователя значение в БД обновляется не чаще, чем раз в
+      `LAST_SEEN_MIN_INTERVAL` секунд;
+    - в буфере хранится не более `LAST_SEEN_MAX_PENDING` пользователей. Если буфер
+      заполнен, поток записи будится немедленно, а отметки новых пользователей
+      до записи отбрасываются (last_seen - не критичные данные).
+
+Пример использования:
+    last_seen_buffer = LastSeenBuffer()
+    last_seen_buffer.init_app(app)
+
+    # В обработчике запроса
+    last_seen_buffer.touch(user.id, user.last_seen)
+"""
+
+import atexit
+import threading
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import bindparam, update
+
+
+class PendingLastSeen:
+    """Буфер отметок одного приложения и его фоновый поток записи."""
+
+    def __init__(self, app, min_interval, flush_interval, max_pending):
+        self.app = app
+        self.min_interval = timedelta(seconds=min_interval)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = {}  # user_id -> last_seen
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def touch(self, user_id, last_seen=None, now=None):
+        """Запоминает посещение пользователя.
+
+        Args:
+            user_id (int): id пользователя.
+            last_seen (datetime | None): Время последнего посещения, известное из БД.
+                Если с него прошло меньше минимального интервала, отметка не нужна.
+            now (datetime | None): Время посещения (по умолчанию - текущее время UTC).
+
+        Returns:
+            datetime | None: Записанное в буфер время или None, если отметка пропущена.
+        """
+        now = now or datetime.now(timezone.utc)
+        if last_seen is not None:
+            if last_seen.tzinfo is None:
+                # SQLite возвращает время без часового пояса, в БД хранится UTC
+                last_seen = last_seen.replace(tzinfo=timezone.utc)
+            if now - last_seen < self.min_interval:
+                return None
+
+        with self._lock:
+            if user_id not in self._pending and len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                self._wakeup.set()
+                return None
+            self._pending[user_id] = now
+
+        self._ensure_started()
+        return now
+
+    def flush(self):
+        """Записывает накопленные отметки одним пакетным UPDATE.
+
+        Returns:
+            int: Количество обновлённых пользователей.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        from . import db
+        from .models import User
+
+        users = User.__table__
+        stmt = (update(users)
+                .where(users.c.id == bindparam('user_id'))
+                .values(last_seen=bindparam('seen_at')))
+        params = [{'user_id': user_id, 'seen_at': seen_at} for user_id, seen_at in pending.items()]
+
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(stmt, params)
+        except Exception:
+            self.app.logger.exception(f'Не удалось записать last_seen для {len(params)} пользователей')
+            return 0
+
+        return len(params)
+
+    def stop(self):
+        """Останавливает поток записи и записывает оставшиеся отметки."""
+        self._stopped.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='last-seen-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+class LastSeenBuffer:
+    """Расширение Flask для отложенной записи `User.last_seen`.
+
+    Состояние хранится отдельно для каждого приложения в `app.extensions['last_seen_buffer']`.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['last_seen_buffer'] = PendingLastSeen(
+            app,
+            min_interval=app.config['LAST_SEEN_MIN_INTERVAL'],
+            flush_interval=app.config['LAST_SEEN_FLUSH_INTERVAL'],
+            max_pending=app.config['LAST_SEEN_MAX_PENDING'])
+
+    @property
+    def pending(self):
+        """Буфер текущего приложения."""
+        return current_app.extensions['last_seen_buffer']
+
+    def touch(self, user_id, last_seen=None):
+        return self.pending.touch(user_id, last_seen)
+
+    def flush(self):
+        return self.pending.flush()
@@ -0,0 +1,53 @@
+"""
+Журналирование неявных (lazy) загрузок связей ORM во время обработки запросов.
+
+Стратегия загрузки связанных объектов задаётся в каждом представлении явно
+(`selectinload`, `joinedload`, `load_only`). Если шаблон или код обращается к связи,
+которую представление не загрузило заранее, SQLAlchemy выполняет отдельный запрос
+на каждый объект (проблема N+1). Включённая настройка `SQLALCHEMY_LOG_LAZY_LOADS`
+записывает каждый такой запрос в лог с указанием эндпоинта, чтобы регрессии были
+видны сразу.
+
+Пример использования:
+    app.config['SQLALCHEMY_LOG_LAZY_LOADS'] = True
+    setup_lazy_load_logging(app)
+"""
+
+from flask import Flask, current_app, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+def log_lazy_load(orm_execute_state):
+    """Обработчик события `do_orm_execute`: пишет в лог неявную загрузку связи."""
+    # lazy_loaded_from определён только для SELECT: у UPDATE/DELETE нет параметров загрузки
+    if not orm_execute_state.is_select or not has_request_context():
+        return
+    state = orm_execute_state.lazy_loaded_from
+    if state is None:
+        return
+    if not current_app.config.get('SQLALCHEMY_LOG_LAZY_LOADS'):
+        return
+
+    target = orm_execute_state.bind_mapper.class_.__name__ if orm_execute_state.bind_mapper else '?'
+    current_app.logger.warning(
+        f'Неявная загрузка связи {state.class_.__name__}{list(state.identity or [])} -> {target} '
+        f'в {request.method} {request.path} (эндпоинт {request.endpoint}). '
+        f'Добавьте selectinload/joinedload в запрос представления.')
+
+
+def setup_lazy_load_logging(app: Flask):
+    """Подключает журналирование неявных загрузок, если оно включено в конфигурации.
+
+    Обработчик регистрируется один раз на класс Session и проверяет настройку
+    приложения при каждом запросе к БД, поэтому приложения с выключенной настройкой
+    не затрагиваются.
+
+    Args:
+        app (Flask): Flask-приложение.
+    """
+    if not app.config.get('SQLALCHEMY_LOG_LAZY_LOADS'):
+        return
+
+    if not event.contains(Session, 'do_orm_execute', log_lazy_load):
+        event.listen(Session, 'do_orm_execute', log_lazy_load)
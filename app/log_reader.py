@@ -0,0 +1,110 @@
+"""
+Постраничное чтение лог-файла с конца.
+
+Страница логов раньше читала весь файл (`readlines()`), и каждый просмотр становился
+тем медленнее, чем больше файл. Теперь файл читается с конца блоками по `block_size`
+байт, пока не наберётся страница записей, поэтому время и память не зависят от размера
+файла. Многострочные записи (например, трейсбеки) объединяются со своей первой строкой.
+
+Постраничная навигация - по смещению в байтах: `before` - начало самой старой записи
+текущей страницы, следующая страница читается до него. Фильтр по уровню применяется
+при чтении; чтобы редкий уровень не заставлял читать весь файл, за один раз
+просматривается не больше `max_scan_bytes` байт (страница может оказаться неполной,
+но ссылка на следующую страницу остаётся).
+
+Пример использования:
+    page = read_log_page('logs/app.log', before=None, limit=100, level='ERROR')
+    for entry in page.entries:
+        print(entry.level, entry.text)
+    page.next_before  # смещение для ссылки «Старее» или None
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Первая строка записи в формате `setup_logger`: "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+RECORD_HEADER = re.compile(rb'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3} - .*? - ([A-Z]+) - ')
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
+
+@dataclass
+class LogEntry:
+    offset: int           # смещение первой строки записи в файле
+    level: Optional[str]  # None - строки без заголовка в начале файла
+    text: str
+
+
+@dataclass
+class LogPage:
+    entries: list = field(default_factory=list)  # от новых к старым
+    next_before: Optional[int] = None            # None - дальше записей нет
+    size: int = 0                                # размер файла на момент чтения
+
+
+def _iter_lines_backwards(f, end, block_size):
+    """Возвращает пары (смещение, строка в байтах) от `end` к началу файла."""
+    position = end
+    tail = b''
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        lines = (f.read(size) + tail).split(b'\n')
+        # Первая строка блока может быть продолжением строки из предыдущего блока
+        tail = lines.pop(0)
+        offset = position + len(tail) + 1
+        offsets = []
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line) + 1
+        yield from zip(reversed(offsets), reversed(lines))
+    yield 0, tail
+
+
+def read_log_page(path, before=None, limit=100, level=None, block_size=64 * 1024, max_scan_bytes=4 * 1024 * 1024):
+    """Читает страницу записей лога, начиная с самых новых.
+
+    Args:
+        path (str): Путь к лог-файлу.
+        before (int | None): Читать записи, начинающиеся до этого смещения (None - с конца файла).
+        limit (int): Максимум записей на странице.
+        level (str | None): Показывать только записи этого уровня.
+        block_size (int): Размер блока чтения, байт.
+        max_scan_bytes (int): Сколько байт просмотреть за один вызов, не больше.
+
+    Returns:
+        LogPage: Записи страницы и смещение для следующей.
+
+    Raises:
+        FileNotFoundError: Если лог-файл не существует.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if before is None else max(0, min(before, size))
+        page = LogPage(size=size)
+
+        boundary = end      # начало самой старой полностью обработанной записи
+        continuation = []   # строки продолжения, ещё не привязанные к заголовку
+        for offset, line in _iter_lines_backwards(f, end, block_size):
+            if not line and not continuation:
+                continue  # пустые строки между записями и перевод строки в конце файла
+            match = RECORD_HEADER.match(line)
+            if match is None and offset > 0:
+                continuation.append(line)
+                continue
+
+            record_level = match.group(1).decode() if match else None
+            text = b'\n'.join([line, *reversed(continuation)]).decode('utf-8', errors='replace')
+            continuation = []
+            boundary = offset
+            if level is None or record_level == level:
+                page.entries.append(LogEntry(offset, record_level, text.rstrip()))
+
+            if len(page.entries) >= limit or end - boundary >= max_scan_bytes:
+                page.next_before = boundary if boundary > 0 else None
+                break
+
+        return page
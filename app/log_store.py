@@ -0,0 +1,216 @@
+"""
+Хранилище структурированных логов в отдельной базе SQLite.
+
+Текстовый лог удобно читать, но искать в нём (например, предупреждения одного
+endpoint за последний час) можно только просмотром всего файла. Обработчик
+`SQLiteLogHandler` (`'sqlite'` в `LOG_HANDLERS`) записывает каждую запись отдельными
+полями - время, уровень, логгер, id запроса, endpoint, id пользователя, сообщение -
+в таблицу с индексами по времени, уровню, endpoint, запросу и пользователю.
+
+Запись идёт пачками: обработчик работает в потоке записи логов (см. app/logger.py),
+накапливает до `batch_size` записей и записывает их одной транзакцией, а
+недобранную пачку дописывает не позже чем через `flush_interval` секунд.
+База - отдельный файл в режиме WAL: чтение страницы логов не блокирует запись,
+а запись логов не конкурирует с основной базой приложения.
+
+Пример использования:
+    store = LogStore('logs/app.db')
+    store.query(level='WARNING', endpoint='main.index', since=time.time() - 3600)
+    store.level_counts(since=time.time() - 3600)
+    store.histogram(bucket=300, since=time.time() - 3600, until=time.time())
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    level INTEGER NOT NULL,
+    level_name TEXT NOT NULL,
+    logger TEXT NOT NULL,
+    request_id TEXT,
+    endpoint TEXT,
+    user_id INTEGER,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_logs_created ON logs (created);
+CREATE INDEX IF NOT EXISTS ix_logs_level_created ON logs (level_name, created);
+CREATE INDEX IF NOT EXISTS ix_logs_endpoint_created ON logs (endpoint, created);
+CREATE INDEX IF NOT EXISTS ix_logs_user_created ON logs (user_id, created);
+CREATE INDEX IF NOT EXISTS ix_logs_request_id ON logs (request_id);
+"""
+
+COLUMNS = ('created', 'level', 'level_name', 'logger', 'request_id', 'endpoint', 'user_id', 'message')
+
+
+class LogStore:
+    """База структурированных логов: пакетная запись и запросы с фильтрами.
+
+    Запись идёт через одно соединение под блокировкой, чтение - через отдельное
+    соединение на каждый запрос (в режиме WAL читатели не ждут писателя).
+    """
+
+    def __init__(self, path, busy_timeout=5):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._writer = None
+        self._write_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self.connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def write(self, rows):
+        """Записывает пачку записей (кортежи в порядке `COLUMNS`) одной транзакцией."""
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.connect()
+                # Логи можно потерять при сбое питания, но не при падении процесса
+                self._writer.execute('PRAGMA synchronous=NORMAL')
+            with self._writer:
+                self._writer.executemany(
+                    f'INSERT INTO logs ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})', rows)
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    @staticmethod
+    def _where(level=None, endpoint=None, request_id=None, user_id=None, search=None, since=None, until=None):
+        conditions, params = [], []
+        for column, value in (('level_name', level), ('endpoint', endpoint),
+                              ('request_id', request_id), ('user_id', user_id)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('created >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('created < ?')
+            params.append(until)
+        if search:
+            conditions.append("message LIKE ? ESCAPE '\\'")
+            params.append('%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def query(self, before_id=None, limit=100, **filters):
+        """Записи, подходящие под фильтры, от новых к старым.
+
+        Args:
+            before_id (int | None): Вернуть записи с id меньше этого (следующая страница).
+            limit (int): Максимум записей.
+            **filters: level, endpoint, request_id, user_id, search (подстрока сообщения),
+                since и until (время, секунды от эпохи).
+
+        Returns:
+            list[dict]: Записи с полями id и `COLUMNS`.
+        """
+        where, params = self._where(**filters)
+        if before_id is not None:
+            where = (where + ' AND' if where else 'WHERE') + ' id < ?'
+            params.append(before_id)
+        with closing(self.connect()) as connection:
+            rows = connection.execute(f'SELECT * FROM logs {where} ORDER BY id DESC LIMIT ?', [*params, limit])
+            return [dict(row) for row in rows]
+
+    def level_counts(self, **filters):
+        """Количество записей по уровням: {'INFO': n, ...}."""
+        where, params = self._where(**filters)
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                f'SELECT level_name, count(*) FROM logs {where} GROUP BY level_name ORDER BY min(level)', params)
+            return dict(rows.fetchall())
+
+    def histogram(self, bucket, **filters):
+        """Количество записей по интервалам времени шириной `bucket` секунд и по уровням.
+
+        Если заданы since и until, пустые интервалы между ними тоже попадают в результат.
+
+        Returns:
+            list[dict]: {'start': начало интервала, 'counts': {уровень: n}, 'total': n}
+                в порядке времени.
+        """
+        where, params = self._where(**filters)
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                f'SELECT CAST(created / ? AS INTEGER) * ? AS start, level_name, count(*) '
+                f'FROM logs {where} GROUP BY start, level_name', [bucket, bucket, *params]).fetchall()
+
+        buckets = {}
+        since, until = filters.get('since'), filters.get('until')
+        if since is not None and until is not None:
+            for start in range(int(since // bucket) * bucket, int(until), bucket):
+                buckets[start] = {'start': start, 'counts': {}, 'total': 0}
+        for start, level_name, count in rows:
+            item = buckets.setdefault(start, {'start': start, 'counts': {}, 'total': 0})
+            item['counts'][level_name] = count
+            item['total'] += count
+        return [buckets[start] for start in sorted(buckets)]
+
+    def prune(self, before):
+        """Удаляет записи старше `before` (секунды от эпохи). Возвращает количество удалённых."""
+        with self._write_lock, closing(self.connect()) as connection, connection:
+            return connection.execute('DELETE FROM logs WHERE created < ?', (before,)).rowcount
+
+
+class SQLiteLogHandler(logging.Handler):
+    """Обработчик логов, записывающий записи в `LogStore` пачками.
+
+    Поля запроса (request_id, endpoint, user_id) добавляет к записи
+    `logger.RequestContextFilter` ещё в потоке запроса.
+    """
+
+    def __init__(self, store, batch_size=500, flush_interval=2.0):
+        super().__init__()
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name='log-store-flusher', daemon=True)
+        self._flusher.start()
+
+    def emit(self, record):
+        # Сообщение уже содержит трейсбек: QueueHandler объединяет их перед постановкой в очередь
+        self.buffer.append((record.created, record.levelno, record.levelname, record.name,
+                            getattr(record, 'request_id', None), getattr(record, 'endpoint', None),
+                            getattr(record, 'user_id', None), record.getMessage()))
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            rows, self.buffer = self.buffer, []
+            if rows:
+                self.store.write(rows)
+        except sqlite3.Error as e:
+            # Пачка теряется, но поток записи логов продолжает работать
+            print(f'Ошибка при записи {len(rows)} логов в {self.store.path}: {e}')
+        finally:
+            self.release()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        self._stopped.set()
+        self._flusher.join()
+        self.flush()
+        self.store.close()
+        super().close()
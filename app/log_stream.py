@@ -0,0 +1,121 @@
+"""
+Трансляция новых записей лога зрителям страницы логов (Server-Sent Events).
+
+Раньше страницу логов обновляли целиком, и каждое обновление заново читало файл.
+Теперь обработчик `LogBroadcaster` (`'stream'` в `LOG_HANDLERS`) получает записи
+в потоке записи логов (см. app/logger.py) и раздаёт их подписчикам - открытым
+соединениям `/logs/stream`. Файл не читается: запись один раз форматируется и
+кладётся в буферы подписчиков.
+
+Буфер каждого подписчика ограничен (`buffer_size`): если зритель не успевает
+забирать записи, старые записи вытесняются, а зритель получает количество
+пропущенных. Подписчиков не больше `max_clients`. Последние `backlog_size` записей
+хранятся, чтобы переподключившийся зритель (заголовок Last-Event-ID) получил
+пропущенное.
+
+Трансляция локальна для процесса: при нескольких процессах зритель видит записи
+того процесса, который обслуживает его соединение.
+"""
+
+import itertools
+import logging
+import threading
+from collections import deque
+
+
+class LogSubscription:
+    """Подписка одного зрителя: ограниченный буфер записей и фильтры."""
+
+    def __init__(self, level=None, endpoint=None, buffer_size=1000):
+        self.level = level
+        self.endpoint = endpoint
+        self.events = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self._ready = threading.Condition()
+
+    def matches(self, event):
+        return ((self.level is None or event['level'] == self.level)
+                and (self.endpoint is None or event['endpoint'] == self.endpoint))
+
+    def push(self, event):
+        with self._ready:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            self._ready.notify()
+
+    def pop_all(self, timeout=None):
+        """Ждёт записей не дольше `timeout` секунд и забирает все накопленные.
+
+        Returns:
+            tuple[list[dict], int]: Записи и количество вытесненных из буфера с прошлого вызова.
+        """
+        with self._ready:
+            if not self.events and not self.dropped:
+                self._ready.wait(timeout)
+            events, dropped = list(self.events), self.dropped
+            self.events.clear()
+            self.dropped = 0
+        return events, dropped
+
+
+class LogBroadcaster(logging.Handler):
+    """Обработчик логов, раздающий записи подписчикам."""
+
+    def __init__(self, buffer_size=1000, backlog_size=1000, max_clients=50):
+        super().__init__()
+        self.buffer_size = buffer_size
+        self.max_clients = max_clients
+        self._backlog = deque(maxlen=backlog_size)
+        self._subscriptions = set()
+        self._ids = itertools.count(1)
+        self._subscriptions_lock = threading.Lock()
+
+    def emit(self, record):
+        event = {
+            'id': next(self._ids),
+            'created': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', None),
+            'endpoint': getattr(record, 'endpoint', None),
+            'user_id': getattr(record, 'user_id', None),
+            'message': record.getMessage(),
+            'text': self.format(record),
+        }
+        with self._subscriptions_lock:
+            self._backlog.append(event)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.push(event)
+
+    def subscribe(self, level=None, endpoint=None, last_event_id=None):
+        """Подписывает зрителя на новые записи.
+
+        Args:
+            level (str | None): Только записи этого уровня.
+            endpoint (str | None): Только записи, сделанные при обработке этого endpoint.
+            last_event_id (int | None): Сначала отдать сохранённые записи с id больше этого.
+
+        Returns:
+            LogSubscription | None: Подписка или None, если зрителей уже `max_clients`.
+        """
+        subscription = LogSubscription(level, endpoint, self.buffer_size)
+        with self._subscriptions_lock:
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            if last_event_id is not None:
+                for event in self._backlog:
+                    if event['id'] > last_event_id and subscription.matches(event):
+                        subscription.push(event)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._subscriptions_lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def clients(self):
+        return len(self._subscriptions)
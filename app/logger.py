@@ -2,11 +2,21 @@
 Модуль логирования для Flask-приложения.
 
 Этот модуль настраивает логирование в приложении Flask, включая:
-    - Вывод логов в консоль.
-    - Запись логов в файл.
-    - Автоматическое создание директории и файла логов.
+    - Неблокирующую запись: логгер приложения только кладёт запись в очередь
+      (`QueueHandler`), а в консоль и файл её пишет отдельный поток (`QueueListener`).
+      Поэтому запись логов не входит во время обработки запроса.
+    - Ротацию файла логов по размеру (`LOG_MAX_BYTES`) и по времени (`LOG_ROTATE_INTERVAL`)
+      со сжатием старых файлов в gzip в фоновом потоке.
+    - Набор обработчиков, задаваемый в конфигурации (`LOG_HANDLERS`), в том числе
+      хранилище структурированных логов с индексами (`'sqlite'`, см. app/log_store.py)
+      и трансляцию новых записей зрителям страницы логов (`'stream'`, см. app/log_stream.py).
+    - Поля запроса в каждой записи: id запроса, endpoint и id пользователя.
     - Очистку существующих обработчиков для предотвращения дублирования.
 
+Очередь ограничена (`LOG_QUEUE_SIZE`): если поток записи не успевает, новые записи
+отбрасываются, а не блокируют запросы; количество отброшенных записей хранится в
+`handler.dropped`.
+
 Пример использования:
     from flask import Flask
     from logger import setup_logger
@@ -16,24 +26,296 @@
     app.logger.info("Приложение запущено.")
 """
 
+import atexit
+import glob
+import gzip
 import logging
 import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from logging.handlers import BaseRotatingHandler, QueueHandler, QueueListener
+from uuid import uuid4
+
+from flask import Flask, g, has_request_context, request
+
+from .log_store import LogStore, SQLiteLogHandler
+from .log_stream import LogBroadcaster
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Работающие потоки записи по именам логгеров: логгер приложения общий для всех
+# экземпляров приложения с одним именем, поэтому при повторной настройке старый поток останавливается
+_listeners = {}
+
+
+def request_id():
+    """Id текущего запроса: из заголовка X-Request-ID или новый."""
+    if 'request_id' not in g:
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid4().hex
+    return g.request_id
+
+
+class RequestContextFilter(logging.Filter):
+    """Добавляет к записи поля запроса: request_id, endpoint, user_id (вне запроса - None).
+
+    Работает в потоке запроса, до постановки записи в очередь.
+    """
+
+    def filter(self, record):
+        record.request_id = record.endpoint = record.user_id = None
+        if has_request_context():
+            record.request_id = request_id()
+            record.endpoint = request.endpoint
+            # Только уже загруженный пользователь (Flask-Login или API): запись лога не обращается к БД
+            user = g.get('_login_user') or g.get('current_user')
+            record.user_id = getattr(user, 'id', None)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler для ограниченной очереди: при переполнении запись отбрасывается."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(QueueListener):
+    """QueueListener, который при остановке дожидается места в ограниченной очереди.
+
+    Стандартный `stop()` кладёт маркер остановки через `put_nowait` и падает с
+    `queue.Full`, если очередь заполнена; здесь маркер ждёт, пока поток записи
+    разберёт очередь, поэтому оставшиеся записи не теряются. Повторный `stop()` ничего не делает.
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+class RotatingLogFileHandler(BaseRotatingHandler):
+    """Файловый обработчик с ротацией по размеру и по времени.
+
+    Файл переименовывается в `<имя>.<время ротации>` и сжимается в gzip в фоновом потоке.
+    Хранится не больше `backup_count` старых файлов.
+
+    В один файл могут писать несколько процессов (воркеры gunicorn). Перед каждой записью,
+    как в `logging.handlers.WatchedFileHandler`, сравниваются устройство и inode открытого
+    файла и файла по пути `filename`: если файл переименован ротацией другого процесса,
+    обработчик переоткрывает его, а не продолжает писать в резервную копию. Ротация файла,
+    уже ротированного другим процессом, сводится к такому же переоткрытию. Проверка -
+    один `os.stat` на запись в потоке записи логов, а не в обработчике запроса.
+    """
+
+    def __init__(self, filename, max_bytes=0, interval=None, backup_count=0, compress=True):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        super().__init__(filename, 'a', encoding='utf-8', delay=False)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self._compressors = []
+        self._backups_lock = threading.Lock()  # сжатие и удаление старых копий по очереди
+        self._last_rotation = (None, 0)
+        started = os.stat(self.baseFilename).st_mtime if os.path.exists(self.baseFilename) else time.time()
+        self.rollover_at = started + interval if interval else None
+
+    def _open(self):
+        stream = super()._open()
+        stat = os.fstat(stream.fileno())
+        self._dev, self._ino = stat.st_dev, stat.st_ino
+        return stream
+
+    def _rotated_elsewhere(self):
+        """Файл по пути `filename` - уже не тот, что открыт (переименован или удалён)."""
+        try:
+            stat = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != (self._dev, self._ino)
+
+    def _reopen(self):
+        if self.stream:
+            self.stream.close()
+        self.stream = self._open()
+        # Файл только что ротирован другим процессом: отсчёт интервала начинается заново
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
 
-from flask import Flask
+    def emit(self, record):
+        if self.stream is not None and self._rotated_elsewhere():
+            try:
+                self._reopen()
+            except OSError:
+                self.handleError(record)
+                return
+        super().emit(record)
 
-LOG_FILE = "logs/app.log"
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes > 0 and self.stream is not None:
+            message = self.format(record) + self.terminator
+            return self.stream.tell() + len(message.encode('utf-8')) >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self._rotated_elsewhere():
+            # Другой процесс уже ротировал файл: переименование затронуло бы его новый файл
+            self._reopen()
+            return
+
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            rotated = self._rotated_name()
+            os.rename(self.baseFilename, rotated)
+            if self.compress:
+                # Сжатие большого файла не задерживает запись новых логов
+                thread = threading.Thread(target=self._compress, args=(rotated,), name='log-compressor', daemon=True)
+                thread.start()
+                self._compressors = [t for t in self._compressors if t.is_alive()] + [thread]
+            else:
+                with self._backups_lock:
+                    self._remove_old_backups()
+
+        self.stream = self._open()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+    def _rotated_name(self):
+        stamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        # Несколько ротаций за одну секунду получают возрастающие номера; номер не
+        # переиспользуется, даже если копия с ним уже удалена, иначе порядок копий нарушится
+        last_stamp, n = self._last_rotation
+        n = n + 1 if stamp == last_stamp else 0
+        while True:
+            candidate = f'{self.baseFilename}.{stamp}' + (f'.{n}' if n else '')
+            if not (os.path.exists(candidate) or os.path.exists(candidate + '.gz')):
+                break
+            n += 1
+        self._last_rotation = (stamp, n)
+        return candidate
+
+    def _compress(self, path):
+        with self._backups_lock:
+            # Файл мог быть удалён как устаревший, пока ждал своей очереди
+            if os.path.exists(path):
+                try:
+                    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                    os.remove(path)
+                except OSError as e:
+                    # Несжатый файл остаётся на месте - записи не теряются. Как и
+                    # logging.Handler.handleError, сообщаем в stderr, а не в stdout
+                    if logging.raiseExceptions:
+                        sys.stderr.write(f'--- Ошибка при сжатии лог-файла {path}: {e}\n')
+            self._remove_old_backups()
+
+    def backups(self):
+        """Резервные копии от старых к новым (имена без `.gz`).
+
+        Файл, который ещё сжимается, и его .gz считаются одной резервной копией.
+        """
+        prefix = self.baseFilename + '.'
+
+        def key(name):
+            # <время>[.n]: несколько ротаций за одну секунду нумеруются по порядку
+            stamp, _, n = name[len(prefix):].partition('.')
+            return stamp, int(n) if n.isdigit() else 0
+
+        names = {path.removesuffix('.gz') for path in glob.glob(glob.escape(self.baseFilename) + '.*')}
+        return sorted(names, key=key)
+
+    def _remove_old_backups(self):
+        if self.backup_count <= 0:
+            return
+        for name in self.backups()[:-self.backup_count]:
+            for path in (name, name + '.gz'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def wait_for_compression(self, timeout=None):
+        """Ждёт завершения фонового сжатия (для тестов и остановки приложения)."""
+        for thread in self._compressors:
+            thread.join(timeout)
+
+    def close(self):
+        self.wait_for_compression(timeout=30)
+        super().close()
+
+
+def _console_handler(app):
+    return logging.StreamHandler()
+
+
+def _file_handler(app):
+    return RotatingLogFileHandler(
+        app.config['LOG_FILE'],
+        max_bytes=app.config['LOG_MAX_BYTES'],
+        interval=app.config['LOG_ROTATE_INTERVAL'],
+        backup_count=app.config['LOG_BACKUP_COUNT'],
+        compress=app.config['LOG_COMPRESS'])
+
+
+def _sqlite_handler(app):
+    store = LogStore(app.config['LOG_STORE_PATH'])
+    # Страница логов читает записи из этого хранилища
+    app.extensions['log_store'] = store
+    return SQLiteLogHandler(store,
+                            batch_size=app.config['LOG_STORE_BATCH_SIZE'],
+                            flush_interval=app.config['LOG_STORE_FLUSH_INTERVAL'])
+
+
+def _stream_handler(app):
+    broadcaster = LogBroadcaster(buffer_size=app.config['LOG_STREAM_BUFFER_SIZE'],
+                                 backlog_size=app.config['LOG_STREAM_BACKLOG'],
+                                 max_clients=app.config['LOG_STREAM_MAX_CLIENTS'])
+    # К нему подключаются зрители `/logs/stream`
+    app.extensions['log_broadcaster'] = broadcaster
+    return broadcaster
+
+
+# Обработчики, которые можно перечислить в `LOG_HANDLERS`
+HANDLER_FACTORIES = {
+    'console': _console_handler,
+    'file': _file_handler,
+    'sqlite': _sqlite_handler,
+    'stream': _stream_handler,
+}
+
+
+def _stop_listener(name):
+    listener = _listeners.pop(name, None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
 
 
 def setup_logger(app: Flask):
     """Настраивает логирование для Flask-приложения.
 
     Функция выполняет следующие действия:
-    1. Устанавливает уровень логирования на INFO.
+    1. Устанавливает уровень логирования (`LOG_LEVEL`).
     2. Отключает распространение логов, чтобы избежать дублирования.
-    3. Создаёт папку и файл логов, если они не существуют.
-    4. Очищает существующие обработчики логирования.
-    5. Добавляет обработчик для вывода логов в консоль.
-    6. Добавляет обработчик для записи логов в файл.
+    3. Останавливает поток записи предыдущей настройки и очищает обработчики.
+    4. Создаёт обработчики из `LOG_HANDLERS` (консоль, файл с ротацией и т.д.).
+    5. Подключает к логгеру очередь, а обработчики - к потоку записи, который её разбирает.
 
     Args:
         app (Flask): Flask-приложение, для которого настраивается логирование.
@@ -41,35 +323,40 @@ def setup_logger(app: Flask):
     Raises:
         Exception: В случае ошибки при настройке логирования.
     """
-    app.logger.setLevel(logging.INFO)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
     app.logger.propagate = False  # Отключаем распространение логов
 
     try:
-        if not os.path.exists("logs"):
-            os.makedirs("logs")  # Создаём папку для логов, если её нет
-
-        if not os.path.exists(LOG_FILE):
-            with open(LOG_FILE, "w", encoding="utf-8") as f:
-                f.write("")  # Создаём пустой файл, если его нет
-
         # Очищаем логгер от всех хэндлеров.
+        _stop_listener(app.logger.name)
         app.logger.handlers.clear()
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
+        app.extensions.pop('log_store', None)
+        app.extensions.pop('log_broadcaster', None)
+        formatter = logging.Formatter(LOG_FORMAT)
 
-        # Обработчик для вывода в консоль
-        std_handler = logging.StreamHandler()
-        std_handler.setFormatter(formatter)
-        app.logger.addHandler(std_handler)
+        handlers = []
+        for name in app.config['LOG_HANDLERS']:
+            handler = HANDLER_FACTORIES[name](app)
+            handler.setFormatter(formatter)
+            handlers.append(handler)
 
-        # Обработчик для записи в файл
-        file_handler = logging.FileHandler(LOG_FILE, encoding="utf-8")
-        file_handler.setFormatter(formatter)
-        # file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
+        queue_handler = DroppingQueueHandler(queue.Queue(app.config['LOG_QUEUE_SIZE']))
+        queue_handler.addFilter(RequestContextFilter())
+        app.logger.addHandler(queue_handler)
+
+        listener = DrainingQueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners[app.logger.name] = listener
+        app.extensions['log_listener'] = listener
 
         app.logger.info("Логирование успешно настроено.")
 
     except Exception as e:
         print(f"Ошибка при настройке логирования: {e}")
+
+
+@atexit.register
+def _stop_listeners():
+    """Записывает оставшиеся в очередях записи при завершении процесса."""
+    for name in list(_listeners):
+        _stop_listener(name)
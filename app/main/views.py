@@ -12,19 +12,23 @@
     - Взаимодействие с базой данных.
     - Отправка уведомлений по электронной почте (если настроено).
 """
+import json
+import time
 from datetime import datetime, timezone
 from pathlib import Path
 
-from flask import (abort, current_app, flash, redirect, render_template,
-                   request, session, url_for)
+from flask import (Response, abort, current_app, flash, jsonify, redirect,
+                   render_template, request, session, url_for)
 from flask_login import current_user, login_required
 from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
 
-from .. import db
+from .. import db, identity_cache
 from ..decorators import admin_required, permission_required
 from ..email import create_and_send_email_async
-from ..logger import LOG_FILE
-from ..models import Comment, Permission, Post, Role, User
+from ..log_reader import LEVELS, read_log_page
+from ..models import Comment, Follow, Permission, Post, Role, User
+from ..pagination import keyset_paginate
 from . import main_bp
 from .forms import (CommentForm, EditProfileAdminForm, EditProfileForm,
                     NameForm, PostForm)
@@ -32,6 +36,35 @@ from .forms import (CommentForm, EditProfileAdminForm, EditProfileForm,
 basedir = Path(__file__).resolve().parent
 
 
+def paginate_timeline(stmt, timestamp_col=Post.timestamp, id_col=Post.id):
+    """Пагинация ленты постов (главная, лента, профиль).
+
+    По умолчанию используется keyset-пагинация по (Post.timestamp, Post.id) с параметрами
+    `?after=`/`?before=`: без OFFSET и без COUNT(*). Старые ссылки вида `?page=N`
+    обслуживаются обычной постраничной навигацией.
+
+    Для ленты подписок ключ сортировки задаётся колонками таблицы timeline
+    (их значения совпадают с timestamp и id поста).
+    """
+    per_page = current_app.config['POSTS_PER_PAGE']
+    # Шаблон _posts.html показывает имя автора каждого поста: авторы страницы
+    # загружаются одним дополнительным запросом, а не по одному на пост.
+    stmt = stmt.options(selectinload(Post.author))
+    if 'page' in request.args:
+        return db.paginate(
+            stmt,
+            page=request.args.get('page', 1, type=int),
+            per_page=per_page,
+            error_out=False)  # Возвращает пустой список вместо 404 при неверной странице
+
+    return keyset_paginate(
+        stmt, timestamp_col, id_col,
+        per_page=per_page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        key=lambda post: (post.timestamp, post.id))
+
+
 # @main_bp.route('/', methods=['GET', 'POST'])
 # def index():
 #     """Главная страница. Обрабатывает ввод имени пользователя.
@@ -90,15 +123,8 @@ def index():
         current_app.logger.info(f'Пользователь {current_user} опубликовал пост.')
         return redirect(url_for('.index'))
 
-    # Получение номера страницы из параметра запроса
-    page = request.args.get('page', 1, type=int)
-
     # Пагинация постов
-    posts_pagination = db.paginate(
-        select(Post).order_by(Post.timestamp.desc()),
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False)  # Возвращает пустой список вместо 404 при неверной странице
+    posts_pagination = paginate_timeline(select(Post).order_by(Post.timestamp.desc()))
 
     return render_template(
         'index.html',
@@ -119,12 +145,7 @@ def feed(username):
     if user is None:
         flash('Нет этого пользователя.')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    posts_pagination = db.paginate(
-        user.feed_posts,
-        page=page,
-        per_page=current_app.config["POSTS_PER_PAGE"],
-        error_out=False)  # Возвращает пустой список вместо 404 при неверной странице
+    posts_pagination = paginate_timeline(*user.feed_timeline())
 
     return render_template(
         'feed.html',
@@ -156,12 +177,8 @@ def profile(username):
         current_app.logger.info(f"Пользователь не найден: {username}")
         abort(404)
 
-    page = request.args.get('page', 1, type=int)
-    posts_pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page=page,
-        per_page=current_app.config['POSTS_PER_PAGE'],
-        error_out=False
-    )
+    posts_pagination = paginate_timeline(
+        select(Post).where(Post.author_id == user.id).order_by(Post.timestamp.desc()))
 
     return render_template(
         'profile.html',
@@ -204,6 +221,8 @@ def edit_profile_admin(id):
         user.about_me = form.about_me.data
         db.session.add(user)
         db.session.commit()
+        # Сбрасываем кеш после фиксации: запрос, начавшийся до неё, мог закешировать старую роль
+        identity_cache.invalidate(user.id)
         flash('Профиль пользователя успешно обновлен.')
         return redirect(url_for('main.profile', username=user.username))
     form.email.data = user.email
@@ -225,6 +244,10 @@ def follow(username):
         flash('Нет этого пользователя.')
         return redirect(url_for('.index'))
 
+    if user == current_user:
+        flash('Нельзя подписаться на самого себя.')
+        return redirect(url_for('.profile', username=username))
+
     if current_user.is_following(user):
         flash('Вы уже подписаны на этого пользователя.')
         return redirect(url_for('.profile', username=username))
@@ -261,14 +284,16 @@ def followers(username):
         return redirect(url_for('.index'))
 
     page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
+    pagination = db.paginate(
+        user.followers.select()
+        .options(joinedload(Follow.follower))
+        .order_by(Follow.timestamp.desc()),
         page=page,
         per_page=current_app.config['FOLLOWERS_PER_PAGE'],
         error_out=False)
 
     follows = [
-        # Исключаем самого себя из подписчиков
-        {'user': item.follower, 'timestamp': item.timestamp} for item in pagination.items if item.follower != user
+        {'user': item.follower, 'timestamp': item.timestamp} for item in pagination.items
     ]
 
     return render_template(
@@ -289,7 +314,10 @@ def followed_by(username):
         return redirect(url_for('.index'))
 
     page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
+    pagination = db.paginate(
+        user.followed.select()
+        .options(joinedload(Follow.followed))
+        .order_by(Follow.timestamp.desc()),
         page=page,
         per_page=current_app.config['FOLLOWERS_PER_PAGE'],
         error_out=False)
@@ -297,7 +325,6 @@ def followed_by(username):
     follows = [
         {'user': item.followed, 'timestamp': item.timestamp}
         for item in pagination.items
-        if item.followed != user    # Исключаем самого себя из подписок
     ]
 
     return render_template(
@@ -330,17 +357,16 @@ def post_details(id):
     page = request.args.get('page', 1, type=int)
     per_page = current_app.config['COMMENTS_PER_PAGE']
 
-    pagination = post.comments.order_by(Comment.created_at.asc()).paginate(
-        page=page,
-        per_page=per_page,
-        error_out=False)
+    # Авторы комментариев страницы загружаются одним запросом (см. _comments.html)
+    stmt = (post.comments.select()
+            .options(selectinload(Comment.author))
+            .order_by(Comment.created_at.asc(), Comment.id.asc()))
 
     if page == -1:
-        page = pagination.pages  # Узнаем последнюю страницу
-        pagination = post.comments.order_by(Comment.created_at.asc()).paginate(
-            page=page,
-            per_page=per_page,
-            error_out=False)
+        # Последняя страница (после публикации комментария)
+        page = max(1, -(-post.comments_count // per_page))
+
+    pagination = db.paginate(stmt, page=page, per_page=per_page, error_out=False)
 
     return render_template('post_details.html',
                            posts=[post],            # Нужно вернуть список для итерирования в шаблоне
@@ -375,8 +401,9 @@ def post_edit(id):
 @main_bp.route('/delete-post/<int:id>', methods=['GET', 'DELETE'])
 @login_required
 def post_delete(id):
-    # Получаем номер текущей страницы из параметров запроса
-    page = request.args.get('page', 1, type=int)
+    # Получаем текущую страницу (номер или курсор) из параметров запроса
+    page = request.args.get('page', type=int)
+    after = request.args.get('after')
 
     post = db.session.get(Post, id)
 
@@ -385,7 +412,7 @@ def post_delete(id):
     db.session.delete(post)
     db.session.commit()
 
-    return redirect(url_for('.index', page=page))
+    return redirect(url_for('.index', page=page, after=after))
 
 
 @main_bp.route('/moderate')
@@ -394,7 +421,9 @@ def post_delete(id):
 def moderate():
     page = request.args.get('page', 1, type=int)
     pagination = db.paginate(
-        select(Comment).order_by(Comment.created_at.desc()),
+        select(Comment)
+        .options(selectinload(Comment.author))
+        .order_by(Comment.created_at.desc()),
         page=page,
         per_page=current_app.config['COMMENTS_PER_PAGE'],
         error_out=False
@@ -445,16 +474,141 @@ def moderate_disable(id):
     )
 
 
+# Периоды страницы логов, часов
+LOG_PERIODS = (1, 6, 24, 24 * 7)
+
+
+def log_store_filters(args):
+    """Фильтры запроса к хранилищу логов из параметров запроса.
+
+    Параметры: level, view (endpoint), request_id, user_id, q (подстрока сообщения) и период -
+    hours (за последние N часов, по умолчанию 24) или since/until (секунды от эпохи).
+    """
+    level = args.get('level', '').upper()
+    now = time.time()
+    since = args.get('since', type=float)
+    if since is None:
+        since = now - 3600 * args.get('hours', 24, type=float)
+    return dict(level=level if level in LEVELS else None,
+                endpoint=args.get('view') or None,
+                request_id=args.get('request_id') or None,
+                user_id=args.get('user_id', type=int),
+                search=args.get('q') or None,
+                since=since,
+                until=args.get('until', now, type=float))
+
+
+def query_log_store(store, args):
+    """Страница записей, количество по уровням и по интервалам времени для страницы и API логов."""
+    filters = log_store_filters(args)
+    limit = current_app.config['LOG_VIEW_PAGE_SIZE']
+    entries = store.query(before_id=args.get('before', type=int), limit=limit, **filters)
+    # Количество по уровням - без фильтра по уровню, чтобы по нему можно было переключаться
+    counts = store.level_counts(**{**filters, 'level': None})
+    bucket = max(60, int(filters['until'] - filters['since']) // current_app.config['LOG_VIEW_BUCKETS'])
+    return {
+        'entries': entries,
+        'next_before': entries[-1]['id'] if len(entries) == limit else None,
+        'counts': counts,
+        'bucket': bucket,
+        'buckets': store.histogram(bucket, **filters),
+    }
+
+
+@main_bp.route("/logs/query")
+@login_required
+@admin_required
+def query_logs():
+    """API хранилища логов: те же параметры, что у страницы логов, ответ в JSON."""
+    store = current_app.extensions.get('log_store')
+    if store is None:
+        abort(404)
+    return jsonify(query_log_store(store, request.args))
+
+
+def log_stream_url(level=None, endpoint=None):
+    """Адрес трансляции новых записей для страницы логов (None, если трансляция выключена)."""
+    if 'log_broadcaster' not in current_app.extensions:
+        return None
+    return url_for('.stream_logs', level=level, view=endpoint)
+
+
+@main_bp.route("/logs/stream")
+@login_required
+@admin_required
+def stream_logs():
+    """Новые записи лога в формате Server-Sent Events (см. app/log_stream.py).
+
+    Параметры запроса: level и view (endpoint) - фильтры записей. При переподключении браузер
+    передаёт заголовок Last-Event-ID, и зритель получает записи, пропущенные за время
+    разрыва (если они ещё хранятся).
+    """
+    broadcaster = current_app.extensions.get('log_broadcaster')
+    if broadcaster is None:
+        abort(404)
+
+    level = request.args.get('level', '').upper()
+    subscription = broadcaster.subscribe(level=level if level in LEVELS else None,
+                                         endpoint=request.args.get('view') or None,
+                                         last_event_id=request.headers.get('Last-Event-ID', type=int))
+    if subscription is None:
+        abort(503)
+    heartbeat = current_app.config['LOG_STREAM_HEARTBEAT']
+
+    def events():
+        while True:
+            records, dropped = subscription.pop_all(timeout=heartbeat)
+            if dropped:
+                yield f'event: dropped\ndata: {dropped}\n\n'
+            for record in records:
+                yield f'id: {record["id"]}\nevent: log\ndata: {json.dumps(record, ensure_ascii=False)}\n\n'
+            if not records and not dropped:
+                # Комментарий: поддерживает соединение и обнаруживает отключившихся зрителей
+                yield ': keepalive\n\n'
+
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscription))
+    return response
+
+
 @main_bp.route("/logs")
+@login_required
+@admin_required
 def show_logs():
-    """Читает логи из файла и передаёт их в HTML-шаблон."""
+    """Показывает страницу логов, от новых записей к старым.
+
+    Если включено хранилище логов (`'sqlite'` в `LOG_HANDLERS`), записи выбираются из него
+    с фильтрами на сервере (см. `log_store_filters`), с количеством по уровням и по времени.
+    Иначе записи читаются с конца лог-файла.
+
+    Параметры запроса:
+        before (int): Смещение в файле или id записи, до которых читать (ссылка «Старее»).
+        level (str): Показывать только записи этого уровня (INFO, WARNING, ERROR...).
+    """
+    store = current_app.extensions.get('log_store')
+    if store is not None:
+        filters = log_store_filters(request.args)
+        # Новые записи добавляются на первую страницу, если фильтры поддерживаются трансляцией
+        live = not any(request.args.get(name) for name in ('before', 'since', 'until', 'request_id', 'user_id', 'q'))
+        return render_template("log_store.html", levels=LEVELS, periods=LOG_PERIODS, args=request.args,
+                               stream_url=log_stream_url(filters['level'], filters['endpoint']) if live else None,
+                               **query_log_store(store, request.args))
+
+    before = request.args.get('before', type=int)
+    level = request.args.get('level', '').upper()
+    if level not in LEVELS:
+        level = None
+    stream_url = log_stream_url(level) if before is None else None
+
     try:
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            logs = f.readlines()
+        page = read_log_page(current_app.config['LOG_FILE'], before=before, level=level,
+                             limit=current_app.config['LOG_VIEW_PAGE_SIZE'],
+                             max_scan_bytes=current_app.config['LOG_VIEW_MAX_SCAN_BYTES'])
     except FileNotFoundError:
-        logs = ["Лог-файл пока не создан."]
+        page = None
 
-    return render_template("logs.html", logs=logs)
+    return render_template("logs.html", page=page, level=level, levels=LEVELS, before=before, stream_url=stream_url)
 
 
 @main_bp.route('/admin')
@@ -464,6 +618,21 @@ def for_admins_only():
     return "For administrators!"
 
 
+@main_bp.route('/admin/sql')
+@login_required
+@admin_required
+def sql_trace():
+    """Сводка запросов к БД этого процесса (см. app/sql_trace.py).
+
+    Параметры запроса:
+        sort (str): total, max, avg, count или slow - по чему выбирать самые тяжёлые запросы.
+    """
+    trace = current_app.extensions.get('sql_trace')
+    sort = request.args.get('sort', 'total')
+    statements = trace.top(sort=sort, limit=current_app.config['SQL_TRACE_PAGE_SIZE']) if trace else []
+    return render_template('admin_sql.html', statements=statements, sort=sort, trace=trace)
+
+
 @main_bp.route('/error500')
 def trigger_500():
     """Функция для искусственного вызыва ошибки 500."""
@@ -0,0 +1,351 @@
+"""
+Метрики приложения в текстовом формате Prometheus (`/metrics`).
+
+Расширение `Metrics` собирает в памяти процесса:
+    - количество запросов и их длительность (гистограмма) по эндпоинтам
+      (`main.*`, `auth.*`, `api_v1.*`), методам и кодам ответа;
+    - количество запросов к БД и их суммарное время на один HTTP-запрос;
+    - время рендеринга шаблонов;
+    - счётчики очереди email, размер кешей и их попадания/промахи, количество
+      отброшенных записей лога - эти значения читаются в момент сбора;
+    - очередь писем в таблице email_outbox: сколько писем ждут отправки, захвачены
+      обработчиками и не отправлены окончательно, и возраст самого старого
+      неотправленного письма. Эти значения общие для всех процессов: они читаются из БД
+      только при запросе `/metrics` и в снимки процессов не попадают.
+
+Несколько процессов (например, воркеры gunicorn). Если задан `METRICS_DIR`, каждый
+процесс не реже раза в `METRICS_FLUSH_INTERVAL` секунд записывает снимок своих метрик
+в `<METRICS_DIR>/<pid>.json`, а `/metrics` складывает снимки всех процессов:
+счётчики и гистограммы суммируются (снимки завершившихся процессов тоже, чтобы
+счётчики не уменьшались), показатели-gauge - только у работающих процессов.
+Каталог нужно очищать перед запуском сервера.
+
+Доступ к `/metrics`: заголовок `Authorization: Bearer <METRICS_TOKEN>` или
+вход под администратором.
+
+Долю попаданий в кеш за интервал удобнее считать в Prometheus:
+    rate(cache_hits_total[5m]) / (rate(cache_hits_total[5m]) + rate(cache_misses_total[5m]))
+`cache_hit_ratio` - та же доля с момента запуска.
+"""
+
+import atexit
+import glob
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import (Response, abort, before_render_template, current_app, g,
+                   has_request_context, request, template_rendered)
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Границы гистограмм: длительность, секунд, и количество запросов к БД на HTTP-запрос
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Обработанные HTTP-запросы'),
+    'http_request_duration_seconds': ('histogram', 'Длительность обработки HTTP-запроса'),
+    'db_queries_per_request': ('histogram', 'Запросов к БД за один HTTP-запрос'),
+    'db_time_per_request_seconds': ('histogram', 'Суммарное время запросов к БД за один HTTP-запрос'),
+    'template_render_duration_seconds': ('histogram', 'Время рендеринга шаблона'),
+    'email_outbox_emails': ('gauge', 'Письма outbox по состоянию: pending, leased, failed'),
+    'email_outbox_oldest_pending_age_seconds': ('gauge', 'Возраст самого старого неотправленного письма outbox'),
+    'email_messages_total': ('counter', 'Письма очереди email по результату'),
+    'cache_entries': ('gauge', 'Записей в кеше'),
+    'cache_hits_total': ('counter', 'Попадания в кеш'),
+    'cache_misses_total': ('counter', 'Промахи кеша'),
+    'cache_hit_ratio': ('gauge', 'Доля попаданий в кеш с момента запуска'),
+    'log_records_dropped_total': ('counter', 'Записи лога, отброшенные при переполненной очереди'),
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+class MetricsRegistry:
+    """Метрики одного процесса: счётчики, гистограммы и функции, читающие значения при сборе.
+
+    Функция сбора возвращает кортежи (имя, метки, значение) для счётчиков и gauge из `METRICS`.
+    """
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._counters = {}    # (имя, метки) -> значение
+        self._histograms = {}  # (имя, метки) -> [границы, количества по интервалам, сумма, количество]
+        self._collectors = []
+        self._shared_collectors = []
+        self._lock = threading.Lock()
+        self._dumped_at = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def inc(self, name, labels=None, value=1):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None, buckets=DURATION_BUCKETS):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0, 0]
+            # Последний интервал - значения больше верхней границы (+Inf)
+            histogram[1][bisect_left(buckets, value)] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def add_collector(self, collector, shared=False):
+        """Добавляет функцию сбора.
+
+        Значения `shared` функций общие для всех процессов (например, читаются из БД): они
+        собираются только в `collect()` и не суммируются по снимкам процессов.
+        """
+        (self._shared_collectors if shared else self._collectors).append(collector)
+
+    def snapshot(self):
+        """Снимок метрик процесса, пригодный для JSON."""
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(buckets), list(counts), total, count]
+                          for (name, labels), (buckets, counts, total, count) in self._histograms.items()]
+        gauges = []
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                item = [name, sorted(labels.items()), value]
+                (counters if METRICS[name][0] == 'counter' else gauges).append(item)
+        return {'pid': os.getpid(), 'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def dump(self):
+        """Записывает снимок процесса в каталог метрик (атомарно, через переименование)."""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+        self._dumped_at = time.monotonic()
+
+    def maybe_dump(self):
+        if self.directory and time.monotonic() - self._dumped_at >= self.flush_interval:
+            self.dump()
+
+    def _snapshots(self):
+        """Снимок текущего процесса и последние снимки остальных процессов."""
+        own = self.snapshot()
+        snapshots = [own]
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                if os.path.basename(path) == f'{own["pid"]}.json':
+                    continue
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # файл удалён или ещё пишется
+        return snapshots
+
+    def collect(self):
+        """Метрики всех процессов: {имя: {метки: значение или [границы, количества, сумма, количество]}}."""
+        merged = {}
+        for snapshot in self._snapshots():
+            alive = snapshot['pid'] == os.getpid() or _pid_alive(snapshot['pid'])
+            for name, labels, value in snapshot['counters'] + (snapshot['gauges'] if alive else []):
+                values = merged.setdefault(name, {})
+                key = tuple(map(tuple, labels))
+                values[key] = values.get(key, 0) + value
+            for name, labels, buckets, counts, total, count in snapshot['histograms']:
+                values = merged.setdefault(name, {})
+                key = tuple(map(tuple, labels))
+                if key not in values:
+                    values[key] = [buckets, counts, total, count]
+                else:
+                    existing = values[key]
+                    existing[1] = [a + b for a, b in zip(existing[1], counts)]
+                    existing[2] += total
+                    existing[3] += count
+
+        for collector in self._shared_collectors:
+            for name, labels, value in collector():
+                merged.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+        # Доля попаданий считается по сумме попаданий и промахов всех процессов
+        hits, misses = merged.get('cache_hits_total', {}), merged.get('cache_misses_total', {})
+        for key in hits.keys() | misses.keys():
+            lookups = hits.get(key, 0) + misses.get(key, 0)
+            if lookups:
+                merged.setdefault('cache_hit_ratio', {})[key] = hits.get(key, 0) / lookups
+        return merged
+
+    def render(self):
+        """Метрики всех процессов в текстовом формате Prometheus."""
+        lines = []
+        for name, values in sorted(self.collect().items()):
+            kind, help_text = METRICS[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(values.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                    continue
+                buckets, counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip([*buckets, '+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# Учёт запросов к БД: слушатели регистрируются один раз на класс Engine и учитывают
+# только запросы, выполненные во время HTTP-запроса приложения с включёнными метриками
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if has_request_context() and 'metrics' in g:
+        g.metrics['db_queries'] += 1
+        g.metrics['db_time'] += elapsed
+
+
+def _template_started(sender, template, context, **extra):
+    g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+
+def _template_rendered(sender, template, context, **extra):
+    timers = g.get('metrics_templates')
+    if timers:
+        sender.extensions['metrics'].observe('template_render_duration_seconds', time.perf_counter() - timers.pop(),
+                                             {'template': template.name or '<string>'})
+
+
+class Metrics:
+    """Расширение Flask: метрики приложения и маршрут `/metrics`.
+
+    Реестр метрик хранится отдельно для каждого приложения в `app.extensions['metrics']`.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        registry = MetricsRegistry(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+        app.extensions['metrics'] = registry
+        registry.add_collector(lambda: _collect_app_state(app))
+        registry.add_collector(_collect_outbox, shared=True)
+        if registry.directory:
+            atexit.register(registry.dump)
+
+        app.before_request(_start_request)
+        app.after_request(_finish_request)
+        before_render_template.connect(_template_started, app)
+        template_rendered.connect(_template_rendered, app)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+    @property
+    def registry(self):
+        """Реестр метрик текущего приложения."""
+        return current_app.extensions['metrics']
+
+
+def _start_request():
+    g.metrics = {'started': time.perf_counter(), 'db_queries': 0, 'db_time': 0.0}
+
+
+def _finish_request(response):
+    state = g.get('metrics')
+    if state is None:
+        return response
+    registry = current_app.extensions['metrics']
+    # Запросы без эндпоинта (404) собираются под одной меткой, чтобы не плодить ряды
+    endpoint = request.endpoint or '<unmatched>'
+    labels = {'endpoint': endpoint, 'method': request.method}
+    registry.inc('http_requests_total', {**labels, 'status': str(response.status_code)})
+    registry.observe('http_request_duration_seconds', time.perf_counter() - state['started'], labels)
+    registry.observe('db_queries_per_request', state['db_queries'], {'endpoint': endpoint}, COUNT_BUCKETS)
+    registry.observe('db_time_per_request_seconds', state['db_time'], {'endpoint': endpoint})
+    registry.maybe_dump()
+    return response
+
+
+def _collect_app_state(app):
+    """Значения, которые читаются в момент сбора: очередь email, кеши, логгер."""
+    pool = app.extensions.get('email_queue')
+    if pool is not None:
+        stats = pool.stats()
+        for result in ('sent', 'failed', 'retried', 'dropped'):
+            yield 'email_messages_total', {'result': result}, stats[result]
+
+    caches = {'identity': app.extensions.get('identity_cache'), 'api_tokens': app.extensions.get('api_tokens')}
+    for cache, entries in caches.items():
+        if entries is not None:
+            stats = entries.stats()
+            yield 'cache_entries', {'cache': cache}, stats['entries']
+            yield 'cache_hits_total', {'cache': cache}, stats['hits']
+            yield 'cache_misses_total', {'cache': cache}, stats['misses']
+
+    for handler in app.logger.handlers:
+        if hasattr(handler, 'dropped'):
+            yield 'log_records_dropped_total', {}, handler.dropped
+
+
+def _collect_outbox():
+    """Очередь писем в email_outbox (общая для всех процессов)."""
+    from .services.outbox import outbox_stats
+
+    stats = outbox_stats()
+    for state in ('pending', 'leased', 'failed'):
+        yield 'email_outbox_emails', {'state': state}, stats[state]
+    yield 'email_outbox_oldest_pending_age_seconds', {}, stats['oldest_pending_age']
+
+
+def metrics_view():
+    """Метрики всех процессов в формате Prometheus. Доступ - по токену или администратору."""
+    token = current_app.config['METRICS_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    authorized = bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    if not authorized and not current_user.is_administrator():
+        abort(403)
+    return Response(current_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
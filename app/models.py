@@ -1,16 +1,55 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from random import randint
+from uuid import uuid4
 
 import mistune  # Markdown-парсер
 from faker import Faker
-from flask import abort, current_app, url_for
+from flask import (abort, current_app, g, has_request_context, request,
+                   url_for)
 from flask_login import AnonymousUserMixin, UserMixin
 from itsdangerous import URLSafeTimedSerializer
 from itsdangerous.exc import BadSignature, SignatureExpired
-from sqlalchemy import select
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import delete, exists, insert, or_, select, union_all, update
+from sqlalchemy.orm.attributes import set_committed_value
 
-from . import db, login_manager
+from . import (db, identity_cache, last_seen_buffer, login_manager,
+               password_hasher)
+from .identity_cache import AUTH_FIELDS
+
+# Версия правил рендеринга Markdown (HTML и превью поста). Увеличивается при любом изменении
+# рендерера, после чего `flask render-posts` перерендерит сохранённые данные у старых постов.
+MARKDOWN_RENDERER_VERSION = 2
+
+# Максимальная длина превью поста (в символах исходного Markdown-текста) для списков постов
+POST_EXCERPT_LENGTH = 300
+
+
+def render_markdown(text):
+    """Рендерит Markdown-текст в HTML."""
+    return mistune.markdown(text or '')
+
+
+def make_excerpt(text, length=POST_EXCERPT_LENGTH):
+    """Обрезает Markdown-текст для превью.
+
+    Текст режется по границе абзаца или слова, чтобы не обрывать слова посередине.
+
+    Returns:
+        tuple[str, bool]: Текст превью и флаг того, что текст был обрезан.
+    """
+    text = text or ''
+    if len(text) <= length:
+        return text, False
+
+    cut = text[:length]
+    # Предпочитаем границу абзаца, затем границу слова, если они не слишком близко к началу
+    for separator in ('\n\n', ' '):
+        pos = cut.rfind(separator)
+        if pos > length // 2:
+            cut = cut[:pos]
+            break
+
+    return cut.rstrip() + '…', True
 
 
 class Permission:
@@ -64,21 +103,28 @@ class Role(db.Model):
             role.default = roles[r][1]
             db.session.add(role)
         db.session.commit()
+        # Разрешения ролей закешированы вместе с пользователями
+        identity_cache.clear()
 
 
 class Follow(db.Model):
     __tablename__ = 'follows'
+    __table_args__ = (
+        # Свои посты попадают в ленту напрямую, подписка на самого себя не нужна
+        db.CheckConstraint('follower_id != followed_id', name='ck_follows_not_self'),
+        # Страницы подписчиков и подписок в API выбираются по ключу (timestamp, id пользователя)
+        db.Index('ix_follows_followed_id_timestamp', 'followed_id', 'timestamp'),
+        db.Index('ix_follows_follower_id_timestamp', 'follower_id', 'timestamp'),
+    )
     follower_id = db.Column(db.Integer,
                             db.ForeignKey('users.id', ondelete='CASCADE'),
                             primary_key=True)
 
+    # Способ загрузки пользователей задаётся в каждом запросе (joinedload/selectinload),
+    # глобальная жадная загрузка подтягивала обе стороны подписки даже там, где нужна одна.
     follower = db.relationship('User',
                                foreign_keys=[follower_id],
-                               back_populates='followed',
-                               # Нужна одна жадная загрузка вместо кучи маленьких (проблема N+1).
-                               # В режиме lazy='joined' связанные объекты извлекаются немедленно из
-                               # запроса соединения.
-                               lazy='joined')
+                               back_populates='followed')
 
     followed_id = db.Column(db.Integer,
                             db.ForeignKey('users.id', ondelete='CASCADE'),
@@ -86,13 +132,11 @@ class Follow(db.Model):
 
     followed = db.relationship('User',
                                foreign_keys=[followed_id],
-                               back_populates='followers',
-                               # Нужна одна жадная загрузка вместо кучи маленьких (проблема N+1).
-                               # В режиме lazy='joined' связанные объекты извлекаются немедленно из
-                               # запроса соединения.
-                               lazy='joined')
+                               back_populates='followers')
 
-    timestamp = db.Column(db.DateTime, default=db.func.now())
+    # Время задаётся на стороне приложения: значение хранится в том же формате, что и
+    # параметры запросов, иначе сравнение с курсором пагинации в SQLite даёт неверный результат.
+    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     def __repr__(self):
         return f'<Follow(followed_id = {self.followed_id}, follower_id = {self.follower_id})>'
@@ -115,9 +159,11 @@ class User(db.Model, UserMixin):
     # Нужно постоянно обновлять, для этого сделан отдельный метод ping
     last_seen = db.Column(db.DateTime(), default=datetime.now(timezone.utc))
 
+    # Коллекции в режиме lazy='write_only' никогда не загружаются неявно: элементы
+    # выбираются явным запросом `user.posts.select()` с нужной пагинацией и стратегией загрузки.
     posts = db.relationship('Post',
                             back_populates='author',
-                            lazy='dynamic',
+                            lazy='write_only',
                             cascade='all, delete-orphan',
                             passive_deletes=True)
 
@@ -134,7 +180,7 @@ class User(db.Model, UserMixin):
     followers = db.relationship('Follow',
                                 foreign_keys=[Follow.followed_id],
                                 back_populates='followed',
-                                lazy='dynamic',
+                                lazy='write_only',
                                 cascade='all, delete-orphan',
                                 passive_deletes=True)
 
@@ -142,16 +188,23 @@ class User(db.Model, UserMixin):
     followed = db.relationship('Follow',
                                foreign_keys=[Follow.follower_id],
                                back_populates='follower',
-                               lazy='dynamic',
+                               lazy='write_only',
                                cascade='all, delete-orphan',
                                passive_deletes=True)
 
     comments = db.relationship('Comment',
                                back_populates='author',
-                               lazy='dynamic',
+                               lazy='write_only',
                                cascade='all, delete-orphan',
                                passive_deletes=True)
 
+    # Денормализованные счётчики для профиля (подписка на самого себя не учитывается).
+    # Поддерживаются обработчиками событий Follow/Post/Comment, расхождения исправляет `flask reconcile-counters`.
+    followers_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    posts_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     def to_json(self):
         json_user = {
             'url': url_for('api_v1.get_user_profile', username=self.username, _external=True),
@@ -161,39 +214,91 @@ class User(db.Model, UserMixin):
             'location': self.location,
             'member_since': self.member_since,
             'last_seen': self.last_seen,
-            'following_list': [follows.followed.username for follows in self.followed],
-            'following_count': self.followed.count() - 1,
-            'followers_list': [follows.follower.username for follows in self.followers],
-            'followers_count': self.followers.count() - 1,
+            'following': url_for('api_v1.get_user_following', username=self.username, _external=True),
+            'following_count': self.following_count,
+            'followers': url_for('api_v1.get_user_followers', username=self.username, _external=True),
+            'followers_count': self.followers_count,
             'posts': url_for('api_v1.get_user_posts', username=self.username, _external=True),
             'feed': url_for('api_v1.get_user_feed', username=self.username, _external=True),
-            'posts_count': self.posts.count(),
-            'comments_count': self.comments.count()
+            'posts_count': self.posts_count,
+            'comments_count': self.comments_count
         }
 
         return json_user
 
     def generate_auth_token(self, expiration=216000):
+        """Выдаёт токен API. Идентификатор токена `jti` позволяет отозвать его досрочно."""
         s = URLSafeTimedSerializer(current_app.config['SECRET_KEY'], expiration)
-        token = s.dumps({'id': self.id}, salt='auth-token-salt')
+        token = s.dumps({'id': self.id, 'jti': uuid4().hex}, salt='auth-token-salt')
         return token
 
     @staticmethod
-    def verify_auth_token(token, expiration=216000):
+    def decode_auth_token(token, expiration=216000):
+        """Проверяет подпись и срок действия токена API, не обращаясь к БД.
+
+        Returns:
+            dict | None: {'id': id пользователя, 'jti': id токена (None у старых токенов),
+                'expires_at': время истечения (UTC)} или None, если токен недействителен.
+        """
         s = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
         try:
-            data = s.loads(token, salt='auth-token-salt', max_age=expiration)
+            data, signed_at = s.loads(token, salt='auth-token-salt', max_age=expiration, return_timestamp=True)
         except (BadSignature, SignatureExpired):
             return None
 
+        return {
+            'id': data['id'],
+            'jti': data.get('jti'),
+            'expires_at': signed_at + timedelta(seconds=expiration),
+        }
+
+    @staticmethod
+    def verify_auth_token(token, expiration=216000):
+        data = User.decode_auth_token(token, expiration)
+        if data is None or RevokedToken.is_revoked(data['jti']):
+            return None
+
         return db.session.get(User, data['id'])
 
     @property
     def feed_posts(self):
-        stmt = (select(Post).join(Follow, Post.author_id == Follow.followed_id).
-                where(Follow.follower_id == self.id).
-                order_by(Post.timestamp.desc()))
-        return stmt
+        """Запрос постов ленты пользователя (от новых к старым)."""
+        return self.feed_timeline()[0]
+
+    def feed_timeline(self):
+        """Запрос ленты пользователя и колонки ключа его сортировки (timestamp, id).
+
+        Лента - это собственные посты пользователя и посты авторов, на которых он подписан.
+        Она читается из материализованной таблицы `timeline` (fan-out on write): при публикации
+        пост раскладывается в ленты подписчиков и в ленту самого автора. Посты авторов с очень
+        большим числом подписчиков в ленты подписчиков не раскладываются
+        (см. `Config.FEED_FANOUT_MAX_FOLLOWERS`) и подмешиваются при чтении; в ленту самого
+        автора пост попадает всегда.
+
+        Returns:
+            tuple: (запрос Select, колонка времени, колонка id) - для keyset-пагинации.
+        """
+        threshold = current_app.config['FEED_FANOUT_MAX_FOLLOWERS']
+        celebrity_ids = db.session.scalars(
+            select(Follow.followed_id)
+            .join(User, User.id == Follow.followed_id)
+            .where(Follow.follower_id == self.id, User.followers_count > threshold)
+        ).all()
+
+        if not celebrity_ids:
+            # Обычный случай: лента целиком берётся из индекса timeline (user_id, timestamp, post_id)
+            stmt = (select(Post)
+                    .join(TimelineEntry, TimelineEntry.post_id == Post.id)
+                    .where(TimelineEntry.user_id == self.id)
+                    .order_by(TimelineEntry.timestamp.desc(), TimelineEntry.post_id.desc()))
+            return stmt, TimelineEntry.timestamp, TimelineEntry.post_id
+
+        # Гибридный режим: материализованная лента + посты «популярных» авторов
+        in_timeline = select(TimelineEntry.post_id).where(TimelineEntry.user_id == self.id)
+        stmt = (select(Post)
+                .where(or_(Post.id.in_(in_timeline), Post.author_id.in_(celebrity_ids)))
+                .order_by(Post.timestamp.desc(), Post.id.desc()))
+        return stmt, Post.timestamp, Post.id
 
     def __init__(self, **kwargs):
         """Инициализирует объект пользователя и назначает роль администратора, если email совпадает
@@ -223,18 +328,16 @@ class User(db.Model, UserMixin):
         super().__init__(**kwargs)
         if self.email == current_app.config['ADMIN_EMAIL']:
             stmt = select(Role).where(Role.permissions == 0xff)
-            self.role = db.session.scalar(stmt).one()
-
-        # self.follow(self)   # Подписаться на самого себя (для отображения своих сообщений в ленте)
+            self.role = db.session.scalars(stmt).one()
 
     def is_following(self, user):
-        return self.followed.filter_by(followed_id=user.id).first() is not None
+        return db.session.get(Follow, (self.id, user.id)) is not None
 
     def is_followed_by(self, user):
-        return self.followers.filter_by(follower_id=user.id).first() is not None
+        return db.session.get(Follow, (user.id, self.id)) is not None
 
     def follow(self, user):
-        if not self.is_following(user):
+        if user.id != self.id and not self.is_following(user):
             f = Follow(follower=self, followed=user)
             db.session.add(f)
             db.session.commit()
@@ -242,9 +345,9 @@ class User(db.Model, UserMixin):
     def unfollow(self, user):
         """Удаление подписки на пользователя.
         Что происходит: удаляется запись из таблицы follows (т.е. удаляется Follow-объект).
-        Доступ к записям осуществляется через self.followed .
+        Запись ищется по первичному ключу (follower_id, followed_id).
         """
-        f = self.followed.filter_by(followed_id=user.id).first()
+        f = db.session.get(Follow, (self.id, user.id))
         if f:
             db.session.delete(f)
             db.session.commit()
@@ -253,12 +356,14 @@ class User(db.Model, UserMixin):
     def generate_fake(count=10):
         fake = Faker('ru_Ru')
         users = []
-        for _ in range(count):
+        # Хеши всех паролей вычисляются пакетом, параллельно в пуле процессов
+        password_hashes = password_hasher.hash_many([fake.password(length=12) for _ in range(count)])
+        for password_hash in password_hashes:
             user = User(
                 username=fake.unique.user_name(),
                 name=f"{fake.first_name()} {fake.last_name()}",
                 email=fake.unique.email(),
-                password=generate_password_hash(fake.password(length=12)),
+                password_hash=password_hash,
                 confirmed=True,
                 location=fake.city(),
                 about_me=fake.text(max_nb_chars=200),
@@ -268,29 +373,28 @@ class User(db.Model, UserMixin):
             db.session.add(user)
             users.append(user)
         try:
-            db.session.flush()  # Получаем id, но не коммитим
-            for user in users:
-                user.add_self_follow()  # Пользователи подписываются на себя
             db.session.commit()
             return users
         except Exception as e:
             db.session.rollback()
             raise e
 
-    def add_self_follow(self):
-        """Метод для подписки создаваемого пользователя на самого себя."""
-        if not self.is_following(self):
-            f = Follow(follower=self, followed=self)
-            db.session.add(f)
-
     @staticmethod
-    def add_self_follows():
-        """Регистрация существующих пользователей
-        как читающих самих себя.
+    def remove_self_follows():
+        """Удаляет устаревшие подписки пользователей на самих себя.
+
+        Раньше они были нужны, чтобы свои посты попадали в ленту. Теперь посты автора
+        раскладываются в его собственную ленту напрямую, а счётчики подписок такие строки
+        никогда не учитывали, поэтому удаление выполняется одним DELETE без событий ORM.
+
+        Returns:
+            int: Количество удалённых строк.
         """
-        for user in db.session.scalars(select(User)).all():
-            user.add_self_follow()
+        result = db.session.execute(
+            delete(Follow).where(Follow.follower_id == Follow.followed_id)
+            .execution_options(synchronize_session=False))
         db.session.commit()
+        return result.rowcount
 
     # @property определяет метод класса как свойство с доступом как к обычному атрибуту.
     @property
@@ -301,12 +405,34 @@ class User(db.Model, UserMixin):
 
     @password.setter
     def password(self, password):   # Сеттер
-        """Установка пароля и автоматическое сохранение его в виде хэша."""
-        self.password_hash = generate_password_hash(password)
+        """Установка пароля и автоматическое сохранение его в виде хэша (в пуле процессов)."""
+        self.password_hash = password_hasher.hash(password)
 
     def verify_password(self, password):
-        """Проверка хэша пароля."""
-        return check_password_hash(self.password_hash, password)
+        """Проверка хэша пароля.
+
+        Если хэш создан с устаревшим алгоритмом или параметрами (`PASSWORD_HASH_METHOD`),
+        после успешной проверки пароль перехешируется и сразу сохраняется в отдельной
+        транзакции: прочие изменения текущего сеанса БД не фиксируются.
+        """
+        password_hash = self.password_hash
+        if not password_hasher.verify(password_hash, password):
+            return False
+
+        if password_hasher.needs_rehash(password_hash):
+            new_hash = password_hasher.hash(password)
+            users = User.__table__
+            # UPDATE с условием на старый хэш не затрёт пароль, сменённый параллельно
+            with db.engine.begin() as connection:
+                updated = connection.execute(
+                    update(users)
+                    .where(users.c.id == self.id, users.c.password_hash == password_hash)
+                    .values(password_hash=new_hash)).rowcount
+            if updated:
+                # Объект сеанса видит новый хэш, не становясь изменённым
+                set_committed_value(self, 'password_hash', new_hash)
+
+        return True
 
     def generate_confirmation_token(self, expiration=3600):
         """Генерация подписанного токена для подтверждения email."""
@@ -352,21 +478,101 @@ class User(db.Model, UserMixin):
 
             >>> user.can(4)  # Проверка разрешения на выполнение
             False
+
+        В рамках запроса результат запоминается в `g`: шаблоны вызывают проверки прав
+        (например, `is_administrator()`) для каждого поста на странице.
         """
-        return self.role is not None and (self.role.permissions & permissions) == permissions
+        if self.id is None or not has_request_context():
+            return self.role is not None and (self.role.permissions & permissions) == permissions
+
+        checks = g.setdefault('_permission_checks', {})
+        key = (self.id, self.role_id, permissions)
+        if key not in checks:
+            checks[key] = self.role is not None and (self.role.permissions & permissions) == permissions
+        return checks[key]
 
     def is_administrator(self):
         return self.can(Permission.ADMINISTER)
 
     def ping(self):
-        self.last_seen = datetime.now(timezone.utc)
-        db.session.add(self)
-        db.session.commit()
+        """Отмечает посещение пользователя.
+
+        В БД время записывается отложенно и пакетами (см. `app.last_seen`), поэтому
+        запрос не выполняет собственный UPDATE и COMMIT. Значение атрибута обновляется
+        без пометки объекта как изменённого.
+        """
+        seen_at = last_seen_buffer.touch(self.id, self.last_seen)
+        if seen_at is not None:
+            set_committed_value(self, 'last_seen', seen_at)
+            identity_cache.update_last_seen(self.id, seen_at)
+
+    @staticmethod
+    def update_counters(connection, user_id, **deltas):
+        """Изменяет счётчики пользователя на заданные величины в текущей транзакции.
+
+        Вызывается из обработчиков событий, поэтому работает через connection flush'а,
+        а не через сессию.
+
+        Example:
+            >>> User.update_counters(connection, 1, posts_count=1)
+        """
+        users = User.__table__
+        values = {name: users.c[name] + delta for name, delta in deltas.items() if delta}
+        if user_id is None or not values:
+            return
+        connection.execute(update(users).where(users.c.id == user_id).values(**values))
 
     def __repr__(self):
         return f'User (id = {self.id}, username = {self.username}, email = {self.email})'
 
 
+def _on_follow_changed(delta):
+    def listener(mapper, connection, target):
+        User.update_counters(connection, target.followed_id, followers_count=delta)
+        User.update_counters(connection, target.follower_id, following_count=delta)
+    return listener
+
+
+def _on_follow_inserted(mapper, connection, target):
+    TimelineEntry.backfill(connection, target.follower_id, target.followed_id)
+
+
+def _on_follow_deleted(mapper, connection, target):
+    TimelineEntry.prune(connection, target.follower_id, target.followed_id)
+    # Счётчик уже уменьшен (_on_follow_changed): автор мог вернуться под порог рассылки
+    if TimelineEntry.followers_count(connection, target.followed_id) == current_app.config['FEED_FANOUT_MAX_FOLLOWERS']:
+        TimelineEntry.materialize(connection, target.followed_id)
+
+
+# Счётчики подписчиков/подписок и лента подписчика обновляются при каждом изменении подписки
+db.event.listen(Follow, 'after_insert', _on_follow_changed(1))
+db.event.listen(Follow, 'after_delete', _on_follow_changed(-1))
+db.event.listen(Follow, 'after_insert', _on_follow_inserted)
+db.event.listen(Follow, 'after_delete', _on_follow_deleted)
+
+
+def _on_user_updated(mapper, connection, target):
+    """Сбрасывает закешированные учётные данные при изменении полей аутентификации."""
+    attrs = db.inspect(target).attrs
+    if any(attrs[field].history.has_changes() for field in AUTH_FIELDS if field != 'last_seen'):
+        identity_cache.invalidate(target.id)
+
+
+def _on_user_deleted(mapper, connection, target):
+    identity_cache.invalidate(target.id)
+
+
+def _on_role_changed(mapper, connection, target):
+    # Разрешения роли хранятся в кеше у каждого пользователя с этой ролью
+    identity_cache.clear()
+
+
+db.event.listen(User, 'after_update', _on_user_updated)
+db.event.listen(User, 'after_delete', _on_user_deleted)
+db.event.listen(Role, 'after_update', _on_role_changed)
+db.event.listen(Role, 'after_delete', _on_role_changed)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def can(self, permissions):
         return False
@@ -381,9 +587,26 @@ login_manager.anonymous_user = AnonymousUser
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        # Для keyset-пагинации постов автора (профиль) по ключу (timestamp, id).
+        # Общая лента использует индекс по timestamp: в SQLite он уже включает rowid (id).
+        db.Index('ix_posts_author_id_timestamp', 'author_id', 'timestamp', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, index=True, default=datetime.now(timezone.utc))
+    # Заранее отрендеренный HTML поста и версия рендерера, которой он получен.
+    # Заполняются автоматически при изменении body (см. Post.on_changed_body).
+    body_html = db.Column(db.Text)
+    body_html_version = db.Column(db.Integer)
+    # Превью поста для списков: обрезанный текст, его HTML и признак того, что текст обрезан
+    body_excerpt = db.Column(db.Text)
+    body_excerpt_html = db.Column(db.Text)
+    body_has_more = db.Column(db.Boolean, default=False)
+    # Денормализованные счётчики комментариев (всех и не заблокированных модератором).
+    # Поддерживаются обработчиками событий Comment, расхождения исправляет `flask reconcile-counters`.
+    comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    enabled_comments_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    timestamp = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc))
 
     author_id = db.Column(db.Integer,
                           db.ForeignKey('users.id', ondelete='CASCADE'))
@@ -394,57 +617,44 @@ class Post(db.Model):
 
     comments = db.relationship('Comment',
                                back_populates='post',
-                               lazy='dynamic',
+                               lazy='write_only',
                                cascade='all, delete-orphan',
                                passive_deletes=True)
 
-    def to_json(self, include_disabled_comments=False, only_few_comments=False):
+    def to_json(self, include_disabled_comments=False, only_few_comments=False, excerpt=False):
         """
         Сериализует объект поста в словарь, пригодный для преобразования в JSON.
 
         Включает основную информацию о посте, а также связанные комментарии.
         Поддерживает опции для включения отключённых комментариев и сокращённого режима отображения.
+        Формат ответа определяется в `app.api.v1.serializers.serialize_posts`, здесь - для одного поста.
 
         Аргументы:
             include_disabled_comments (bool): Если True — включает в вывод отключённые комментарии.
                 Если False — исключает их. По умолчанию False.
-            only_few_comments (bool): Если True — возвращаются только первые три комментария (после фильтрации).
-                Полезно для превью. По умолчанию False.
+            only_few_comments (bool): Если True — возвращаются только последние COMMENTS_PREVIEW_COUNT
+                комментариев (после фильтрации). Полезно для превью. По умолчанию False.
+            excerpt (bool): Если True — вместо полного текста отдаётся сохранённое превью поста.
+                Используется в списках постов. По умолчанию False.
 
         Возвращает:
             dict: Словарь, содержащий сериализованные данные поста:
                 - 'url' (str): Абсолютный URL поста.
-                - 'body' (str): Текст поста.
+                - 'body' (str): Текст поста (или его превью при excerpt=True).
+                - 'body_truncated' (bool): Признак того, что в 'body' отдано обрезанное превью.
                 - 'timestamp' (datetime): Дата и время создания поста.
                 - 'author' (str): URL профиля автора.
                 - 'comments' (list): Список сериализованных комментариев.
                 - 'comments_count (including disabled)' (int): Общее количество комментариев, включая отключённые.
     """
-        json_post = {
-            'url': url_for('api_v1.get_post', id=self.id, _external=True),
-            'body': self.body,
-            'timestamp': self.timestamp,
-            'author': url_for('api_v1.get_user_profile', username=self.author.username, _external=True),
-            'comments': [],
-            'comments_count (including disabled)': self.comments.count()
-        }
-
-        if include_disabled_comments:
-            # Отключаем показ заблокированных комментов
-            comments = self.comments.all()
-        else:
-            comments = self.comments.filter(
-                # (Comment.disabled.is_(False)) | (Comment.disabled.is_(None))
-                Comment.disabled.isnot(True)
-            ).all()
-
-        if only_few_comments:
-            # Показать тольк опервые 3 коммента
-            comments = comments[:3]
+        # Импорт здесь: модуль сериализации сам импортирует модели
+        from .api.v1.serializers import serialize_post
 
-        json_post['comments'] = [comment.to_json(include_post_info=False) for comment in comments]
-
-        return json_post
+        return serialize_post(
+            self,
+            include_disabled_comments=include_disabled_comments,
+            excerpt=excerpt,
+            comments_limit=current_app.config['COMMENTS_PREVIEW_COUNT'] if only_few_comments else None)
 
     @staticmethod
     def from_json(json_post: dict) -> 'Post':
@@ -487,9 +697,99 @@ class Post(db.Model):
 
         return Post(body=body)
 
+    @staticmethod
+    def load_comment_previews(post_ids, limit=None, include_disabled=False):
+        """Загружает последние комментарии сразу для нескольких постов одним запросом.
+
+        Комментарии нумеруются оконной функцией `ROW_NUMBER() OVER (PARTITION BY post_id)`
+        от новых к старым, и из БД читаются только первые `limit` строк каждого поста,
+        сколько бы комментариев у него ни было.
+
+        Args:
+            post_ids (Iterable[int]): id постов страницы.
+            limit (int | None): Сколько комментариев брать на пост (по умолчанию COMMENTS_PREVIEW_COUNT).
+            include_disabled (bool): Включать заблокированные модератором комментарии.
+
+        Returns:
+            dict[int, list[Comment]]: Комментарии каждого поста в хронологическом порядке.
+        """
+        post_ids = list(post_ids)
+        if limit is None:
+            limit = current_app.config['COMMENTS_PREVIEW_COUNT']
+        previews = {post_id: [] for post_id in post_ids}
+        if not post_ids or limit <= 0:
+            return previews
+
+        ranked = (select(Comment.id,
+                         db.func.row_number().over(
+                             partition_by=Comment.post_id,
+                             order_by=(Comment.created_at.desc(), Comment.id.desc())).label('rn'))
+                  .where(Comment.post_id.in_(post_ids)))
+        if not include_disabled:
+            ranked = ranked.where(Comment.disabled.isnot(True))
+        ranked = ranked.subquery()
+
+        stmt = (select(Comment)
+                .join(ranked, ranked.c.id == Comment.id)
+                .where(ranked.c.rn <= limit)
+                .order_by(Comment.post_id, Comment.created_at, Comment.id))
+        for comment in db.session.scalars(stmt):
+            previews[comment.post_id].append(comment)
+
+        return previews
+
+    @property
+    def is_rendered(self):
+        """Сохранённые HTML и превью получены текущей версией рендерера."""
+        return self.body_html is not None and self.body_html_version == MARKDOWN_RENDERER_VERSION
+
     # 🔹 Метод для рендеринга Markdown → HTML
     def render_html(self):
-        return mistune.markdown(self.body)
+        """Возвращает HTML поста.
+
+        Берёт сохранённый `body_html`, если он получен текущей версией рендерера,
+        иначе рендерит Markdown на лету (для строк, ещё не обработанных `flask render-posts`).
+        """
+        if self.is_rendered:
+            return self.body_html
+        return render_markdown(self.body)
+
+    def render_excerpt_html(self):
+        """Возвращает HTML превью поста (аналогично render_html)."""
+        if self.is_rendered:
+            return self.body_excerpt_html
+        return render_markdown(make_excerpt(self.body)[0])
+
+    def get_excerpt(self):
+        """Возвращает пару (текст превью, признак обрезки)."""
+        if self.is_rendered:
+            return self.body_excerpt, bool(self.body_has_more)
+        return make_excerpt(self.body)
+
+    @staticmethod
+    def render_body(body):
+        """Вычисляет все производные от body поля: HTML поста и его превью.
+
+        Returns:
+            dict: Значения колонок body_html, body_html_version, body_excerpt,
+                body_excerpt_html и body_has_more.
+        """
+        excerpt, has_more = make_excerpt(body)
+        body_html = render_markdown(body)
+        return {
+            'body_html': body_html,
+            'body_html_version': MARKDOWN_RENDERER_VERSION,
+            'body_excerpt': excerpt,
+            # Короткий пост целиком помещается в превью - HTML не рендерится повторно
+            'body_excerpt_html': render_markdown(excerpt) if has_more else body_html,
+            'body_has_more': has_more,
+        }
+
+    @staticmethod
+    def on_changed_body(target, value, oldvalue, initiator):
+        """Обработчик события изменения body: перерендеривает сохранённые HTML и превью."""
+        for column, rendered in Post.render_body(value).items():
+            setattr(target, column, rendered)
 
     @staticmethod
     def generate_fake(count=10, author_ids=None):
@@ -514,11 +814,46 @@ class Post(db.Model):
         return new_posts
 
 
+# HTML и превью поста рендерятся один раз при создании/редактировании, а не при каждом показе
+db.event.listen(Post.body, 'set', Post.on_changed_body)
+
+
+def _on_post_inserted(mapper, connection, target):
+    User.update_counters(connection, target.author_id, posts_count=1)
+    TimelineEntry.fan_out(connection, target.id, target.author_id)
+
+
+def _on_post_deleting(mapper, connection, target):
+    """Перед удалением поста уменьшает счётчики автора и комментаторов.
+
+    Комментарии поста удаляются каскадно средствами БД (passive_deletes), события Comment
+    для них не срабатывают, поэтому счётчики комментаторов корректируются здесь.
+    """
+    User.update_counters(connection, target.author_id, posts_count=-1)
+
+    users, comments = User.__table__, Comment.__table__
+    post_comments = (select(db.func.count())
+                     .where(comments.c.post_id == target.id, comments.c.author_id == users.c.id)
+                     .scalar_subquery())
+    connection.execute(
+        update(users)
+        .where(users.c.id.in_(select(comments.c.author_id).where(comments.c.post_id == target.id)))
+        .values(comments_count=users.c.comments_count - post_comments))
+
+
+db.event.listen(Post, 'after_insert', _on_post_inserted)
+db.event.listen(Post, 'before_delete', _on_post_deleting)
+
+
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        # Выборка комментариев поста по ключу (created_at, id) и пересчёт счётчиков поста
+        db.Index('ix_comments_post_id_created_at', 'post_id', 'created_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, index=True, default=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc))
     disabled = db.Column(db.Boolean)
 
     author_id = db.Column(db.Integer,
@@ -534,23 +869,298 @@ class Comment(db.Model):
                            back_populates='comments')
 
     def to_json(self, include_post_info=True):
-        json_comment = {
-            'url': url_for('api_v1.get_comment', id=self.id, _external=True),
-            'body': self.body,
-            'created_at': self.created_at,
-            'author': url_for('api_v1.get_user_profile', username=self.author.username, _external=True)
-        }
+        """Сериализует комментарий (формат - `app.api.v1.serializers.serialize_comments`)."""
+        from .api.v1.serializers import serialize_comment
+
+        return serialize_comment(self, include_post_info=include_post_info)
+
+    @property
+    def is_enabled(self):
+        return self.disabled is not True
+
+    @staticmethod
+    def _update_post_counters(connection, post_id, total, enabled):
+        """Изменяет счётчики комментариев поста в той же транзакции, что и сам комментарий."""
+        if post_id is None or (total == 0 and enabled == 0):
+            return
+        connection.execute(
+            update(Post.__table__)
+            .where(Post.__table__.c.id == post_id)
+            .values(comments_count=Post.__table__.c.comments_count + total,
+                    enabled_comments_count=Post.__table__.c.enabled_comments_count + enabled))
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        Comment._update_post_counters(connection, target.post_id, 1, int(target.is_enabled))
+        User.update_counters(connection, target.author_id, comments_count=1)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        Comment._update_post_counters(connection, target.post_id, -1, -int(target.is_enabled))
+        User.update_counters(connection, target.author_id, comments_count=-1)
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        """Пересчитывает счётчик включённых комментариев при блокировке/разблокировке."""
+        history = db.inspect(target).attrs.disabled.history
+        if not history.has_changes():
+            return
+        if not history.deleted:
+            # Старое значение не было загружено - пересчитываем счётчик поста целиком
+            Comment._recount_enabled(connection, target.post_id)
+            return
+        was_enabled = history.deleted[0] is not True
+        Comment._update_post_counters(connection, target.post_id, 0, int(target.is_enabled) - int(was_enabled))
+
+    @staticmethod
+    def _recount_enabled(connection, post_id):
+        comments = Comment.__table__
+        enabled = (select(db.func.count())
+                   .where(comments.c.post_id == post_id, comments.c.disabled.isnot(True))
+                   .scalar_subquery())
+        connection.execute(
+            update(Post.__table__).where(Post.__table__.c.id == post_id).values(enabled_comments_count=enabled))
+
+
+# Счётчики комментариев поста и автора обновляются при каждом изменении комментария
+db.event.listen(Comment, 'after_insert', Comment.on_inserted)
+db.event.listen(Comment, 'after_delete', Comment.on_deleted)
+db.event.listen(Comment, 'after_update', Comment.on_updated)
+
+
+class TimelineEntry(db.Model):
+    """Материализованная лента пользователя (fan-out on write).
+
+    При публикации поста в ленты всех подписчиков автора добавляется по строке,
+    поэтому чтение ленты - это диапазонный просмотр индекса (user_id, timestamp, post_id)
+    без соединения posts с follows и сортировки во время запроса.
+    Строки удаляются каскадно вместе с постом или пользователем.
+    """
+    __tablename__ = 'timeline'
+    __table_args__ = (
+        db.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp', 'post_id'),
+    )
+
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='CASCADE'),
+                        primary_key=True)
+    post_id = db.Column(db.Integer,
+                        db.ForeignKey('posts.id', ondelete='CASCADE'),
+                        primary_key=True)
+    # Копия Post.timestamp: лента сортируется без обращения к таблице posts
+    timestamp = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<TimelineEntry(user_id = {self.user_id}, post_id = {self.post_id})>'
+
+    @staticmethod
+    def followers_count(connection, author_id):
+        """Количество подписчиков автора в текущей транзакции."""
+        users = User.__table__
+        return connection.scalar(select(users.c.followers_count).where(users.c.id == author_id)) or 0
+
+    @staticmethod
+    def is_fanout_author(connection, author_id):
+        """Посты автора раскладываются по лентам, если у него не слишком много подписчиков."""
+        return TimelineEntry.followers_count(connection, author_id) <= current_app.config['FEED_FANOUT_MAX_FOLLOWERS']
+
+    @staticmethod
+    def fan_out(connection, post_id, author_id):
+        """Добавляет новый пост в ленты автора и всех его подписчиков одним INSERT ... SELECT.
+
+        В ленту автора пост добавляется всегда, в ленты подписчиков - только если автор
+        не «популярный» (см. `is_fanout_author`).
+        """
+        timeline, follows, posts = TimelineEntry.__table__, Follow.__table__, Post.__table__
+        readers = select(db.literal(author_id).label('user_id'))
+        if TimelineEntry.is_fanout_author(connection, author_id):
+            readers = union_all(
+                select(follows.c.follower_id.label('user_id')).where(follows.c.followed_id == author_id),
+                readers)
+        readers = readers.subquery()
+        connection.execute(insert(timeline).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            select(readers.c.user_id, posts.c.id, posts.c.timestamp)
+            .select_from(readers.join(posts, posts.c.id == post_id))))
 
-        if include_post_info:
-            # Опционально добавляем инфо о посте
-            json_comment['post_url'] = url_for('api_v1.get_post', id=self.post_id, _external=True)
-            json_comment['post'] = self.post.body[:40]
+    @staticmethod
+    def materialize(connection, author_id):
+        """Раскладывает последние посты автора в ленты всех его подписчиков.
+
+        Вызывается, когда автор возвращается под порог `FEED_FANOUT_MAX_FOLLOWERS`: посты,
+        написанные выше порога, подмешивались при чтении и в лентах подписчиков их нет.
+        Берётся столько последних постов, сколько добавляется в ленту при подписке.
+        """
+        timeline, follows, posts = TimelineEntry.__table__, Follow.__table__, Post.__table__
+        recent = (select(posts.c.id, posts.c.timestamp)
+                  .where(posts.c.author_id == author_id)
+                  .order_by(posts.c.timestamp.desc())
+                  .limit(current_app.config['FEED_BACKFILL_POSTS'])
+                  .subquery())
+        already_added = exists().where(timeline.c.user_id == follows.c.follower_id, timeline.c.post_id == recent.c.id)
+        connection.execute(insert(timeline).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            select(follows.c.follower_id, recent.c.id, recent.c.timestamp)
+            .select_from(follows.join(recent, db.true()))
+            .where(follows.c.followed_id == author_id, ~already_added)))
+
+    @staticmethod
+    def backfill(connection, follower_id, followed_id):
+        """При подписке добавляет в ленту подписчика последние посты автора."""
+        if not TimelineEntry.is_fanout_author(connection, followed_id):
+            return
+        timeline, posts = TimelineEntry.__table__, Post.__table__
+        already_added = exists().where(timeline.c.user_id == follower_id, timeline.c.post_id == posts.c.id)
+        connection.execute(insert(timeline).from_select(
+            ['user_id', 'post_id', 'timestamp'],
+            select(db.literal(follower_id), posts.c.id, posts.c.timestamp)
+            .where(posts.c.author_id == followed_id, ~already_added)
+            .order_by(posts.c.timestamp.desc())
+            .limit(current_app.config['FEED_BACKFILL_POSTS'])))
+
+    @staticmethod
+    def prune(connection, follower_id, followed_id):
+        """При отписке удаляет посты автора из ленты бывшего подписчика."""
+        timeline, posts = TimelineEntry.__table__, Post.__table__
+        connection.execute(
+            delete(timeline)
+            .where(timeline.c.user_id == follower_id,
+                   timeline.c.post_id.in_(select(posts.c.id).where(posts.c.author_id == followed_id))))
+
+
+class RevokedToken(db.Model):
+    """Досрочно отозванные токены API.
+
+    Проверка отзыва на каждый запрос выполняется по фильтру Блума в памяти
+    (см. `app.api.v1.tokens`), таблица - его источник и точная проверка при
+    срабатывании фильтра. Строки с истёкшими токенами удаляет `flask prune-revoked-tokens`.
+    """
+    __tablename__ = 'revoked_tokens'
+
+    jti = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer,
+                        db.ForeignKey('users.id', ondelete='CASCADE'),
+                        index=True)
+    revoked_at = db.Column(db.DateTime, index=True, default=lambda: datetime.now(timezone.utc))
+    # Время истечения самого токена: после него запись об отзыве больше не нужна
+    expires_at = db.Column(db.DateTime, index=True)
+
+    def __repr__(self):
+        return f'<RevokedToken(jti = {self.jti}, user_id = {self.user_id})>'
+
+    @staticmethod
+    def is_revoked(jti):
+        """Точная проверка отзыва токена по БД."""
+        if jti is None:
+            return False
+        return db.session.scalar(select(exists().where(RevokedToken.jti == jti)))
+
+    @staticmethod
+    def prune(now=None):
+        """Удаляет записи об отзыве уже истёкших токенов. Возвращает количество удалённых строк."""
+        now = now or datetime.now(timezone.utc)
+        result = db.session.execute(delete(RevokedToken).where(RevokedToken.expires_at < now))
+        db.session.commit()
+        return result.rowcount
+
+
+class EmailOutbox(db.Model):
+    """Исходящие письма (transactional outbox).
 
-        return json_comment
+    Письмо добавляется в ту же транзакцию, что и изменение, которое его вызвало
+    (`EmailOutbox.enqueue()` перед `commit`), поэтому не теряется при перезапуске
+    процесса и не уходит, если транзакция откатилась. Шаблоны рендерит и письма отправляет
+    отдельный процесс `flask send-outbox` (см. `app/services/outbox.py`).
+
+    Параметры шаблона хранятся в JSON; объекты моделей сохраняются ссылкой
+    (имя класса и первичный ключ) и загружаются заново при рендеринге.
+    """
+    __tablename__ = 'email_outbox'
+    __table_args__ = (
+        # Выборка готовых к отправке писем
+        db.Index('ix_email_outbox_status_available_at', 'status', 'available_at'),
+    )
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Ключ идемпотентности: письмо с тем же ключом повторно не ставится в очередь
+    key = db.Column(db.String(128), unique=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    template = db.Column(db.String(128), nullable=False)
+    context = db.Column(db.JSON, nullable=False, default=dict)
+    # Адрес сайта из запроса, в котором создано письмо: для ссылок с _external=True
+    base_url = db.Column(db.String(255))
+    # Заранее отрендеренные текст и HTML (массовые рассылки рендерятся пакетно, см. `services.digest`).
+    # Если заданы, шаблон при отправке не рендерится.
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+
+    status = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Не отправлять раньше этого времени (задержка перед повторной попыткой)
+    available_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # Аренда: письмо захвачено обработчиком claimed_by до claimed_until
+    claimed_by = db.Column(db.String(32))
+    claimed_until = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<EmailOutbox(id = {self.id}, recipient = {self.recipient}, status = {self.status})>'
+
+    @staticmethod
+    def enqueue(to, subject, template, key=None, **context):
+        """Добавляет письмо в текущую транзакцию. Commit выполняет вызывающий код.
+
+        Args:
+            to (str): Адрес получателя.
+            subject (str): Тема письма (без префикса `MAIL_SUBJECT_PREFIX`).
+            template (str): Имя шаблона без расширения (рендерятся .txt и .html).
+            key (str | None): Ключ идемпотентности.
+            **context: Параметры шаблона: значения JSON и объекты моделей.
+
+        Returns:
+            EmailOutbox | None: Добавленное письмо или None, если письмо с таким ключом уже есть.
+        """
+        if key is not None and db.session.scalar(select(exists().where(EmailOutbox.key == key))):
+            return None
+
+        email = EmailOutbox(
+            key=key,
+            recipient=to,
+            subject=current_app.config['MAIL_SUBJECT_PREFIX'] + subject,
+            template=template,
+            context=EmailOutbox.dump_context(context),
+            base_url=request.host_url if has_request_context() else None)
+        db.session.add(email)
+        return email
+
+    @staticmethod
+    def dump_context(context):
+        """Заменяет объекты моделей в параметрах шаблона ссылками на них."""
+        return {name: {'__model__': type(value).__name__, 'id': db.inspect(value).identity[0]}
+                if isinstance(value, db.Model) else value
+                for name, value in context.items()}
+
+    @staticmethod
+    def load_context(context):
+        """Восстанавливает параметры шаблона, загружая объекты моделей по ссылкам."""
+        registry = db.Model.registry._class_registry
+        return {name: db.session.get(registry[value['__model__']], value['id'])
+                if isinstance(value, dict) and '__model__' in value else value
+                for name, value in context.items()}
 
 
 @login_manager.user_loader
 def load_user(user_id):
     """Загрузка пользователя по ID.
-    Требование Flask-Login."""
-    return db.session.get(User, int(user_id))
+    Требование Flask-Login.
+
+    Поля аутентификации и роль берутся из кеша между запросами (см. `app.identity_cache`),
+    при тёплом кеше запросов к БД не выполняется."""
+    return identity_cache.load(int(user_id))
@@ -0,0 +1,131 @@
+"""
+Постраничная навигация по ключу (keyset / seek pagination).
+
+В отличие от `db.paginate()`, который выполняет OFFSET-сканирование и COUNT(*) на каждой
+странице, здесь следующая страница выбирается условием по ключу сортировки
+`(timestamp, id)` последнего показанного элемента. Стоимость запроса не зависит от номера
+страницы, а общее количество элементов не считается.
+
+Пример использования:
+    pagination = keyset_paginate(
+        select(Post), Post.timestamp, Post.id,
+        per_page=20, after=request.args.get('after'))
+    pagination.items        # Элементы страницы
+    pagination.next_cursor  # Курсор для ?after= (более старые элементы)
+    pagination.prev_cursor  # Курсор для ?before= (более новые элементы)
+"""
+
+from datetime import datetime
+
+from flask import abort
+from sqlalchemy import and_, or_
+
+from . import db
+
+CURSOR_SEPARATOR = '_'
+
+
+def encode_cursor(timestamp, id):
+    """Кодирует ключ (timestamp, id) в строку курсора."""
+    return f'{timestamp.isoformat()}{CURSOR_SEPARATOR}{id}'
+
+
+def decode_cursor(cursor):
+    """Раскодирует строку курсора в ключ (timestamp, id).
+
+    Raises:
+        ValueError: Если курсор имеет неверный формат.
+    """
+    timestamp, _, id = cursor.rpartition(CURSOR_SEPARATOR)
+    return datetime.fromisoformat(timestamp), int(id)
+
+
+class KeysetPagination:
+    """Страница результатов keyset-пагинации.
+
+    Атрибуты совместимы по смыслу с `flask_sqlalchemy.pagination.Pagination`
+    (`items`, `has_next`, `has_prev`, `per_page`), но вместо номеров страниц
+    хранятся курсоры соседних страниц.
+    """
+
+    # Признак для шаблонов: выбирает макрос навигации по курсорам
+    cursor_based = True
+
+    def __init__(self, items, per_page, has_next, has_prev, key):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self._key = key
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(*self._key(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor(*self._key(self.items[0]))
+
+
+def _seek(timestamp_col, id_col, cursor, forward):
+    """Условие «строго после курсора» в направлении `forward` для ключа (timestamp, id)."""
+    timestamp, id = cursor
+    if forward:
+        return or_(timestamp_col > timestamp, and_(timestamp_col == timestamp, id_col > id))
+    return or_(timestamp_col < timestamp, and_(timestamp_col == timestamp, id_col < id))
+
+
+def keyset_paginate(stmt, timestamp_col, id_col, per_page, after=None, before=None,
+                    descending=True, key=None, decode=decode_cursor):
+    """Выбирает страницу результатов запроса по ключу (timestamp, id).
+
+    Args:
+        stmt (Select): Запрос без учёта пагинации. Его сортировка заменяется на сортировку по ключу.
+        timestamp_col: Колонка времени (первая часть ключа).
+        id_col: Колонка id (вторая часть ключа, разрешает совпадения времени).
+        per_page (int): Количество элементов на странице.
+        after (str | None): Курсор: вернуть элементы, следующие за ним в порядке сортировки.
+        before (str | None): Курсор: вернуть элементы, предшествующие ему в порядке сортировки.
+        descending (bool): Сортировка от новых к старым (по умолчанию) или наоборот.
+        key (callable | None): Функция получения ключа (timestamp, id) из элемента страницы.
+            По умолчанию берутся атрибуты с именами колонок ключа.
+        decode (callable): Функция раскодирования курсора в ключ (timestamp, id).
+
+    Returns:
+        KeysetPagination: Страница результатов. При неверном курсоре - ответ 400.
+    """
+    if key is None:
+        def key(item):
+            return getattr(item, timestamp_col.key), getattr(item, id_col.key)
+
+    try:
+        after = decode(after) if after else None
+        before = decode(before) if before else None
+    except ValueError:
+        abort(400, description='Неверный курсор пагинации')
+
+    # Навигация «назад» выбирает элементы в обратном порядке и затем разворачивает их
+    backwards = before is not None and after is None
+    ascending = descending == backwards
+    order = (timestamp_col.asc(), id_col.asc()) if ascending else (timestamp_col.desc(), id_col.desc())
+
+    stmt = stmt.order_by(None).order_by(*order)
+    if backwards:
+        stmt = stmt.where(_seek(timestamp_col, id_col, before, forward=ascending))
+    elif after is not None:
+        stmt = stmt.where(_seek(timestamp_col, id_col, after, forward=ascending))
+
+    # Лишний элемент показывает, есть ли ещё страница в этом направлении
+    items = db.session.scalars(stmt.limit(per_page + 1)).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if backwards:
+        items.reverse()
+        return KeysetPagination(items, per_page, has_next=True, has_prev=has_more, key=key)
+
+    return KeysetPagination(items, per_page, has_next=has_more, has_prev=after is not None, key=key)
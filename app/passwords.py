@@ -0,0 +1,143 @@
+"""
+Хеширование паролей в пуле процессов.
+
+Функции формирования ключа (scrypt, pbkdf2) специально сделаны медленными. Раньше
+`generate_password_hash`/`check_password_hash` выполнялись прямо в потоке обработчика
+запроса и занимали его на всё время вычисления. Теперь вычисления отправляются в
+ограниченный пул процессов `PASSWORD_HASH_WORKERS`, а поток запроса только ждёт
+результат. Одновременно в пул передаётся не более `PASSWORD_HASH_MAX_PENDING` задач,
+остальные запросы ждут своей очереди и не накапливаются в памяти пула.
+
+Алгоритм и его параметры задаются в `PASSWORD_HASH_METHOD` (формат `method` функции
+`werkzeug.security.generate_password_hash`, например `scrypt` или `pbkdf2:sha256:600000`).
+Хеши, созданные с другими параметрами, продолжают проверяться, а при успешном входе
+пароль перехешируется (см. `User.verify_password()`).
+
+`PASSWORD_HASH_WORKERS = 0` отключает пул: хеши вычисляются в текущем потоке.
+
+Пример использования:
+    password_hasher = PasswordHasher()
+    password_hasher.init_app(app)
+
+    password_hash = password_hasher.hash('cat')
+    password_hasher.verify(password_hash, 'cat')  # True
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingPool:
+    """Пул процессов хеширования одного приложения."""
+
+    def __init__(self, method, workers, max_pending):
+        self.method = method
+        # None - по числу CPU
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * 4)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._method_prefix = None
+
+    def _call(self, func, *args):
+        if self.workers == 0:
+            return func(*args)
+
+        with self._slots:
+            return self._get_executor().submit(func, *args).result()
+
+    def _get_executor(self):
+        # Пул создаётся при первом обращении, а не при запуске приложения:
+        # CLI-команды и тесты, не работающие с паролями, не порождают процессы.
+        # К этому моменту уже работают потоки (очередь логов, отправка email, потоки
+        # сервера), поэтому процессы запускаются через spawn: дочерний процесс, созданный
+        # fork, наследует захваченные другими потоками блокировки и может зависнуть
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                    atexit.register(self.shutdown)
+        return self._executor
+
+    def hash(self, password):
+        return self._call(generate_password_hash, password, self.method)
+
+    def hash_many(self, passwords):
+        """Хеширует список паролей, распределяя их по всем процессам пула."""
+        if self.workers == 0:
+            return [generate_password_hash(password, self.method) for password in passwords]
+        return list(self._get_executor().map(generate_password_hash, passwords, [self.method] * len(passwords)))
+
+    def verify(self, password_hash, password):
+        return self._call(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Создан ли хеш с алгоритмом или параметрами, отличными от текущих."""
+        if not password_hash:
+            return False
+        if self._method_prefix is None:
+            # Полное описание алгоритма с параметрами по умолчанию (например,
+            # 'scrypt:32768:8:1') берётся из хеша пустой строки один раз на процесс
+            self._method_prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+class PasswordHasher:
+    """Расширение Flask для хеширования паролей.
+
+    Состояние хранится отдельно для каждого приложения в `app.extensions['password_hasher']`.
+    Вне контекста приложения хеши вычисляются в текущем потоке с параметрами werkzeug
+    по умолчанию.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['password_hasher'] = HashingPool(
+            method=app.config['PASSWORD_HASH_METHOD'],
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_MAX_PENDING'])
+
+    @property
+    def pool(self):
+        """Пул текущего приложения (None вне контекста приложения)."""
+        if not has_app_context():
+            return None
+        return current_app.extensions.get('password_hasher')
+
+    def hash(self, password):
+        pool = self.pool
+        if pool is None:
+            return generate_password_hash(password)
+        return pool.hash(password)
+
+    def hash_many(self, passwords):
+        pool = self.pool
+        if pool is None:
+            return [generate_password_hash(password) for password in passwords]
+        return pool.hash_many(passwords)
+
+    def verify(self, password_hash, password):
+        pool = self.pool
+        if pool is None:
+            return check_password_hash(password_hash, password)
+        return pool.verify(password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        pool = self.pool
+        return pool is not None and pool.needs_rehash(password_hash)
@@ -0,0 +1,204 @@
+"""Пакетная рассылка дайджестов: новые посты авторов, на которых подписан пользователь.
+
+Дайджесты считаются не по одному пользователю, а пачками по `chunk_size`
+подтверждённых пользователей (keyset по id). На пачку выполняются два запроса:
+    1. очередная пачка пользователей;
+    2. посты авторов из подписок всех пользователей пачки за окно времени: одно
+       соединение follows с posts (индексы (follower_id, followed_id) и
+       (author_id, timestamp, id)), оконные функции отбирают последние
+       `posts_per_user` постов каждого пользователя и считают их общее количество.
+Посты «популярных» авторов, не раскладываемые по материализованным лентам,
+учитываются так же, как остальные.
+
+Шаблоны рендерятся в пуле процессов (в каждом процессе создаётся своё приложение),
+готовые письма пачками записываются в outbox, откуда их отправляет `flask send-outbox`.
+Повторный запуск за тот же день писем не дублирует (ключ идемпотентности).
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from flask import current_app, render_template
+from sqlalchemy import func, insert, select
+
+from app.models import EmailOutbox, Follow, Post, User, db
+
+DIGEST_TEMPLATE = 'mail/digest'
+
+# Приложение для рендеринга в дочернем процессе пула (см. `_init_renderer`)
+_renderer = None
+
+
+def _init_renderer(config_name):
+    """Инициализатор процесса пула: создаёт приложение с шаблонами и url_for."""
+    global _renderer
+    from app import create_app
+
+    _renderer = create_app(config_name)
+
+
+def _render_digests(digests, base_url, days, app=None):
+    """Рендерит пачку дайджестов. Выполняется в дочернем процессе (или в текущем, если пул отключён)."""
+    app = app or _renderer
+    rendered = []
+    with app.test_request_context(base_url=base_url):
+        for digest in digests:
+            context = dict(user=digest['user'], posts=digest['posts'], total=digest['total'], days=days)
+            rendered.append({
+                'user_id': digest['user']['id'],
+                'recipient': digest['user']['email'],
+                'body': render_template(DIGEST_TEMPLATE + '.txt', **context),
+                'html': render_template(DIGEST_TEMPLATE + '.html', **context),
+            })
+    return rendered
+
+
+def _iter_user_chunks(chunk_size):
+    """Подтверждённые пользователи пачками по chunk_size (keyset по id)."""
+    last_id = 0
+    while True:
+        users = db.session.execute(
+            select(User.id, User.username, User.email)
+            .where(User.confirmed.is_(True), User.id > last_id)
+            .order_by(User.id)
+            .limit(chunk_size)).all()
+        if not users:
+            return
+        yield users
+        last_id = users[-1].id
+
+
+def collect_digests(users, since, until, posts_per_user):
+    """Собирает дайджесты пачки пользователей одним запросом.
+
+    Args:
+        users (list[Row]): Пользователи пачки (id, username, email).
+        since (datetime): Начало окна (включительно).
+        until (datetime): Конец окна (не включительно).
+        posts_per_user (int): Сколько последних постов включать в дайджест.
+
+    Returns:
+        list[dict]: Дайджесты пользователей, у которых есть новые посты:
+            {'user': {...}, 'posts': [{'id', 'author', 'timestamp', 'excerpt'}], 'total': int}.
+    """
+    ranked = (
+        select(Follow.follower_id.label('user_id'),
+               Post.id.label('post_id'),
+               Post.author_id,
+               Post.timestamp,
+               func.coalesce(Post.body_excerpt, Post.body).label('excerpt'),
+               func.row_number().over(partition_by=Follow.follower_id,
+                                      order_by=(Post.timestamp.desc(), Post.id.desc())).label('rank'),
+               func.count().over(partition_by=Follow.follower_id).label('total'))
+        .join(Post, Post.author_id == Follow.followed_id)
+        .where(Follow.follower_id.in_([user.id for user in users]),
+               Post.timestamp >= since,
+               Post.timestamp < until)
+        .subquery())
+    rows = db.session.execute(
+        select(ranked, User.username.label('author'))
+        .join(User, User.id == ranked.c.author_id)
+        .where(ranked.c.rank <= posts_per_user)
+        .order_by(ranked.c.user_id, ranked.c.rank)).all()
+
+    digests = {}
+    for row in rows:
+        digest = digests.get(row.user_id)
+        if digest is None:
+            digest = digests[row.user_id] = {'posts': [], 'total': row.total}
+        digest['posts'].append({'id': row.post_id, 'author': row.author,
+                                'timestamp': row.timestamp, 'excerpt': row.excerpt})
+
+    return [{'user': {'id': user.id, 'username': user.username, 'email': user.email}, **digests[user.id]}
+            for user in users if user.id in digests]
+
+
+def _write_digests(rendered, subject, key_suffix, base_url):
+    """Записывает пачку готовых дайджестов в outbox одним INSERT. Возвращает количество новых писем."""
+    keys = {digest['user_id']: f'digest:{digest["user_id"]}:{key_suffix}' for digest in rendered}
+    existing = set(db.session.scalars(select(EmailOutbox.key).where(EmailOutbox.key.in_(keys.values()))))
+    rows = [{'key': keys[digest['user_id']], 'recipient': digest['recipient'], 'subject': subject,
+             'template': DIGEST_TEMPLATE, 'context': {}, 'base_url': base_url,
+             'body': digest['body'], 'html': digest['html']}
+            for digest in rendered if keys[digest['user_id']] not in existing]
+    if rows:
+        db.session.execute(insert(EmailOutbox), rows)
+        db.session.commit()
+    return len(rows)
+
+
+def send_digests(days=7, posts_per_user=10, chunk_size=1000, workers=None, dry_run=False,
+                 base_url=None, config_name=None, now=None):
+    """Формирует дайджесты всех пользователей за последние `days` дней и ставит их в outbox.
+
+    Args:
+        days (int): Ширина окна, дней.
+        posts_per_user (int): Сколько последних постов включать в дайджест.
+        chunk_size (int): Сколько пользователей обрабатывать за раз.
+        workers (int | None): Процессов рендеринга (по умолчанию - число CPU, 0 - без пула).
+        dry_run (bool): Только посчитать и отрендерить, ничего не записывая.
+        base_url (str | None): Адрес сайта для ссылок в письмах.
+        config_name (str | None): Конфигурация приложения в процессах пула.
+        now (datetime | None): Конец окна (по умолчанию - текущее время UTC).
+
+    Returns:
+        dict: Количество пользователей, дайджестов и записанных писем, а также время
+            по этапам ('query', 'render', 'write') и общее ('total'), секунд.
+    """
+    until = now or datetime.now(timezone.utc)
+    since = until - timedelta(days=days)
+    subject = current_app.config['MAIL_SUBJECT_PREFIX'] + f'Новые посты за {days} дн.'
+    key_suffix = f'{until:%Y-%m-%d}'
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    stats = {'users': 0, 'digests': 0, 'queued': 0, 'query': 0.0, 'render': 0.0, 'write': 0.0}
+    started = time.perf_counter()
+
+    def timed(stage, call, *args):
+        stage_started = time.perf_counter()
+        result = call(*args)
+        stats[stage] += time.perf_counter() - stage_started
+        return result
+
+    def digest_chunks():
+        users_chunks = _iter_user_chunks(chunk_size)
+        while True:
+            users = timed('query', next, users_chunks, None)
+            if users is None:
+                return
+            stats['users'] += len(users)
+            digests = timed('query', collect_digests, users, since, until, posts_per_user)
+            stats['digests'] += len(digests)
+            if digests:
+                yield digests
+
+    def write(rendered):
+        if not dry_run:
+            stats['queued'] += timed('write', _write_digests, rendered, subject, key_suffix, base_url)
+
+    if workers == 0:
+        app = current_app._get_current_object()
+        for digests in digest_chunks():
+            write(timed('render', _render_digests, digests, base_url, days, app))
+    else:
+        config_name = config_name or os.getenv('FLASK_CONFIG', 'default')
+        # В пул одновременно отдаётся ограниченное число пачек, чтобы не держать все дайджесты в памяти
+        window = workers * 2
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_renderer,
+                                 initargs=(config_name,)) as executor:
+            chunks = digest_chunks()
+            while True:
+                futures = [executor.submit(_render_digests, digests, base_url, days)
+                           for digests in islice(chunks, window)]
+                if not futures:
+                    break
+                for future in futures:
+                    # Время ожидания результатов: рендеринг, не перекрытый запросами к БД
+                    write(timed('render', future.result))
+
+    stats['total'] = time.perf_counter() - started
+    return stats
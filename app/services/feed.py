@@ -0,0 +1,50 @@
+"""Сервисные функции для материализованных лент пользователей (таблица timeline)."""
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, or_, select, union_all
+
+from app.models import Follow, Post, TimelineEntry, User, db
+
+
+def rebuild_timelines(limit=None):
+    """Пересобирает ленты всех пользователей с нуля.
+
+    Нужна после первичного развёртывания таблицы timeline и после изменения
+    `FEED_FANOUT_MAX_FOLLOWERS`: посты авторов, перешедших порог в любую сторону,
+    должны быть разложены по лентам заново (при переходе порога из-за подписок и отписок
+    ленты поддерживаются сами, см. `TimelineEntry.materialize`). Выполняется двумя
+    запросами в одной транзакции.
+
+    Args:
+        limit (int | None): Сколько последних постов каждого автора класть в ленту
+            подписчика (None - все посты).
+
+    Returns:
+        int: Количество строк в пересобранных лентах.
+    """
+    threshold = current_app.config['FEED_FANOUT_MAX_FOLLOWERS']
+
+    # Читатели автора: подписчики и сам автор (свои посты входят в собственную ленту)
+    readers = union_all(
+        select(Follow.follower_id.label('user_id'), Follow.followed_id.label('author_id')),
+        select(User.id.label('user_id'), User.id.label('author_id'))).subquery()
+
+    rows = (select(readers.c.user_id,
+                   Post.id.label('post_id'),
+                   Post.timestamp.label('timestamp'),
+                   func.row_number().over(partition_by=(readers.c.user_id, readers.c.author_id),
+                                          order_by=(Post.timestamp.desc(), Post.id.desc())).label('rn'))
+            .join(Post, Post.author_id == readers.c.author_id)
+            .join(User, User.id == readers.c.author_id)
+            # Свои посты автор видит всегда, подписчики - только посты не «популярных» авторов
+            .where(or_(readers.c.user_id == readers.c.author_id, User.followers_count <= threshold))
+            .subquery())
+    stmt = select(rows.c.user_id, rows.c.post_id, rows.c.timestamp)
+    if limit is not None:
+        stmt = stmt.where(rows.c.rn <= limit)
+
+    db.session.execute(delete(TimelineEntry))
+    result = db.session.execute(insert(TimelineEntry).from_select(['user_id', 'post_id', 'timestamp'], stmt))
+    db.session.commit()
+
+    return result.rowcount
@@ -0,0 +1,209 @@
+"""Доставка писем из таблицы email_outbox (transactional outbox).
+
+Обработчик захватывает пачку готовых писем атомарным UPDATE (аренда на `lease` секунд),
+рендерит шаблоны и передаёт письма в очередь отправки `email_queue` (app/email_queue.py):
+её потоки переиспользуют SMTP-соединения, а предохранитель приостанавливает отправку,
+когда сервер недоступен. Каждое письмо отправляется одной попыткой, повторы планирует
+outbox (`available_at`). Результаты записываются пакетными UPDATE.
+
+Доставка - «хотя бы один раз»: если обработчик упал после отправки, но до записи
+результата, письмо будет отправлено повторно по истечении аренды. Чтобы получатель
+мог распознать дубликат, Message-ID письма постоянный и выводится из его id.
+Несколько обработчиков могут работать одновременно: захваченные письма другим
+не выдаются, пока не истекла аренда.
+"""
+
+import socket
+from concurrent.futures import Future, wait
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from flask import current_app, render_template
+from flask_mail import Message
+from sqlalchemy import and_, bindparam, case, func, or_, select, update
+
+from app import email_queue
+from app.email_queue import CircuitOpenError
+from app.models import EmailOutbox, db
+
+
+def claim_batch(worker_id, limit, lease, now=None):
+    """Захватывает до `limit` готовых к отправке писем для обработчика `worker_id`.
+
+    Returns:
+        list[EmailOutbox]: Захваченные письма в порядке постановки в очередь.
+    """
+    now = now or datetime.now(timezone.utc)
+    ready = (select(EmailOutbox.id)
+             .where(EmailOutbox.status == EmailOutbox.PENDING,
+                    EmailOutbox.available_at <= now,
+                    or_(EmailOutbox.claimed_until.is_(None), EmailOutbox.claimed_until < now))
+             .order_by(EmailOutbox.id)
+             .limit(limit)
+             .with_for_update(skip_locked=True))
+    db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(ready.scalar_subquery()))
+        .values(claimed_by=worker_id, claimed_until=now + timedelta(seconds=lease))
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+
+    return db.session.scalars(
+        select(EmailOutbox)
+        .where(EmailOutbox.claimed_by == worker_id, EmailOutbox.status == EmailOutbox.PENDING)
+        .order_by(EmailOutbox.id)).all()
+
+
+def outbox_stats(now=None):
+    """Состояние очереди писем: для метрик и мониторинга.
+
+    Returns:
+        dict: `pending` - ждут отправки, `leased` - захвачены обработчиками, `failed` - не
+            отправлены окончательно; `oldest_pending_age` - сколько секунд ждёт самое старое
+            неотправленное письмо (0, если таких нет).
+    """
+    now = now or datetime.now(timezone.utc)
+    is_pending = EmailOutbox.status == EmailOutbox.PENDING
+    # Как и в claim_batch: аренда действует, пока не истекло claimed_until
+    free = or_(EmailOutbox.claimed_until.is_(None), EmailOutbox.claimed_until < now)
+    row = db.session.execute(select(
+        func.count(case((and_(is_pending, free), 1))),
+        func.count(case((and_(is_pending, ~free), 1))),
+        func.count(case((EmailOutbox.status == EmailOutbox.FAILED, 1))),
+        func.min(case((is_pending, EmailOutbox.created_at))))).one()
+
+    oldest = row[3]
+    if oldest is not None and oldest.tzinfo is None:
+        oldest = oldest.replace(tzinfo=timezone.utc)  # время хранится в UTC без часового пояса
+    age = max(0.0, (now - oldest).total_seconds()) if oldest is not None else 0
+    return {'pending': row[0], 'leased': row[1], 'failed': row[2], 'oldest_pending_age': age}
+
+
+def render_message(email):
+    """Собирает письмо из шаблонов (если оно не отрендерено заранее).
+
+    Ссылки строятся от адреса сайта, сохранённого в письме.
+    """
+    app = current_app._get_current_object()
+    msg = Message(
+        recipients=[email.recipient],
+        subject=email.subject,
+        sender=app.config['MAIL_SENDER'],
+        charset='utf-8')
+    # Постоянный Message-ID: повторная отправка того же письма распознаётся получателем
+    msg.msgId = f'<outbox-{email.id}@{socket.getfqdn()}>'
+
+    if email.body is not None:
+        msg.body, msg.html = email.body, email.html
+        return msg
+
+    with app.test_request_context(base_url=email.base_url):
+        context = EmailOutbox.load_context(email.context)
+        msg.body = render_template(email.template + '.txt', **context)
+        msg.html = render_template(email.template + '.html', **context)
+
+    return msg
+
+
+def _record_results(worker_id, emails, results, deferred, max_attempts, backoff):
+    """Записывает результаты отправки пакетными UPDATE.
+
+    Письма из `deferred` не отправлялись и освобождаются без учёта попытки; письма, которых
+    нет ни в `results`, ни в `deferred`, остаются захваченными до истечения аренды.
+    """
+    now = datetime.now(timezone.utc)
+    sent, retry, failed = [], [], []
+    for email in emails:
+        if email.id not in results:
+            continue
+        error = results[email.id]
+        if error is None:
+            sent.append({'email_id': email.id})
+            continue
+        attempts = email.attempts + 1
+        params = {'email_id': email.id, 'attempts': attempts, 'last_error': error[:1000]}
+        if attempts >= max_attempts:
+            failed.append(params)
+        else:
+            retry.append({**params, 'available_at': now + timedelta(seconds=backoff * 2 ** (attempts - 1))})
+
+    outbox = EmailOutbox.__table__
+    # Результат записывается, только если аренда не перешла к другому обработчику
+    claimed = and_(outbox.c.id == bindparam('email_id'), outbox.c.claimed_by == worker_id)
+    released = {'claimed_by': None, 'claimed_until': None}
+    if sent:
+        db.session.execute(update(outbox).where(claimed).values(status=EmailOutbox.SENT, sent_at=now, **released),
+                           sent)
+    if retry:
+        db.session.execute(update(outbox).where(claimed).values(
+            attempts=bindparam('attempts'), last_error=bindparam('last_error'),
+            available_at=bindparam('available_at'), **released), retry)
+    if failed:
+        db.session.execute(update(outbox).where(claimed).values(
+            status=EmailOutbox.FAILED, attempts=bindparam('attempts'), last_error=bindparam('last_error'),
+            **released), failed)
+    if deferred:
+        db.session.execute(update(outbox).where(claimed).values(**released),
+                           [{'email_id': email_id} for email_id in deferred])
+    db.session.commit()
+
+    return len(sent), len(retry), len(failed)
+
+
+def deliver_outbox(batch_size=50, lease=300, max_attempts=5, backoff=60):
+    """Отправляет одну пачку писем из outbox через очередь `email_queue`.
+
+    Args:
+        batch_size (int): Сколько писем захватывать за раз.
+        lease (int): Время аренды захваченных писем, секунд.
+        max_attempts (int): После стольких неудачных попыток письмо помечается как failed.
+        backoff (int): Задержка перед первой повторной попыткой, секунд (далее удваивается).
+
+    Returns:
+        tuple[int, int, int]: Количество отправленных, отложенных для повтора и окончательно
+            не отправленных писем. (0, 0, 0) - готовых к отправке писем нет или отправка
+            приостановлена предохранителем.
+    """
+    app = current_app._get_current_object()
+    pool = email_queue.pool
+    if pool.breaker.retry_after():
+        app.logger.warning(f'Outbox: отправка приостановлена предохранителем '
+                           f'ещё на {pool.breaker.retry_after():.0f} с')
+        return 0, 0, 0
+
+    worker_id = uuid4().hex
+    emails = claim_batch(worker_id, batch_size, lease)
+    if not emails:
+        return 0, 0, 0
+
+    results, futures = {}, {}
+    for email in emails:
+        try:
+            msg = render_message(email)
+        except Exception as e:
+            app.logger.exception(f'Не удалось отрендерить письмо {email.id} ({email.template})')
+            results[email.id] = f'Ошибка рендеринга: {e}'
+            continue
+        future = Future()
+        if pool.submit(msg, future):
+            futures[email.id] = future
+        else:
+            results[email.id] = 'Очередь отправки email заполнена'
+
+    # Результат должен быть записан до истечения аренды, иначе письмо захватит другой обработчик
+    wait(futures.values(), timeout=lease / 2)
+    deferred = []
+    for email_id, future in futures.items():
+        if not future.cancel() and not future.done():
+            continue  # письмо отправляется прямо сейчас: остаётся захваченным до истечения аренды
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or isinstance(error, CircuitOpenError):
+            deferred.append(email_id)
+        else:
+            results[email_id] = None if error is None else str(error) or type(error).__name__
+
+    sent, retry, failed = _record_results(worker_id, emails, results, deferred, max_attempts, backoff)
+    if retry or failed or deferred:
+        app.logger.warning(f'Outbox: отправлено {sent}, отложено {retry}, не отправлено {failed}, '
+                           f'ждут предохранителя {len(deferred)}')
+    return sent, retry, failed
@@ -0,0 +1,100 @@
+"""Сервисные функции для постов: массовая (пере)обработка сохранённых данных и счётчиков."""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from sqlalchemy import func, or_, select, update
+
+from app.models import MARKDOWN_RENDERER_VERSION, Comment, Post, db
+
+
+def _render_chunk(rows):
+    """Рендерит пачку постов. Выполняется в дочернем процессе.
+
+    Args:
+        rows (list[tuple[int, str]]): Пары (id поста, Markdown-текст).
+
+    Returns:
+        list[dict]: Параметры для массового UPDATE по первичному ключу.
+    """
+    return [{'id': post_id, **Post.render_body(body)} for post_id, body in rows]
+
+
+def _iter_chunks(post_ids, chunk_size):
+    """Читает тексты постов из БД пачками по chunk_size штук."""
+    ids = iter(post_ids)
+    while True:
+        chunk_ids = list(islice(ids, chunk_size))
+        if not chunk_ids:
+            return
+        yield db.session.execute(select(Post.id, Post.body).where(Post.id.in_(chunk_ids))).all()
+
+
+def rerender_posts(chunk_size=500, workers=None, force=False):
+    """Перерендеривает сохранённые HTML и превью постов параллельными пачками.
+
+    Обрабатываются посты без `body_html` или отрендеренные устаревшей версией
+    рендерера (`force=True` — все посты). Пачки рендерятся в пуле процессов,
+    результат каждой пачки записывается одним массовым UPDATE и коммитится,
+    поэтому прерванный запуск можно просто повторить.
+
+    Args:
+        chunk_size (int): Количество постов в одной пачке.
+        workers (int | None): Количество процессов (по умолчанию — число CPU).
+        force (bool): Перерендерить все посты, независимо от версии.
+
+    Returns:
+        int: Количество обновлённых постов.
+    """
+    stmt = select(Post.id).order_by(Post.id)
+    if not force:
+        stmt = stmt.where(or_(Post.body_html.is_(None),
+                              Post.body_html_version.is_(None),
+                              Post.body_html_version != MARKDOWN_RENDERER_VERSION))
+    post_ids = db.session.scalars(stmt).all()
+
+    workers = workers or os.cpu_count() or 1
+    # В пул одновременно отдаётся ограниченное число пачек, чтобы не читать всю таблицу в память
+    window = workers * 2
+
+    updated = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = _iter_chunks(post_ids, chunk_size)
+        while True:
+            futures = [executor.submit(_render_chunk, rows) for rows in islice(chunks, window)]
+            if not futures:
+                break
+            for future in futures:
+                params = future.result()
+                db.session.execute(update(Post), params)
+                db.session.commit()
+                updated += len(params)
+
+    return updated
+
+
+def reconcile_comment_counters():
+    """Исправляет расхождения денормализованных счётчиков комментариев у постов.
+
+    Счётчики пересчитываются одним UPDATE с коррелированными подзапросами,
+    изменяются только строки, в которых значения разошлись с фактическими.
+
+    Returns:
+        int: Количество исправленных постов.
+    """
+    total = (select(func.count(Comment.id))
+             .where(Comment.post_id == Post.id)
+             .scalar_subquery())
+    enabled = (select(func.count(Comment.id))
+               .where(Comment.post_id == Post.id, Comment.disabled.isnot(True))
+               .scalar_subquery())
+
+    result = db.session.execute(
+        update(Post)
+        .where(or_(Post.comments_count != total, Post.enabled_comments_count != enabled))
+        .values(comments_count=total, enabled_comments_count=enabled)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+
+    return result.rowcount
@@ -2,7 +2,9 @@
 Такой подход позволит тебе отделить логику работы с данными от самой модели.
 """
 
-from app.models import Role, User, db
+from sqlalchemy import func, or_, select, update
+
+from app.models import Comment, Follow, Post, Role, User, db
 
 
 def create_user(session=None, **kwargs):
@@ -15,6 +17,31 @@ def create_user(session=None, **kwargs):
         user.role = session.scalar(db.select(Role).where(Role.name == 'User'))
     db.session.add(user)
     db.session.flush()
-    user.add_self_follow()
     # db.session.commit()
     return user
+
+
+def reconcile_user_counters():
+    """Исправляет расхождения денормализованных счётчиков пользователей.
+
+    Пересчитывает подписчиков, подписки, посты и комментарии одним UPDATE с коррелированными
+    подзапросами. Изменяются только разошедшиеся строки.
+
+    Returns:
+        int: Количество исправленных пользователей.
+    """
+    actual = {
+        'followers_count': select(func.count()).where(Follow.followed_id == User.id).scalar_subquery(),
+        'following_count': select(func.count()).where(Follow.follower_id == User.id).scalar_subquery(),
+        'posts_count': select(func.count(Post.id)).where(Post.author_id == User.id).scalar_subquery(),
+        'comments_count': select(func.count(Comment.id)).where(Comment.author_id == User.id).scalar_subquery(),
+    }
+
+    result = db.session.execute(
+        update(User)
+        .where(or_(*(getattr(User, column) != value for column, value in actual.items())))
+        .values(**actual)
+        .execution_options(synchronize_session=False))
+    db.session.commit()
+
+    return result.rowcount
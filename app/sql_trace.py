@@ -0,0 +1,214 @@
+"""
+Трассировка SQL: время каждого запроса к БД, журнал медленных запросов и их сводка.
+
+Слушатели событий Engine (`before_cursor_execute` / `after_cursor_execute`) замеряют
+каждый запрос и относят его к эндпоинту, при обработке которого он выполнен.
+Запросы сводятся по нормализованному тексту (литералы и списки IN заменены на `?`):
+количество, суммарное и максимальное время, эндпоинты. Сводку показывает страница
+администратора `/admin/sql`.
+
+Запрос дольше `SQL_SLOW_QUERY_THRESHOLD` секунд записывается в лог (`app.sql`,
+уровень WARNING - попадает в файл, хранилище и трансляцию логов) вместе с планом
+выполнения (`EXPLAIN QUERY PLAN`, только SQLite) и формой параметров - типами и
+длинами значений, но не самими значениями. План одного и того же запроса
+пересчитывается не чаще раза в `SQL_EXPLAIN_TTL` секунд.
+
+Сводка локальна для процесса и хранит не больше `SQL_TRACE_MAX_STATEMENTS` запросов
+(при переполнении вытесняется запрос с наименьшим суммарным временем).
+
+Пример использования:
+    app.config['SQL_SLOW_QUERY_THRESHOLD'] = 0.1
+    sql_tracer.init_app(app)
+    current_app.extensions['sql_trace'].top(sort='total', limit=20)
+"""
+
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+SORT_KEYS = {
+    'total': lambda stats: stats.total,
+    'max': lambda stats: stats.max,
+    'avg': lambda stats: stats.avg,
+    'count': lambda stats: stats.count,
+    'slow': lambda stats: stats.slow,
+}
+
+
+def normalize(statement):
+    """Текст запроса без литералов: одинаковые запросы с разными значениями сводятся вместе."""
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _IN_LIST.sub('(?, ...)', statement)
+    return ' '.join(statement.split())
+
+
+def _value_shape(value):
+    if value is None:
+        return 'None'
+    if isinstance(value, (str, bytes)):
+        return f'{type(value).__name__}[{len(value)}]'
+    return type(value).__name__
+
+
+def parameter_shape(parameters, executemany=False):
+    """Форма параметров запроса: типы (и длины строк) без самих значений."""
+    if executemany:
+        parameters = list(parameters)
+        return f'{len(parameters)} × {parameter_shape(parameters[0])}' if parameters else '0 ×'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{name}: {_value_shape(value)}' for name, value in parameters.items()) + '}'
+    return '(' + ', '.join(_value_shape(value) for value in parameters or ()) + ')'
+
+
+def explain_query_plan(dbapi_connection, statement, parameters):
+    """План выполнения запроса SQLite в виде дерева, по строке на шаг."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters or ())
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return '\n'.join(lines)
+
+
+class StatementStats:
+    """Сводка по одному нормализованному запросу."""
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.endpoints = Counter()
+        self.parameters = None   # форма параметров последнего медленного выполнения
+        self.plan = None
+        self.plan_at = None
+
+    @property
+    def avg(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class SqlTrace:
+    """Сводка запросов одного приложения."""
+
+    def __init__(self, slow_threshold, explain_ttl=600, max_statements=1000):
+        self.slow_threshold = slow_threshold
+        self.explain_ttl = explain_ttl
+        self.max_statements = max_statements
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement, elapsed, endpoint):
+        """Учитывает выполнение запроса. Возвращает сводку или None, если места в сводке нет."""
+        key = normalize(statement)
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                if len(self._statements) >= self.max_statements:
+                    victim = min(self._statements.values(), key=SORT_KEYS['total'])
+                    if victim.total >= elapsed:
+                        return None
+                    del self._statements[victim.statement]
+                stats = self._statements[key] = StatementStats(key)
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.endpoints[endpoint] += 1
+            if elapsed >= self.slow_threshold:
+                stats.slow += 1
+        return stats
+
+    def needs_plan(self, stats):
+        return stats.plan_at is None or time.monotonic() - stats.plan_at >= self.explain_ttl
+
+    def top(self, sort='total', limit=50):
+        """Самые тяжёлые запросы по `sort` (total, max, avg, count или slow)."""
+        with self._lock:
+            statements = list(self._statements.values())
+        return sorted(statements, key=SORT_KEYS.get(sort, SORT_KEYS['total']), reverse=True)[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+
+
+def _current_trace():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('sql_trace')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_trace() is not None:
+        conn.info.setdefault('sql_trace_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current_trace()
+    started = conn.info.get('sql_trace_started')
+    if trace is None or not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    endpoint = (request.endpoint or '<unmatched>') if has_request_context() else '<no request>'
+    stats = trace.record(statement, elapsed, endpoint)
+    if stats is None or elapsed < trace.slow_threshold:
+        return
+
+    stats.parameters = parameter_shape(parameters, executemany)
+    if conn.dialect.name == 'sqlite' and trace.needs_plan(stats):
+        try:
+            # Сырой курсор DB-API: план не проходит через события Engine и не учитывается сам
+            stats.plan = explain_query_plan(cursor.connection, statement,
+                                            parameters[0] if executemany else parameters)
+        except Exception as e:
+            stats.plan = f'План не получен: {e}'
+        stats.plan_at = time.monotonic()
+
+    current_app.logger.getChild('sql').warning(
+        f'Медленный запрос: {elapsed * 1000:.1f} мс в {endpoint}\n'
+        f'{statement}\n'
+        f'Параметры: {stats.parameters}\n'
+        f'План:\n{stats.plan or "-"}')
+
+
+class SqlTracer:
+    """Расширение Flask: трассировка запросов к БД.
+
+    Сводка хранится отдельно для каждого приложения в `app.extensions['sql_trace']`.
+    Слушатели регистрируются один раз на класс Engine и учитывают только запросы,
+    выполненные в контексте приложения с включённой трассировкой.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['SQL_TRACE_ENABLED']:
+            return
+        app.extensions['sql_trace'] = SqlTrace(
+            slow_threshold=app.config['SQL_SLOW_QUERY_THRESHOLD'],
+            explain_ttl=app.config['SQL_EXPLAIN_TTL'],
+            max_statements=app.config['SQL_TRACE_MAX_STATEMENTS'])
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
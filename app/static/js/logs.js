@@ -1,21 +1,50 @@
 document.addEventListener("DOMContentLoaded", function () {
-    console.log("JS файл загружен успешно!"); // Эта строка должна появиться в консоли браузера
+    // Фильтры применяются на сервере: при выборе уровня или периода форма отправляется сразу
+    ["log-filter", "log-period"].forEach(function (id) {
+        const select = document.getElementById(id);
+        if (select) {
+            select.addEventListener("change", function () {
+                this.form.submit();
+            });
+        }
+    });
 
-    const logFilter = document.getElementById("log-filter");
-    if (logFilter) {
-        logFilter.addEventListener("change", function () {
-            let filter = this.value;
-            let logs = document.querySelectorAll(".log-entry");
+    // Новые записи приходят по Server-Sent Events и добавляются в начало списка,
+    // страница при этом не перезагружается (только на первой странице логов)
+    const container = document.querySelector(".logs-container[data-stream-url]");
+    if (!container || !window.EventSource) {
+        return;
+    }
+    const maxEntries = 1000;  // старые записи удаляются, чтобы страница не разрасталась
 
-            logs.forEach(log => {
-                if (filter === "all") {
-                    log.style.display = "block"; // Показать все
-                } else if (log.classList.contains(filter)) {
-                    log.style.display = "block"; // Показать только выбранные
-                } else {
-                    log.style.display = "none";  // Скрыть остальные
-                }
-            });
-        });
+    function logClass(level) {
+        if (level === "ERROR" || level === "CRITICAL") {
+            return "log-error";
+        } else if (level === "WARNING") {
+            return "log-warning";
+        } else if (level === "INFO") {
+            return "log-info";
+        }
+        return "";
     }
+
+    function prepend(text, className) {
+        const entry = document.createElement("div");
+        entry.className = ("log-entry mb-3 " + className).trim();
+        entry.style.whiteSpace = "pre-wrap";
+        entry.textContent = text;
+        container.insertBefore(entry, container.firstChild);
+        while (container.children.length > maxEntries) {
+            container.removeChild(container.lastChild);
+        }
+    }
+
+    const source = new EventSource(container.dataset.streamUrl);
+    source.addEventListener("log", function (event) {
+        const record = JSON.parse(event.data);
+        prepend(record.text, logClass(record.level));
+    });
+    source.addEventListener("dropped", function (event) {
+        prepend("Пропущено записей: " + event.data + " (страница не успевала их получать)", "log-warning");
+    });
 });
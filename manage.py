@@ -42,6 +42,171 @@ def run_tests(test_file):
     sys.exit(exit_code)
 
 
+@app.cli.command("render-posts")
+@click.option("--chunk-size", default=500, show_default=True, help="Количество постов в одной пачке")
+@click.option("--workers", default=None, type=int, help="Количество процессов (по умолчанию - число CPU)")
+@click.option("--force", is_flag=True, help="Перерендерить все посты, а не только устаревшие")
+def render_posts(chunk_size, workers, force):
+    """
+    Заполнение сохранённых HTML и превью постов (body_html, body_excerpt*).
+    Обрабатывает посты без HTML или отрендеренные старой версией рендерера.
+    Пример запуска:
+        1) flask render-posts
+        2) flask render-posts --force --workers 4
+    """
+    from app.services.posts import rerender_posts
+
+    updated = rerender_posts(chunk_size=chunk_size, workers=workers, force=force)
+    click.echo(f"Перерендерено постов: {updated}")
+
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters():
+    """
+    Пересчёт денормализованных счётчиков (комментарии постов; подписчики,
+    подписки, посты и комментарии пользователей), если они разошлись с фактическими данными.
+    Пример запуска:
+        flask reconcile-counters
+    """
+    from app.services.posts import reconcile_comment_counters
+    from app.services.users import reconcile_user_counters
+
+    fixed = reconcile_comment_counters()
+    click.echo(f"Исправлено счётчиков комментариев у постов: {fixed}")
+    fixed = reconcile_user_counters()
+    click.echo(f"Исправлено счётчиков у пользователей: {fixed}")
+
+
+@app.cli.command("rebuild-timelines")
+@click.option("--limit", default=None, type=int, help="Сколько последних постов каждого автора класть в ленту")
+def rebuild_timelines_command(limit):
+    """
+    Пересборка материализованных лент пользователей (таблица timeline).
+    Запускается после первичного развёртывания и после изменения FEED_FANOUT_MAX_FOLLOWERS.
+    Пример запуска:
+        flask rebuild-timelines --limit 100
+    """
+    from app.services.feed import rebuild_timelines
+
+    rows = rebuild_timelines(limit=limit)
+    click.echo(f"Строк в лентах: {rows}")
+
+
+@app.cli.command("remove-self-follows")
+def remove_self_follows():
+    """
+    Миграция данных: удаление подписок пользователей на самих себя.
+    Свои посты теперь попадают в ленту напрямую, такие строки больше не нужны.
+    Запускается один раз перед применением ограничения ck_follows_not_self.
+    Пример запуска:
+        flask remove-self-follows
+    """
+    from app.models import User
+
+    removed = User.remove_self_follows()
+    click.echo(f"Удалено подписок на самого себя: {removed}")
+
+
+@app.cli.command("prune-revoked-tokens")
+def prune_revoked_tokens():
+    """
+    Удаление записей об отзыве токенов API, срок действия которых уже истёк.
+    Такие токены отклоняются и без записи об отзыве. Запускается по расписанию (cron).
+    Пример запуска:
+        flask prune-revoked-tokens
+    """
+    from app.models import RevokedToken
+
+    removed = RevokedToken.prune()
+    click.echo(f"Удалено записей об отзыве: {removed}")
+
+
+@app.cli.command("prune-log-store")
+@click.option("--days", default=None, type=int, help="Сколько дней хранить записи (по умолчанию LOG_STORE_RETENTION_DAYS)")
+def prune_log_store(days):
+    """
+    Удаление старых записей из хранилища структурированных логов.
+    Запускается по расписанию (cron).
+    Пример запуска:
+        flask prune-log-store --days 7
+    """
+    import time
+
+    from app.log_store import LogStore
+
+    days = app.config['LOG_STORE_RETENTION_DAYS'] if days is None else days
+    store = app.extensions.get('log_store') or LogStore(app.config['LOG_STORE_PATH'])
+    removed = store.prune(time.time() - days * 24 * 60 * 60)
+    click.echo(f"Удалено записей логов: {removed}")
+
+
+@app.cli.command("send-outbox")
+@click.option("--batch-size", default=None, type=int, help="Сколько писем захватывать за раз")
+@click.option("--loop", is_flag=True, help="Работать постоянно, опрашивая outbox")
+@click.option("--interval", default=5.0, show_default=True, help="Пауза между опросами пустого outbox, секунд")
+def send_outbox(batch_size, loop, interval):
+    """
+    Отправка писем из outbox (письма регистрации, подтверждения email и т.п.).
+    Письма отправляет очередь email (потоков - EMAIL_WORKERS). Без --loop отправляет
+    все готовые письма и завершается. Можно запускать несколько обработчиков одновременно.
+    Пример запуска:
+        flask send-outbox --loop --batch-size 100
+    """
+    import time
+
+    from app.services.outbox import deliver_outbox
+
+    options = dict(
+        batch_size=batch_size or app.config["OUTBOX_BATCH_SIZE"],
+        lease=app.config["OUTBOX_LEASE"],
+        max_attempts=app.config["OUTBOX_MAX_ATTEMPTS"],
+        backoff=app.config["OUTBOX_RETRY_BACKOFF"])
+
+    totals = [0, 0, 0]
+    while True:
+        counts = deliver_outbox(**options)
+        totals = [total + count for total, count in zip(totals, counts)]
+        if not any(counts):
+            if not loop:
+                break
+            time.sleep(interval)
+
+    click.echo(f"Отправлено: {totals[0]}, отложено: {totals[1]}, не отправлено: {totals[2]}")
+
+
+@app.cli.command("send-digest")
+@click.option("--days", default=None, type=int, help="За сколько последних дней собирать посты")
+@click.option("--chunk-size", default=None, type=int, help="Сколько пользователей обрабатывать за раз")
+@click.option("--workers", default=None, type=int, help="Процессов рендеринга (по умолчанию - число CPU, 0 - без пула)")
+@click.option("--dry-run", is_flag=True, help="Только посчитать и отрендерить, не записывая письма")
+def send_digest(days, chunk_size, workers, dry_run):
+    """
+    Дайджест новых постов авторов, на которых подписан пользователь.
+    Письма ставятся в outbox, отправляет их `flask send-outbox`.
+    Запускается по расписанию (cron), повторный запуск в тот же день писем не дублирует.
+    С --dry-run выводит время этапов и оценку для 100 тыс. пользователей.
+    Пример запуска:
+        flask send-digest --days 7 --dry-run
+    """
+    from app.services.digest import send_digests
+
+    stats = send_digests(
+        days=days or app.config["DIGEST_DAYS"],
+        posts_per_user=app.config["DIGEST_POSTS_PER_USER"],
+        chunk_size=chunk_size or app.config["DIGEST_CHUNK_SIZE"],
+        workers=workers,
+        dry_run=dry_run,
+        base_url=app.config["DIGEST_BASE_URL"])
+
+    click.echo(f"Пользователей: {stats['users']}, дайджестов: {stats['digests']}, "
+               f"поставлено в outbox: {stats['queued']}")
+    click.echo(f"Время, с: запросы {stats['query']:.2f}, рендеринг {stats['render']:.2f}, "
+               f"запись {stats['write']:.2f}, всего {stats['total']:.2f}")
+    if dry_run and stats["users"]:
+        estimate = stats["total"] / stats["users"] * 100_000
+        click.echo(f"Оценка для 100 тыс. пользователей: {estimate:.0f} с")
+
+
 if __name__ == "__main__":
     host = os.getenv('FLASK_RUN_HOST', '0.0.0.0')
     port = int(os.getenv('FLASK_RUN_PORT', 5000))
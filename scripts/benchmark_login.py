@@ -0,0 +1,85 @@
+"""
+Нагрузочная проверка входа пользователей: пропускная способность `/auth/login`
+при конкурентных запросах с хешированием паролей в потоке запроса и в пуле процессов.
+
+Каждый вариант запускается на отдельной временной БД SQLite. Запросы выполняются
+тестовым клиентом Flask из `--threads` потоков, что соответствует потокам WSGI-сервера.
+
+Пример запуска (из корня проекта):
+    SECRET_KEY=secret python scripts/benchmark_login.py --threads 8 --logins 200
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+
+from app import create_app, db  # noqa: E402
+from app.config import TestingConfig, config  # noqa: E402
+from app.models import Role  # noqa: E402
+from app.services.users import create_user  # noqa: E402
+
+USERS = 20
+
+
+def run(method, workers, threads, logins):
+    """Возвращает количество успешных входов в секунду для одного варианта настроек."""
+    with tempfile.TemporaryDirectory() as tmp:
+        class BenchmarkConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f'sqlite:///{Path(tmp) / "benchmark.sqlite"}'
+            WTF_CSRF_ENABLED = False
+            DEBUG_TB_ENABLED = False
+            PASSWORD_HASH_METHOD = method
+            PASSWORD_HASH_WORKERS = workers
+
+        config['benchmark'] = BenchmarkConfig
+        app = create_app('benchmark')
+        app.logger.disabled = True  # Журнал каждого входа искажает замеры
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            for i in range(USERS):
+                create_user(password='cat', email=f'user_{i}@example.com', username=f'user{i}', confirmed=True)
+            db.session.commit()
+
+        def login(i):
+            client = app.test_client()
+            response = client.post('/auth/login', data={
+                'email': f'user_{i % USERS}@example.com', 'password': 'cat'})
+            return response.status_code == 302 and '/auth/login' not in response.location
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            # Прогрев: запуск процессов пула и первые соединения с БД
+            list(executor.map(login, range(threads)))
+
+            started = time.perf_counter()
+            succeeded = sum(executor.map(login, range(logins)))
+            elapsed = time.perf_counter() - started
+
+        app.extensions['password_hasher'].shutdown()
+        assert succeeded == logins, f'Успешных входов: {succeeded} из {logins}'
+        return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help='Количество конкурентных клиентов')
+    parser.add_argument('--logins', type=int, default=100, help='Количество входов в каждом варианте')
+    parser.add_argument('--method', default='scrypt', help='Алгоритм хеширования (PASSWORD_HASH_METHOD)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессов в пуле хеширования')
+    args = parser.parse_args()
+
+    print(f'Алгоритм: {args.method}, клиентов: {args.threads}, входов: {args.logins}, CPU: {os.cpu_count()}')
+    for title, workers in (('в потоке запроса', 0), (f'пул из {args.workers} процессов', args.workers)):
+        throughput = run(args.method, workers, args.threads, args.logins)
+        print(f'{title:>30}: {throughput:8.1f} входов/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import pytest
+
+from app import create_app
+from app import db as _db
+from app.models import Role
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов модуля: модуль переопределяет фикстуру, если нужны свои."""
+    return {}
+
+
+@pytest.fixture(scope='module')
+def app(app_config):
+    """Создание фикстуры для всех тестов в этом модуле."""
+    app = create_app('testing')
+    app.config.update(app_config)
+    with app.app_context():
+        yield app       # Доступ к app внутри тестов
+
+
+@pytest.fixture(scope='module')
+def db(app):
+    """Фикстура для базы данных (создание и удаление таблиц)."""
+    _db.create_all()
+    yield _db   # Доступ к _db внутри тестов
+    _db.session.remove()
+    _db.drop_all()
+
+
+@pytest.fixture(scope='function')
+def session(db):
+    """Сессия с пустыми таблицами и ролями по умолчанию."""
+    # Очистка всех таблиц
+    for table in reversed(db.metadata.sorted_tables):   # гарантирует правильный порядок удаления (учитывая внешние ключи).
+        db.session.execute(table.delete())
+    db.session.commit()
+    Role.insert_roles()
+
+    yield db.session
+
+    db.session.rollback()
+    db.session.remove()
+
+
+@pytest.fixture
+def admin_client():
+    """Вход администратором в приложение, созданное тестом: возвращает функцию app -> клиент."""
+    def login(app):
+        app.config.update(WTF_CSRF_ENABLED=False, ADMIN_EMAIL='admin@example.com')
+        with app.app_context():
+            _db.create_all()
+            Role.insert_roles()
+            create_user(email='admin@example.com', username='admin', password='cat', confirmed=True)
+            _db.session.commit()
+        client = app.test_client()
+        client.post('/auth/login', data={'email': 'admin@example.com', 'password': 'cat'})
+        return client
+
+    return login
@@ -0,0 +1,109 @@
+from base64 import b64encode
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from app.api.v1.pagination import sign_cursor, unsign_cursor
+from app.models import Comment, Post
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов этого модуля."""
+    return dict(POSTS_PER_PAGE=2, COMMENTS_PER_PAGE=2)
+
+
+@pytest.fixture(scope='function')
+def post(session):
+    """Читатель, подписанный на автора; у автора пять постов, у последнего - пять комментариев."""
+    reader = create_user(email='reader@example.com', username='reader', password='cat', confirmed=True,
+                         session=session)
+    author = create_user(email='author@example.com', username='author', password='cat', confirmed=True,
+                         session=session)
+    start = datetime(2024, 1, 1)
+    posts = [Post(body=f'пост {i}', author=author, timestamp=start + timedelta(minutes=i)) for i in range(5)]
+    session.add_all(posts)
+    session.add_all(Comment(body=f'коммент {i}', author=reader, post=posts[-1],
+                            created_at=start + timedelta(hours=1, minutes=i))
+                    for i in range(5))
+    session.commit()
+    reader.follow(author)
+    session.commit()
+    return posts[-1]
+
+
+@pytest.fixture(scope='function')
+def client(app):
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = 'Basic ' + b64encode(b'reader@example.com:cat').decode()
+    return client
+
+
+def get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def walk(client, url, field, link):
+    """Проходит список по ссылкам `link`, возвращая значения `field` всех страниц."""
+    items = []
+    while url:
+        page = get(client, url)
+        items += [item['body'] for item in page[field]]
+        url = page[link]
+    return items
+
+
+def test_sign_cursor_round_trip(app):
+    with app.test_request_context():
+        assert sign_cursor(None, 'after') is None
+        assert unsign_cursor(sign_cursor('2024-01-01T00:00:00_7', 'after')) == ('2024-01-01T00:00:00_7', None)
+        assert unsign_cursor(sign_cursor('2024-01-01T00:00:00_7', 'before')) == (None, '2024-01-01T00:00:00_7')
+
+        with pytest.raises(BadRequest):
+            unsign_cursor(sign_cursor('2024-01-01T00:00:00_7', 'after') + 'x')
+
+
+def test_next_and_prev_cursors_round_trip(client, post):
+    first = get(client, '/api/v1/posts')
+    assert [item['body'] for item in first['posts']] == ['пост 4', 'пост 3']
+    assert first['prev_cursor'] is None and first['prev_page'] is None
+
+    second = get(client, first['next_page'])
+    assert [item['body'] for item in second['posts']] == ['пост 2', 'пост 1']
+    assert parse_qs(urlsplit(first['next_page']).query)['cursor'] == [first['next_cursor']]
+
+    back = get(client, f'/api/v1/posts?cursor={second["prev_cursor"]}')
+    assert back['posts'] == first['posts']
+    assert back['prev_cursor'] is None
+
+    assert walk(client, '/api/v1/posts', 'posts', 'next_page') == [f'пост {i}' for i in reversed(range(5))]
+
+
+def test_tampered_cursor_is_rejected(client, post):
+    cursor = get(client, '/api/v1/posts')['next_cursor']
+    assert client.get(f'/api/v1/posts?cursor={cursor[:-2]}xx').status_code == 400
+    assert client.get('/api/v1/posts?cursor=garbage').status_code == 400
+
+
+def test_count_is_opt_in(client, post):
+    assert 'posts_count' not in get(client, '/api/v1/posts')
+    assert get(client, '/api/v1/posts?count=true')['posts_count'] == 5
+    assert get(client, '/api/v1/posts?page=2')['posts_count'] == 5
+
+
+def test_feed_and_comment_links_point_to_their_own_endpoints(client, post):
+    page = get(client, '/api/v1/profile/reader/feed')
+    assert urlsplit(page['next_page']).path == '/api/v1/profile/reader/feed'
+    assert walk(client, '/api/v1/profile/reader/feed', 'posts', 'next_page') == \
+        [f'пост {i}' for i in reversed(range(5))]
+
+    url = f'/api/v1/posts/{post.id}/comments'
+    page = get(client, url)
+    assert urlsplit(page['next_page']).path == url
+    # Комментарии поста идут от старых к новым
+    assert walk(client, url, 'comments', 'next_page') == [f'коммент {i}' for i in range(5)]
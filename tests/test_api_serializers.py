@@ -0,0 +1,124 @@
+from base64 import b64encode
+
+import pytest
+from sqlalchemy import event
+
+from app import db as _db
+from app.api.v1.serializers import serialize_comments, serialize_posts
+from app.models import Comment, Post
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='function')
+def posts(session):
+    """Посты разных авторов, у каждого - комментарии разных пользователей."""
+    users = [create_user(password='cat', email=f'user_{i}@example.com', username=f'user{i}',
+                         confirmed=True, session=session)
+             for i in range(10)]
+    posts = [Post(body=f'пост {i}', author=users[i]) for i in range(10)]
+    session.add_all(posts)
+    for i, post in enumerate(posts):
+        for j in range(4):
+            session.add(Comment(body=f'коммент {j}', author=users[(i + j + 1) % 10], post=post))
+    session.commit()
+    return posts
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self)
+
+
+def count_queries(client, url):
+    # Новый сеанс: связанные объекты не должны браться из карты идентичности тестов
+    _db.session.remove()
+    headers = {'Authorization': 'Basic ' + b64encode(b'user_0@example.com:cat').decode()}
+    with QueryCounter(_db.engine) as counter:
+        response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return counter.count, response.get_json()
+
+
+def test_serialized_posts_match_to_json(app, posts):
+    with app.test_request_context():
+        expected = [post.to_json(excerpt=True, only_few_comments=True) for post in posts]
+        assert serialize_posts(posts, excerpt=True, comments_limit=app.config['COMMENTS_PREVIEW_COUNT']) == expected
+
+        expected = [post.to_json() for post in posts]
+        assert serialize_posts(posts) == expected
+
+        comments = _db.session.scalars(_db.select(Comment)).all()
+        assert serialize_comments(comments) == [comment.to_json() for comment in comments]
+
+        # Формат задан в одном месте - в сериализаторах
+        post = posts[0].to_json(only_few_comments=True)
+        assert list(post) == ['url', 'body', 'body_truncated', 'timestamp', 'author', 'comments',
+                              'comments_count (including disabled)']
+        assert post['author'].endswith('/api/v1/profile/user0')
+        assert [comment['body'] for comment in post['comments']] == ['коммент 1', 'коммент 2', 'коммент 3']
+        assert list(post['comments'][0]) == ['url', 'body', 'created_at', 'author']
+        assert list(comments[0].to_json()) == ['url', 'body', 'created_at', 'author', 'post_url', 'post']
+
+
+@pytest.mark.parametrize('url, per_page_key', [
+    ('/api/v1/posts', 'POSTS_PER_PAGE'),
+    ('/api/v1/profile/user0/feed', 'POSTS_PER_PAGE'),
+    ('/api/v1/comments', 'COMMENTS_PER_PAGE'),
+])
+def test_query_count_does_not_depend_on_page_size(app, posts, url, per_page_key):
+    for post in posts[1:]:
+        posts[0].author.follow(post.author)
+    _db.session.commit()
+
+    client = app.test_client()
+    per_page = app.config[per_page_key]
+    try:
+        app.config[per_page_key] = 2
+        count_queries(client, url)  # первый запрос заполняет кеши (роль пользователя)
+        small_count, small = count_queries(client, url)
+        app.config[per_page_key] = 8
+        large_count, large = count_queries(client, url)
+    finally:
+        app.config[per_page_key] = per_page
+
+    field = 'comments' if per_page_key == 'COMMENTS_PER_PAGE' else 'posts'
+    assert (len(small[field]), len(large[field])) == (2, 8)
+    assert small_count == large_count
+
+
+def test_followers_are_paginated(app, posts):
+    user = posts[0].author
+    followers = [post.author for post in posts[1:]]
+    for follower in followers:
+        follower.follow(user)
+    _db.session.commit()
+    expected = [follower.username for follower in reversed(followers)]
+
+    client = app.test_client()
+    per_page = app.config['FOLLOWERS_PER_PAGE']
+    app.config['FOLLOWERS_PER_PAGE'] = 4
+    try:
+        _, profile = count_queries(client, '/api/v1/profile/user0')
+        assert 'followers_list' not in profile
+        assert profile['followers_count'] == len(followers)
+
+        usernames, url = [], profile['followers']
+        while url:
+            _, page = count_queries(client, url)
+            usernames += [follower['username'] for follower in page['followers']]
+            url = page['next_page']
+    finally:
+        app.config['FOLLOWERS_PER_PAGE'] = per_page
+
+    assert usernames == expected
@@ -0,0 +1,113 @@
+from base64 import b64encode
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db as _db
+from app.api.v1.tokens import BloomFilter
+from app.models import RevokedToken, User
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='function')
+def token(app, session):
+    create_user(password='cat', email='user@example.com', username='user', confirmed=True, session=session)
+    session.commit()
+    client = app.test_client()
+    credentials = b64encode(b'user@example.com:cat').decode()
+    response = client.get('/api/v1/token', headers={'Authorization': f'Basic {credentials}'})
+    assert response.status_code == 200
+    return response.get_json()['token']
+
+
+def token_headers(token):
+    return {'Authorization': 'Basic ' + b64encode(f'{token}:'.encode()).decode()}
+
+
+def count_queries(client, method, url, headers):
+    # Новый сеанс: пользователь не должен браться из карты идентичности тестов
+    _db.session.remove()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(_db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.open(url, method=method, headers=headers)
+    finally:
+        event.remove(_db.engine, 'before_cursor_execute', before_cursor_execute)
+    return response, statements
+
+
+def test_bloom_filter_membership():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    members = [f'jti-{i}' for i in range(1000)]
+    for member in members:
+        bloom.add(member)
+
+    assert all(member in bloom for member in members)
+    false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_cached_token_is_verified_without_queries(app, token):
+    client = app.test_client()
+
+    response, _ = count_queries(client, 'GET', '/api/v1/token/usage', token_headers(token))
+    assert response.status_code == 200
+    response, statements = count_queries(client, 'GET', '/api/v1/token/usage', token_headers(token))
+
+    assert response.status_code == 200
+    assert statements == []
+    assert response.get_json()['count'] == 2
+
+
+def test_revoked_token_is_rejected(app, token):
+    client = app.test_client()
+    assert client.get('/api/v1/token/usage', headers=token_headers(token)).status_code == 200
+
+    assert client.delete('/api/v1/token', headers=token_headers(token)).status_code == 204
+
+    assert client.get('/api/v1/token/usage', headers=token_headers(token)).status_code == 401
+    assert User.verify_auth_token(token) is None
+
+
+def test_revocation_from_another_process_is_picked_up(app, session, token):
+    client = app.test_client()
+    assert client.get('/api/v1/token/usage', headers=token_headers(token)).status_code == 200
+
+    # Отзыв, записанный в таблицу напрямую, виден после обновления списка отзыва
+    data = User.decode_auth_token(token)
+    session.add(RevokedToken(jti=data['jti'], user_id=data['id'], expires_at=data['expires_at']))
+    session.commit()
+    registry = app.extensions['api_tokens']
+    registry.refresh_interval, refresh_interval = 0, registry.refresh_interval
+    try:
+        assert client.get('/api/v1/token/usage', headers=token_headers(token)).status_code == 401
+    finally:
+        registry.refresh_interval = refresh_interval
+
+
+def test_late_commit_with_earlier_revocation_time_is_picked_up(app, session, token):
+    client = app.test_client()
+    user = session.scalar(_db.select(User).where(User.email == 'user@example.com'))
+    other_token = user.generate_auth_token()
+    assert client.get('/api/v1/token/usage', headers=token_headers(other_token)).status_code == 200
+
+    registry = app.extensions['api_tokens']
+    registry.refresh_interval, refresh_interval = 0, registry.refresh_interval
+    try:
+        assert client.delete('/api/v1/token', headers=token_headers(token)).status_code == 204
+        revoked_at = session.get(RevokedToken, User.decode_auth_token(token)['jti']).revoked_at
+
+        # Транзакция другого процесса поставила время отзыва раньше, а зафиксировалась позже
+        data = User.decode_auth_token(other_token)
+        session.add(RevokedToken(jti=data['jti'], user_id=data['id'], expires_at=data['expires_at'],
+                                 revoked_at=revoked_at - timedelta(seconds=10)))
+        session.commit()
+
+        assert client.get('/api/v1/token/usage', headers=token_headers(other_token)).status_code == 401
+    finally:
+        registry.refresh_interval = refresh_interval
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app import mail
+from app.models import EmailOutbox, Post
+from app.services.digest import send_digests
+from app.services.outbox import deliver_outbox
+from app.services.users import create_user
+
+NOW = datetime(2030, 1, 8, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов этого модуля."""
+    return dict(MAIL_SENDER='noreply@example.com')
+
+
+@pytest.fixture(scope='function')
+def users(session):
+    """reader подписан на author_1 и author_2; lonely ни на кого не подписан."""
+    reader, author_1, author_2, lonely = [
+        create_user(password='cat', email=f'{name}@example.com', username=name, confirmed=True, session=session)
+        for name in ('reader', 'author_1', 'author_2', 'lonely')]
+    session.commit()
+    reader.follow(author_1)
+    reader.follow(author_2)
+
+    for days_ago in (1, 2, 3, 10):
+        session.add(Post(body=f'пост {days_ago}', author=author_1, timestamp=NOW - timedelta(days=days_ago)))
+    session.add(Post(body='пост author_2', author=author_2, timestamp=NOW - timedelta(hours=1)))
+    session.commit()
+    return reader, author_1, author_2, lonely
+
+
+def test_digest_is_queued_once_per_day(session, users):
+    reader = users[0]
+
+    stats = send_digests(days=7, posts_per_user=2, chunk_size=2, workers=0, now=NOW,
+                         base_url='http://example.com/')
+    assert (stats['users'], stats['digests'], stats['queued']) == (4, 1, 1)
+
+    email = session.scalar(select(EmailOutbox))
+    assert email.recipient == reader.email
+    assert 'опубликовали 4 новых постов' in email.body
+    assert 'пост author_2' in email.body and 'пост 1' in email.body and 'пост 2' not in email.body
+    assert 'http://example.com/feed/reader' in email.html
+
+    # Повторный запуск в тот же день писем не добавляет
+    assert send_digests(days=7, workers=0, now=NOW)['queued'] == 0
+
+    with mail.record_messages() as outbox:
+        assert deliver_outbox() == (1, 0, 0)
+    assert outbox[0].body == email.body
+
+
+def test_dry_run_writes_nothing(session, users):
+    stats = send_digests(days=7, workers=0, dry_run=True, now=NOW)
+
+    assert (stats['digests'], stats['queued']) == (1, 0)
+    assert session.scalar(select(EmailOutbox)) is None
+    assert stats['total'] >= stats['query']
+
+
+def test_digests_rendered_in_process_pool(session, users):
+    stats = send_digests(days=7, posts_per_user=2, workers=1, now=NOW, base_url='http://example.com/',
+                         config_name='testing')
+
+    assert stats['queued'] == 1
+    assert 'http://example.com/feed/reader' in session.scalar(select(EmailOutbox.html))
@@ -1,10 +1,15 @@
+import socketserver
+import threading
+from concurrent.futures import Future
 from unittest.mock import ANY, MagicMock, patch
 
 import pytest
 from flask import Flask
 from flask_mail import Message
 
+from app import mail
 from app.email import create_and_send_email_async, send_email
+from app.email_queue import CircuitBreaker, CircuitOpenError, EmailWorkerPool
 
 
 class TestSendEmail:
@@ -52,80 +57,220 @@ class TestSendEmail:
         self.mock_mail_send.assert_called_once_with(self.test_message)
 
     def test_create_and_send_email_async(self):
-        """Тестируем асинхронное создание и отправку письма.
+        """Тестируем создание письма и постановку его в очередь фоновой отправки.
 
         Назначение:
-        Функция предназначена для тестирования асинхронного создания и отправки электронного письма
-        с использованием моков (mock-объектов) для изоляции тестируемого кода от внешних зависимостей.
+        Функция проверяет, что письмо создаётся из шаблонов и передаётся в очередь
+        отправки (`app.email_queue`), а не отправляется в потоке запроса.
 
         Структура теста:
         1. Мокирование зависимостей:
             - Используется `patch` для мокирования (т.е. имитации):
                 - `app.email.render_template` — для рендеринга шаблонов.
                 - `app.email.Message` — для создания объекта сообщения.
-                - `app.email.Thread` — для создания и управления потоком (thread).
+                - `app.email.email_queue` — очереди фоновой отправки.
             Здесь важно, что `patch` работает на уровне модулей, поэтому нужно указать,
             где именно находится зависимость, которую надо заменить.
 
-        2. Настройка моков:
-            - `mock_render_template` настраивается для возврата строки с именем шаблона.
-            - `mock_message` настраивается для возврата мокированного экземпляра сообщения
-                (`mock_message_instance`).
+        2. Вызывается функция `create_and_send_email_async` с параметрами
+           в контексте приложения (нужны настройки префикса темы и отправителя).
 
-        3. Вызывается функция `create_and_send_email_async` с параметрами.
-           Здесь важно, что когда `create_and_send_email_async` вызывает Thread,
-           она на самом деле вызывает мок-объект.
+        3. Проверка постановки в очередь:
+            - Письмо передано в `email_queue.submit` ровно один раз.
 
-        4. Проверка создания потока:
-            - Проверяется, что поток создан с правильными аргументами:
-                - `target=send_email` — целевая функция для выполнения в потоке.
-                - `args=[ANY, mock_message_instance]` — аргументы для целевой функции.
+        4. Проверка рендеринга шаблонов:
+            - `test_template.txt` и `test_template.html` с параметром `some_key='some_value'`.
 
-        5. Проверка запуска потока:
-            - Проверяется, что поток был запущен с помощью вызова `start`.
-
-        6. Проверка рендеринга шаблонов:
-            - Проверяется, что шаблоны были отрендерены с правильными параметрами:
-                - `test_template.txt` и `test_template.html` с параметром `some_key='some_value'`.
-
-        7. Проверка возвращаемого значения:
-            - Проверяется, что функция возвращает объект потока (`mock_thread.return_value`).
-
-        Ключевые моменты:
-            - Изоляция теста: Использование моков позволяет изолировать тест от реальных зависимостей,
-            таких как рендеринг шаблонов и отправка писем.
-            - Проверка асинхронности: Тест проверяет, что функция корректно создает и запускает поток
-            для асинхронной отправки письма.
-            - Проверка возвращаемого значения: Убеждаемся, что функция возвращает ожидаемый объект потока.
+        5. Проверка возвращаемого значения:
+            - Функция возвращает результат `submit` (поставлено ли письмо в очередь).
         """
+        self.app.config.update(MAIL_SUBJECT_PREFIX='[Test] ', MAIL_SENDER='noreply@test.com')
+
         # Получение моков
-        with (patch('app.email.render_template') as mock_render_template,
+        with (self.app.app_context(),
+              patch('app.email.render_template') as mock_render_template,
               patch('app.email.Message') as mock_message,
-              patch('app.email.Thread') as mock_thread):
+              patch('app.email.email_queue') as mock_queue):
 
             # Настройка моков
             mock_render_template.side_effect = lambda x, **kwargs: f"Rendered {x}"
             mock_message_instance = MagicMock()
             mock_message.return_value = mock_message_instance
+            mock_queue.submit.return_value = True
 
             # Вызываем тестируемую функцию
-            thr = create_and_send_email_async(
+            queued = create_and_send_email_async(
                 to='test@example.com',
                 subject='Test Subject',
                 template='test_template',
                 some_key='some_value')
 
-            # Поток создан с правильными аргументами
-            mock_thread.assert_called_once_with(
-                target=send_email,
-                args=[ANY, mock_message_instance])
-
-            # Поток был запущен
-            mock_thread.return_value.start.assert_called_once()
+            # Письмо поставлено в очередь
+            mock_queue.submit.assert_called_once_with(mock_message_instance)
+            mock_message.assert_called_once_with(
+                recipients=['test@example.com'], subject='[Test] Test Subject',
+                sender='noreply@test.com', charset=ANY)
 
             # Шаблоны рендерятся
             mock_render_template.assert_any_call('test_template.txt', some_key='some_value')
             mock_render_template.assert_any_call('test_template.html', some_key='some_value')
 
-            # Возвращается объект потока
-            assert thr == mock_thread.return_value
+            assert queued is True
+
+
+class SMTPStub(socketserver.ThreadingTCPServer):
+    """Минимальный SMTP-сервер в процессе тестов: считает соединения и принятые письма."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPStubHandler)
+        self.connections = 0
+        self.messages = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply('220 stub ready')
+        for raw in self.rfile:
+            command = raw.decode().strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 stub')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                data = []
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(line)
+                with self.server.lock:
+                    self.server.messages.append(b''.join(data))
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class TestEmailQueue:
+    """Очередь отправки email против SMTP-сервера в процессе тестов."""
+
+    @pytest.fixture
+    def smtp(self):
+        server = SMTPStub()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+
+    def make_pool(self, port, **overrides):
+        app = Flask(__name__)
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_SUPPRESS_SEND=False,
+                          MAIL_DEFAULT_SENDER='noreply@test.com')
+        mail.init_app(app)
+        options = dict(workers=1, max_size=100, max_per_connection=100, idle_timeout=30,
+                       max_retries=2, retry_backoff=0.01, breaker_threshold=100, breaker_reset_timeout=60)
+        options.update(overrides)
+        return EmailWorkerPool(app, **options)
+
+    def message(self, i):
+        return Message(subject=f'Test {i}', sender='noreply@test.com',
+                       recipients=[f'user_{i}@example.com'], body='Test Body')
+
+    def test_messages_reuse_one_connection(self, smtp):
+        pool = self.make_pool(smtp.port)
+        for i in range(5):
+            assert pool.submit(self.message(i))
+        pool.join()
+        pool.stop()
+
+        assert len(smtp.messages) == 5
+        assert smtp.connections == 1
+        assert pool.stats() == {'queued': 0, 'sent': 5, 'failed': 0, 'retried': 0, 'dropped': 0,
+                                'connections': 1, 'in_flight': 0, 'breaker': 'closed'}
+
+    def test_connection_is_recycled(self, smtp):
+        pool = self.make_pool(smtp.port, max_per_connection=2)
+        for i in range(5):
+            pool.submit(self.message(i))
+        pool.join()
+        pool.stop()
+
+        assert len(smtp.messages) == 5
+        assert smtp.connections == 3
+
+    def test_failures_are_retried_and_open_breaker(self, smtp):
+        # Порт, на котором никто не слушает
+        port = smtp.port
+        smtp.shutdown()
+        smtp.server_close()
+
+        pool = self.make_pool(port, max_retries=2, breaker_threshold=3)
+        pool.submit(self.message(0))
+        pool.join()
+        pool.stop(timeout=0)
+
+        stats = pool.stats()
+        assert (stats['sent'], stats['failed'], stats['retried']) == (0, 1, 2)
+        assert stats['breaker'] == 'open'
+
+    def test_future_gets_result_of_single_attempt(self, smtp):
+        pool = self.make_pool(smtp.port, breaker_threshold=1)
+        sent = Future()
+        pool.submit(self.message(0), sent)
+        assert sent.result(timeout=5) is None
+
+        # Без повторов: ошибка сразу передаётся вызывающему коду и размыкает предохранитель
+        failed, skipped = Future(), Future()
+        with patch('app.email_queue._Worker.send', side_effect=ConnectionRefusedError('SMTP down')):
+            pool.submit(self.message(1), failed)
+            assert isinstance(failed.exception(timeout=5), ConnectionRefusedError)
+            pool.submit(self.message(2), skipped)
+            assert isinstance(skipped.exception(timeout=5), CircuitOpenError)
+        pool.stop()
+
+        assert len(smtp.messages) == 1
+        assert (pool.stats()['sent'], pool.stats()['failed'], pool.stats()['retried']) == (1, 1, 0)
+
+    def test_queue_is_bounded(self):
+        pool = self.make_pool(1, max_size=2)
+        pool._stopped.set()  # рабочие потоки не запускаются, письма остаются в очереди
+
+        assert [pool.submit(self.message(i)) for i in range(3)] == [True, True, False]
+        assert pool.stats()['queued'] == 2
+        assert pool.stats()['dropped'] == 1
+
+
+def test_circuit_breaker_half_open_probe():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    now[0] = 10
+    assert breaker.allow()      # одна пробная попытка
+    assert not breaker.allow()
+    breaker.record_failure()    # неудача - снова разомкнут
+    assert breaker.state == 'open'
+
+    now[0] = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
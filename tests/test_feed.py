@@ -0,0 +1,112 @@
+import pytest
+
+from app import db as _db
+from app.models import Post, TimelineEntry
+from app.services.feed import rebuild_timelines
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='function')
+def users(session):
+    """Читатель и два автора."""
+    users = [create_user(password='cat', email=f'user_{i}@example.com', username=f'user{i}', session=session)
+             for i in range(3)]
+    session.commit()
+    return users
+
+
+def publish(session, author, body):
+    post = Post(body=body, author=author)
+    session.add(post)
+    session.commit()
+    return post
+
+
+def feed(user):
+    return [post.body for post in _db.session.scalars(user.feed_posts)]
+
+
+def test_post_is_fanned_out_to_followers(session, users):
+    reader, author, _ = users
+    reader.follow(author)
+
+    publish(session, author, 'пост автора')
+
+    assert session.get(TimelineEntry, (reader.id, session.scalar(author.posts.select()).id)) is not None
+    assert feed(reader) == ['пост автора']
+
+
+def test_follow_backfills_and_unfollow_prunes(session, users):
+    reader, author, other = users
+    publish(session, author, 'старый пост')
+    publish(session, other, 'чужой пост')
+
+    reader.follow(author)
+    assert feed(reader) == ['старый пост']
+
+    reader.unfollow(author)
+    assert feed(reader) == []
+
+
+def test_popular_author_is_merged_at_read_time(app, session, users):
+    reader, author, other = users
+    reader.follow(author)
+    reader.follow(other)
+
+    app.config['FEED_FANOUT_MAX_FOLLOWERS'] = 0
+    try:
+        publish(session, author, 'пост популярного автора')
+        assert session.query(TimelineEntry).filter_by(user_id=reader.id).count() == 0
+        assert feed(reader) == ['пост популярного автора']
+        # В свою ленту автор получает пост всегда
+        assert session.query(TimelineEntry).filter_by(user_id=author.id).count() == 1
+        assert feed(author) == ['пост популярного автора']
+    finally:
+        app.config['FEED_FANOUT_MAX_FOLLOWERS'] = 5000
+
+
+def test_author_back_under_threshold_keeps_posts_in_feeds(app, session, users):
+    reader, author, other = users
+    reader.follow(author)
+    other.follow(author)
+
+    app.config['FEED_FANOUT_MAX_FOLLOWERS'] = 1
+    try:
+        # Два подписчика - выше порога: пост подмешивается при чтении
+        publish(session, author, 'пост популярного автора')
+        assert session.query(TimelineEntry).filter_by(user_id=reader.id).count() == 0
+        assert feed(reader) == ['пост популярного автора']
+        assert feed(author) == ['пост популярного автора']
+
+        # Обычная отписка возвращает автора под порог: пост раскладывается по лентам
+        other.unfollow(author)
+        assert feed(reader) == ['пост популярного автора']
+        assert feed(author) == ['пост популярного автора']
+        assert feed(other) == []
+        assert session.query(TimelineEntry).filter_by(user_id=reader.id).count() == 1
+    finally:
+        app.config['FEED_FANOUT_MAX_FOLLOWERS'] = 5000
+
+
+def test_rebuild_timelines(session, users):
+    reader, author, _ = users
+    reader.follow(author)
+    for i in range(3):
+        publish(session, author, f'пост {i}')
+    session.query(TimelineEntry).delete()
+    session.commit()
+
+    rebuild_timelines(limit=2)
+    assert session.query(TimelineEntry).filter_by(user_id=reader.id).count() == 2
+    assert feed(reader) == ['пост 2', 'пост 1']
+
+
+def test_feed_includes_own_posts(session, users):
+    reader, author, _ = users
+    reader.follow(author)
+
+    publish(session, reader, 'свой пост')
+    publish(session, author, 'пост автора')
+
+    assert feed(reader) == ['пост автора', 'свой пост']
+    assert feed(author) == ['пост автора']
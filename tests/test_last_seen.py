@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select
+
+from app.last_seen import PendingLastSeen
+from app.models import User
+from app.services.users import create_user
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope='function')
+def users(session):
+    users = [create_user(password='cat', email=f'user_{i}@example.com', username=f'user{i}', session=session)
+             for i in range(3)]
+    session.commit()
+    return users
+
+
+@pytest.fixture(scope='function')
+def buffer(app):
+    buffer = PendingLastSeen(app, min_interval=60, flush_interval=3600, max_pending=2)
+    yield buffer
+    buffer.stop()
+
+
+def last_seen(session, user):
+    return session.scalar(select(User.last_seen).where(User.id == user.id).execution_options(populate_existing=True))
+
+
+def test_touch_respects_min_interval(buffer):
+    now = datetime.now(timezone.utc)
+
+    assert buffer.touch(1, last_seen=now - timedelta(seconds=10), now=now) is None
+    assert buffer.touch(1, last_seen=(now - timedelta(minutes=5)).replace(tzinfo=None), now=now) == now
+    assert len(buffer) == 1
+
+
+def test_pending_is_bounded(buffer):
+    for user_id in range(10):
+        buffer.touch(user_id)
+
+    assert len(buffer) == 2
+    assert buffer.dropped == 8
+
+    # Отметки уже буферизованных пользователей обновляются и при заполненном буфере
+    assert buffer.touch(0) is not None
+    assert len(buffer) == 2
+
+
+def test_flush_writes_pending_in_one_batch(session, users, buffer):
+    seen_at = datetime(2030, 1, 1, 12, 0, tzinfo=timezone.utc)
+    buffer.touch(users[0].id, now=seen_at)
+    buffer.touch(users[1].id, now=seen_at)
+
+    assert buffer.flush() == 2
+    assert buffer.flush() == 0
+    assert last_seen(session, users[0]) == seen_at.replace(tzinfo=None)
+    assert last_seen(session, users[1]) == seen_at.replace(tzinfo=None)
+    assert last_seen(session, users[2]) != seen_at.replace(tzinfo=None)
+
+
+def test_ping_is_buffered(app, session, users):
+    user = users[0]
+    user.last_seen = datetime(2000, 1, 1)
+    session.commit()
+
+    user.ping()
+
+    assert user not in session.dirty
+    assert last_seen(session, user) == datetime(2000, 1, 1)
+
+    app.extensions['last_seen_buffer'].stop()
+    assert last_seen(session, user) > datetime(2000, 1, 1)
+
+
+def test_pending_is_flushed_on_exit(tmp_path):
+    database = tmp_path / 'last_seen.sqlite'
+    script = textwrap.dedent(f'''
+        from datetime import datetime
+
+        from app import create_app, db
+        from app.config import TestingConfig, config
+        from app.models import Role
+        from app.services.users import create_user
+
+        class FileConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = {f"sqlite:///{database}"!r}
+
+        config['file'] = FileConfig
+        app = create_app('file')
+        with app.app_context():
+            db.create_all()
+            Role.insert_roles()
+            user = create_user(password='cat', email='user@example.com', username='user',
+                               last_seen=datetime(2000, 1, 1))
+            db.session.commit()
+            user.ping()
+        # Процесс завершается, не дожидаясь фоновой записи
+    ''')
+    env = {**os.environ, 'SECRET_KEY': os.environ.get('SECRET_KEY', 'secret')}
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, check=True, timeout=60)
+
+    with sqlite3.connect(database) as connection:
+        (seen_at,) = connection.execute('SELECT last_seen FROM users').fetchone()
+
+    assert datetime.fromisoformat(seen_at) > datetime(2000, 1, 1)
@@ -0,0 +1,56 @@
+import logging
+
+import pytest
+
+from app import db as _db
+from app.lazy_loads import setup_lazy_load_logging
+from app.models import Post
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов этого модуля."""
+    return dict(SQLALCHEMY_LOG_LAZY_LOADS=True)
+
+
+@pytest.fixture(scope='module')
+def app(app):
+    """Журналирование неявных загрузок подключается после изменения настроек."""
+    setup_lazy_load_logging(app)
+    return app
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_lazy_load_in_request_is_logged_with_endpoint(app, session):
+    author = create_user(email='author@example.com', username='author', password='cat', session=session)
+    session.add(Post(body='пост', author=author))
+    session.commit()
+    session.expunge_all()
+
+    handler = RecordingHandler()
+    app.logger.addHandler(handler)
+    try:
+        # Вне запроса неявные загрузки не записываются
+        session.scalars(_db.select(Post)).one().author
+        assert handler.records == []
+        session.expunge_all()
+
+        with app.test_request_context('/'):
+            assert session.scalars(_db.select(Post)).one().author.username == 'author'
+    finally:
+        app.logger.removeHandler(handler)
+
+    (record,) = handler.records
+    assert record.levelno == logging.WARNING
+    message = record.getMessage()
+    assert 'Post' in message and '-> User' in message
+    assert 'GET /' in message and 'main.index' in message
@@ -0,0 +1,72 @@
+import pytest
+
+from app import create_app
+from app.log_reader import read_log_page
+
+RECORDS = [
+    '2030-01-01 00:00:00,000 - app - INFO - Логирование успешно настроено.',
+    '2030-01-01 00:00:01,000 - app - WARNING - Неудачная попытка входа',
+    '2030-01-01 00:00:02,000 - app - ERROR - Exception on /error500 [GET]\n'
+    'Traceback (most recent call last):\n'
+    '  File "views.py", line 1, in trigger_500\n'
+    'Exception: Это тестовая ошибка 500',
+    '2030-01-01 00:00:03,000 - app - INFO - Пользователь вошёл в систему.',
+    '2030-01-01 00:00:04,000 - app - INFO - Пост создан.',
+]
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    path = tmp_path / 'app.log'
+    path.write_text('\n'.join(RECORDS) + '\n', encoding='utf-8')
+    return path
+
+
+def read_all(path, **kwargs):
+    """Читает лог постранично до конца, возвращает тексты записей и количество страниц."""
+    texts, pages, before = [], 0, None
+    while True:
+        page = read_log_page(path, before=before, **kwargs)
+        texts += [entry.text for entry in page.entries]
+        pages += 1
+        if page.next_before is None:
+            return texts, pages
+        before = page.next_before
+
+
+@pytest.mark.parametrize('block_size', [7, 64, 64 * 1024])
+def test_pages_cover_file_newest_first(log_file, block_size):
+    texts, pages = read_all(log_file, limit=2, block_size=block_size)
+
+    assert texts == RECORDS[::-1]
+    assert pages == 3
+
+
+def test_multiline_records_and_level_filter(log_file):
+    page = read_log_page(log_file, level='ERROR', block_size=16)
+
+    assert [entry.level for entry in page.entries] == ['ERROR']
+    assert page.entries[0].text == RECORDS[2]
+    assert page.next_before is None
+
+
+def test_scan_limit_keeps_next_page_link(log_file):
+    page = read_log_page(log_file, level='WARNING', max_scan_bytes=10)
+
+    assert page.entries == []
+    assert page.next_before is not None
+    assert read_all(log_file, level='WARNING', max_scan_bytes=10)[0] == [RECORDS[1]]
+
+
+def test_logs_view_pages_by_offset(log_file, admin_client):
+    app = create_app('testing')
+    app.config.update(LOG_VIEW_PAGE_SIZE=2, LOG_FILE=str(log_file))
+    assert app.test_client().get('/logs').status_code == 302
+    client = admin_client(app)
+
+    html = client.get('/logs').get_data(as_text=True)
+    assert 'Пост создан.' in html and 'Логирование успешно' not in html
+    assert '/logs?before=' in html
+
+    html = client.get('/logs?level=error').get_data(as_text=True)
+    assert 'тестовая ошибка 500' in html and 'Пост создан.' not in html
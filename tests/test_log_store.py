@@ -0,0 +1,89 @@
+import logging
+
+import pytest
+
+from app import create_app
+from app.log_store import LogStore, SQLiteLogHandler
+from app.logger import setup_logger
+
+
+def row(created, level_name, endpoint=None, request_id=None, message='сообщение'):
+    return (created, logging.getLevelName(level_name), level_name, 'app', request_id, endpoint, None, message)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LogStore(str(tmp_path / 'logs.db'))
+    yield store
+    store.close()
+
+
+def test_query_filters_counts_and_histogram(store):
+    now = 1_700_000_400  # кратно ширине интервала гистограммы
+    store.write([
+        row(now - 7200, 'WARNING', 'main.index', message='давно'),
+        row(now - 600, 'INFO', 'main.index'),
+        row(now - 300, 'WARNING', 'main.index', request_id='r1', message='медленный 100% запрос'),
+        row(now - 200, 'WARNING', 'auth.login'),
+        row(now - 100, 'ERROR', 'main.index', request_id='r1'),
+    ])
+    last_hour = dict(since=now - 3600, until=now)
+
+    entries = store.query(level='WARNING', endpoint='main.index', **last_hour)
+    assert [entry['message'] for entry in entries] == ['медленный 100% запрос']
+    assert [entry['level_name'] for entry in store.query(request_id='r1')] == ['ERROR', 'WARNING']
+    assert len(store.query(search='100%')) == 1 and store.query(search='10_%') == []
+
+    # Постраничная выборка по id
+    first = store.query(limit=2)
+    assert [entry['id'] for entry in store.query(before_id=first[-1]['id'])] == [3, 2, 1]
+
+    assert store.level_counts(**last_hour) == {'INFO': 1, 'WARNING': 2, 'ERROR': 1}
+
+    buckets = store.histogram(1200, **last_hour)
+    assert len(buckets) == 3 and sum(item['total'] for item in buckets) == 4
+    assert buckets[-1]['counts'] == {'INFO': 1, 'WARNING': 2, 'ERROR': 1}
+
+    assert store.prune(now - 3600) == 1
+    assert len(store.query()) == 4
+
+
+def test_handler_writes_in_batches(store):
+    handler = SQLiteLogHandler(store, batch_size=3, flush_interval=60)
+    for i in range(4):
+        handler.handle(logging.LogRecord('app', logging.INFO, __file__, 1, f'запись {i}', None, None))
+    assert len(store.query()) == 3
+
+    handler.close()
+    assert len(store.query()) == 4
+
+
+def test_request_fields_page_and_api(tmp_path, admin_client):
+    app = create_app('testing')
+    app.config.update(LOG_HANDLERS=('sqlite',), LOG_STORE_PATH=str(tmp_path / 'logs.db'))
+    setup_logger(app)
+
+    @app.route('/_log_warning')
+    def log_warning():
+        app.logger.warning('предупреждение')
+        return ''
+
+    assert app.test_client().get('/logs/query').status_code == 302
+    client = admin_client(app)
+    client.get('/_log_warning', headers={'X-Request-ID': 'req-42'})
+    listener = app.extensions['log_listener']
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
+
+    data = client.get('/logs/query?level=WARNING').get_json()
+    (entry,) = data['entries']
+    assert (entry['message'], entry['request_id'], entry['endpoint']) == ('предупреждение', 'req-42', 'log_warning')
+    # INFO: настройка логирования и вход администратора
+    assert data['counts'] == {'INFO': 2, 'WARNING': 1}
+    assert sum(item['total'] for item in data['buckets']) == 1
+
+    response = client.get('/logs?request_id=req-42')
+    assert response.status_code == 200
+    assert 'предупреждение' in response.get_data(as_text=True)
+    assert 'успешно настроено' not in response.get_data(as_text=True)
@@ -0,0 +1,63 @@
+import json
+import logging
+
+from app import create_app
+from app.log_stream import LogBroadcaster
+from app.logger import setup_logger
+
+
+def emit(broadcaster, level, message):
+    broadcaster.handle(logging.LogRecord('app', level, __file__, 1, message, None, None))
+
+
+def test_subscriptions_are_bounded_and_filtered():
+    broadcaster = LogBroadcaster(buffer_size=3, backlog_size=10, max_clients=2)
+    warnings = broadcaster.subscribe(level='WARNING')
+    everything = broadcaster.subscribe()
+    assert broadcaster.subscribe() is None  # зрителей не больше max_clients
+
+    emit(broadcaster, logging.INFO, 'инфо')
+    for i in range(5):
+        emit(broadcaster, logging.WARNING, f'предупреждение {i}')
+
+    events, dropped = warnings.pop_all(timeout=0)
+    assert [event['message'] for event in events] == ['предупреждение 2', 'предупреждение 3', 'предупреждение 4']
+    assert dropped == 2
+    assert warnings.pop_all(timeout=0) == ([], 0)
+    assert everything.pop_all(timeout=0)[1] == 3
+
+    # Переподключение: пропущенные записи из сохранённых
+    broadcaster.unsubscribe(everything)
+    resumed = broadcaster.subscribe(last_event_id=4)
+    assert [event['id'] for event in resumed.pop_all(timeout=0)[0]] == [5, 6]
+
+
+def test_stream_endpoint_sends_new_records(admin_client):
+    app = create_app('testing')
+    app.config.update(LOG_HANDLERS=('stream',), LOG_STREAM_HEARTBEAT=0.05)
+    setup_logger(app)
+    broadcaster = app.extensions['log_broadcaster']
+
+    # Анонимный зритель не получает трансляцию и не занимает место
+    assert app.test_client().get('/logs/stream').status_code == 302
+    assert broadcaster.clients == 0
+
+    response = admin_client(app).get('/logs/stream?level=WARNING')
+    assert response.mimetype == 'text/event-stream'
+    assert broadcaster.clients == 1
+
+    chunks = iter(response.response)
+    assert next(chunks) == b': keepalive\n\n'
+
+    app.logger.info('инфо')
+    app.logger.warning('предупреждение')
+    chunk = next(chunk for chunk in chunks if chunk.startswith(b'id:'))
+    event_id, event_type, data = chunk.decode().strip().split('\n')
+    assert event_type == 'event: log'
+    record = json.loads(data.removeprefix('data: '))
+    assert record['message'] == 'предупреждение'
+    assert record['text'].endswith('WARNING - предупреждение')
+
+    response.close()
+    assert broadcaster.clients == 0
+    app.extensions['log_listener'].stop()
@@ -0,0 +1,129 @@
+import gzip
+import logging
+import threading
+import time
+
+from app import create_app
+from app.logger import HANDLER_FACTORIES, DroppingQueueHandler, RotatingLogFileHandler, setup_logger
+
+
+def make_record(message):
+    return logging.LogRecord('app', logging.INFO, __file__, 1, message, None, None)
+
+
+def test_size_rotation_compresses_and_prunes(tmp_path):
+    path = tmp_path / 'app.log'
+    handler = RotatingLogFileHandler(str(path), max_bytes=100, backup_count=2)
+    try:
+        for i in range(10):
+            handler.emit(make_record(f'запись {i:02d} ' + 'x' * 40))
+        handler.wait_for_compression()
+        backups = handler.backups()
+    finally:
+        handler.close()
+
+    assert len(backups) == 2
+    assert len(list(tmp_path.glob('app.log.*.gz'))) == 2
+    # Последние записи - в текущем файле и самой свежей резервной копии
+    assert 'запись 09' in path.read_text(encoding='utf-8')
+    with gzip.open(backups[-1] + '.gz', 'rt', encoding='utf-8') as f:
+        assert 'запись 08' in f.read()
+
+
+def test_compression_error_goes_to_stderr(tmp_path, monkeypatch, capsys):
+    rotated = tmp_path / 'app.log.2030-01-01_00-00-00'
+    rotated.write_text('запись\n', encoding='utf-8')
+
+    def fail(*args, **kwargs):
+        raise OSError('диск заполнен')
+
+    monkeypatch.setattr(gzip, 'open', fail)
+    handler = RotatingLogFileHandler(str(tmp_path / 'app.log'), max_bytes=100)
+    try:
+        handler._compress(str(rotated))
+    finally:
+        handler.close()
+
+    captured = capsys.readouterr()
+    assert captured.out == ''
+    assert 'диск заполнен' in captured.err
+    assert rotated.exists()
+
+
+def test_time_rotation(tmp_path):
+    path = tmp_path / 'app.log'
+    handler = RotatingLogFileHandler(str(path), interval=3600, compress=False)
+    try:
+        handler.emit(make_record('вчера'))
+        handler.rollover_at = time.time() - 1
+        handler.emit(make_record('сегодня'))
+    finally:
+        handler.close()
+
+    (backup,) = tmp_path.glob('app.log.*')
+    assert backup.read_text(encoding='utf-8').strip() == 'вчера'
+    assert path.read_text(encoding='utf-8').strip() == 'сегодня'
+
+
+def test_rotation_by_another_process_is_followed(tmp_path):
+    path = tmp_path / 'app.log'
+    # Два обработчика одного файла ведут себя как два процесса-воркера
+    first = RotatingLogFileHandler(str(path), max_bytes=10 ** 6, compress=False)
+    second = RotatingLogFileHandler(str(path), max_bytes=10 ** 6, compress=False)
+    try:
+        first.emit(make_record('до ротации'))
+        first.doRollover()
+        first.emit(make_record('свежая запись'))
+
+        # Второй процесс тоже решил ротировать файл: новый файл первого не переименовывается
+        second.doRollover()
+        second.emit(make_record('после ротации'))
+
+        # Запись после чужой ротации попадает в новый файл, а не в резервную копию
+        first.doRollover()
+        second.emit(make_record('в новый файл'))
+    finally:
+        first.close()
+        second.close()
+
+    first_backup, second_backup = first.backups()
+    with open(first_backup, encoding='utf-8') as f:
+        assert f.read().splitlines() == ['до ротации']
+    with open(second_backup, encoding='utf-8') as f:
+        assert f.read().splitlines() == ['свежая запись', 'после ротации']
+    assert path.read_text(encoding='utf-8').splitlines() == ['в новый файл']
+
+
+class SlowHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.unblock.wait(5)
+        self.messages.append(record.getMessage())
+
+
+def test_logging_does_not_block_caller(monkeypatch):
+    slow = SlowHandler()
+    monkeypatch.setitem(HANDLER_FACTORIES, 'slow', lambda app: slow)
+
+    app = create_app('testing')
+    app.config.update(LOG_HANDLERS=('slow',), LOG_QUEUE_SIZE=3)
+    setup_logger(app)
+
+    (queue_handler,) = app.logger.handlers
+    assert isinstance(queue_handler, DroppingQueueHandler)
+
+    started = time.perf_counter()
+    for i in range(10):
+        app.logger.info(f'сообщение {i}')
+    assert time.perf_counter() - started < 1
+
+    # Поток записи занят первой записью, очередь на 3 записи - остальные отброшены
+    assert queue_handler.dropped > 0
+    slow.unblock.set()
+    app.extensions['log_listener'].stop()
+    assert slow.messages[0] == 'Логирование успешно настроено.'
+    assert len(slow.messages) + queue_handler.dropped == 11
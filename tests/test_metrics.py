@@ -0,0 +1,70 @@
+import json
+import os
+
+import pytest
+
+from app.metrics import MetricsRegistry
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов этого модуля."""
+    return dict(METRICS_TOKEN='secret')
+
+
+def write_snapshot(directory, pid, registry):
+    snapshot = registry.snapshot()
+    snapshot['pid'] = pid
+    with open(os.path.join(directory, f'{pid}.json'), 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+
+
+def test_metrics_of_processes_are_summed(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    registry.add_collector(lambda: [('cache_entries', {'cache': 'identity'}, 2)])
+    # Общее для всех процессов значение не суммируется
+    registry.add_collector(lambda: [('email_outbox_emails', {'state': 'pending'}, 7)], shared=True)
+    registry.inc('http_requests_total', {'endpoint': 'main.index', 'method': 'GET', 'status': '200'})
+    registry.observe('http_request_duration_seconds', 0.02, {'endpoint': 'main.index', 'method': 'GET'})
+
+    # Другой работающий процесс и завершившийся процесс
+    other = MetricsRegistry()
+    other.add_collector(lambda: [('cache_entries', {'cache': 'identity'}, 3), ('cache_hits_total', {'cache': 'identity'}, 3),
+                                 ('cache_misses_total', {'cache': 'identity'}, 1)])
+    other.inc('http_requests_total', {'endpoint': 'main.index', 'method': 'GET', 'status': '200'}, 2)
+    other.observe('http_request_duration_seconds', 20, {'endpoint': 'main.index', 'method': 'GET'})
+    write_snapshot(tmp_path, os.getppid(), other)
+    write_snapshot(tmp_path, 2 ** 22 + 1, other)
+
+    text = registry.render()
+    assert 'http_requests_total{endpoint="main.index",method="GET",status="200"} 5' in text
+    labels = 'endpoint="main.index",method="GET"'
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.025"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="10.0"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f'http_request_duration_seconds_count{{{labels}}} 3' in text
+    # Показатели завершившегося процесса не учитываются, счётчики - учитываются
+    assert 'cache_entries{cache="identity"} 5' in text
+    assert 'email_outbox_emails{state="pending"} 7' in text
+    assert 'cache_hit_ratio{cache="identity"} 0.75' in text
+    assert '# TYPE http_request_duration_seconds histogram' in text
+
+
+def test_metrics_endpoint(app, session):
+    client = app.test_client()
+    client.get('/')
+    client.get('/no-such-page')
+
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'http_requests_total{endpoint="main.index",method="GET",status="200"} 1' in text
+    assert 'http_requests_total{endpoint="<unmatched>",method="GET",status="404"} 1' in text
+    assert 'db_queries_per_request_count{endpoint="main.index"} 1' in text
+    assert 'template_render_duration_seconds_count{template="index.html"} 1' in text
+    assert 'email_outbox_emails{state="pending"} 0' in text
+    assert 'email_outbox_oldest_pending_age_seconds 0' in text
+    assert 'cache_entries{cache="identity"}' in text
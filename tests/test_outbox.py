@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+
+import flask_mail
+import pytest
+from sqlalchemy import func, select, update
+
+from app import email_queue, mail
+from app.email_queue import CircuitBreaker
+from app.models import EmailOutbox, User
+from app.services.outbox import claim_batch, deliver_outbox, outbox_stats
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов этого модуля."""
+    return dict(WTF_CSRF_ENABLED=False, MAIL_SENDER='noreply@example.com')
+
+
+def register(app, i):
+    response = app.test_client().post('/auth/register', data={
+        'email': f'user_{i}@example.com', 'username': f'user{i}', 'password': 'cat', 'password2': 'cat'})
+    assert response.status_code == 302
+
+
+def test_register_writes_outbox_in_same_transaction(app, session):
+    with mail.record_messages() as outbox:
+        register(app, 0)
+
+    assert outbox == []
+    email = session.scalar(select(EmailOutbox))
+    user = session.scalar(select(User))
+    assert email.recipient == user.email
+    assert email.context['user'] == {'__model__': 'User', 'id': user.id}
+    assert email.status == EmailOutbox.PENDING
+
+    # Откат транзакции отменяет и письмо
+    with app.test_request_context():
+        create_user(password='cat', email='other@example.com', username='other', session=session)
+        EmailOutbox.enqueue('other@example.com', 'Тема', 'auth/email/confirm', user=user, token='t')
+        session.rollback()
+    assert session.scalar(select(func.count()).select_from(EmailOutbox)) == 1
+
+
+def test_deliver_outbox_renders_and_sends_once(app, session):
+    for i in range(5):
+        register(app, i)
+
+    with mail.record_messages() as outbox:
+        assert deliver_outbox(batch_size=3) == (3, 0, 0)
+        assert deliver_outbox(batch_size=3) == (2, 0, 0)
+        assert deliver_outbox(batch_size=3) == (0, 0, 0)
+
+    assert sorted(msg.recipients[0] for msg in outbox) == [f'user_{i}@example.com' for i in range(5)]
+    assert all('http://localhost/auth/confirm/' in msg.body for msg in outbox)
+    assert len({msg.msgId for msg in outbox}) == 5
+    assert session.scalar(select(func.count()).where(EmailOutbox.status == EmailOutbox.SENT)) == 5
+
+
+def test_failed_delivery_is_retried_then_given_up(app, session, monkeypatch):
+    register(app, 0)
+
+    def send(connection, message, envelope_from=None):
+        raise ConnectionRefusedError('SMTP down')
+
+    # Соединения переиспользуются потоками очереди, поэтому ошибка подставляется в отправку
+    monkeypatch.setattr(flask_mail.Connection, 'send', send)
+
+    assert deliver_outbox(max_attempts=2, backoff=0) == (0, 1, 0)
+    email = session.scalar(select(EmailOutbox))
+    assert (email.status, email.attempts, email.last_error) == (EmailOutbox.PENDING, 1, 'SMTP down')
+
+    assert deliver_outbox(max_attempts=2, backoff=0) == (0, 0, 1)
+    session.refresh(email)
+    assert (email.status, email.attempts) == (EmailOutbox.FAILED, 2)
+
+
+def test_open_breaker_pauses_delivery_without_spending_attempts(app, session, monkeypatch):
+    for i in range(2):
+        register(app, i)
+    pool = email_queue.pool
+    monkeypatch.setattr(pool, 'breaker', CircuitBreaker(failure_threshold=1, reset_timeout=60))
+
+    # Предохранитель разомкнут: письма не захватываются
+    pool.breaker.record_failure()
+    with mail.record_messages() as outbox:
+        assert deliver_outbox() == (0, 0, 0)
+    assert outbox == []
+    assert session.scalars(select(EmailOutbox.claimed_by)).all() == [None, None]
+
+    # Предохранитель разомкнулся, пока письма ждали в очереди: письма освобождаются без попытки
+    monkeypatch.setattr(pool.breaker, 'retry_after', lambda: 0)
+    monkeypatch.setattr(pool.breaker, 'allow', lambda: False)
+    assert deliver_outbox() == (0, 0, 0)
+    for email in session.scalars(select(EmailOutbox)):
+        assert (email.status, email.attempts, email.claimed_by) == (EmailOutbox.PENDING, 0, None)
+
+
+def test_claimed_emails_are_not_given_to_other_workers(app, session):
+    for i in range(4):
+        register(app, i)
+
+    first = claim_batch('first', limit=3, lease=300)
+    second = claim_batch('second', limit=3, lease=300)
+    assert len(first) == 3 and len(second) == 1
+    assert not {email.id for email in first} & {email.id for email in second}
+
+    # После истечения аренды письма снова доступны
+    later = datetime.utcnow() + timedelta(seconds=301)
+    assert len(claim_batch('third', limit=10, lease=300, now=later)) == 4
+
+
+def test_outbox_stats(app, session):
+    assert outbox_stats() == {'pending': 0, 'leased': 0, 'failed': 0, 'oldest_pending_age': 0}
+    for i in range(4):
+        register(app, i)
+    session.execute(update(EmailOutbox).where(EmailOutbox.recipient == 'user_3@example.com')
+                    .values(status=EmailOutbox.FAILED))
+    session.commit()
+    claim_batch('worker', limit=1, lease=300)
+
+    stats = outbox_stats(now=datetime.now(timezone.utc) + timedelta(seconds=60))
+    assert (stats['pending'], stats['leased'], stats['failed']) == (2, 1, 1)
+    assert 60 <= stats['oldest_pending_age'] < 120
+
+    # Истёкшая аренда - письмо снова ждёт отправки
+    stats = outbox_stats(now=datetime.now(timezone.utc) + timedelta(seconds=301))
+    assert (stats['pending'], stats['leased'], stats['failed']) == (3, 0, 1)
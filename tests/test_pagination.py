@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from werkzeug.exceptions import BadRequest
+
+from app.main.views import paginate_timeline
+from app.models import Post
+from app.pagination import decode_cursor, encode_cursor, keyset_paginate
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов этого модуля."""
+    return dict(POSTS_PER_PAGE=2)
+
+
+@pytest.fixture(scope='function')
+def posts(session):
+    """Пять постов от старого к новому; у двух средних одинаковое время."""
+    author = create_user(email='author@example.com', username='author', password='cat', session=session)
+    start = datetime(2024, 1, 1)
+    offsets = [0, 1, 2, 2, 3]
+    posts = [Post(body=f'пост {i}', author=author, timestamp=start + timedelta(minutes=offset))
+             for i, offset in enumerate(offsets)]
+    session.add_all(posts)
+    session.commit()
+    return posts
+
+
+def bodies(pagination):
+    return [post.body for post in pagination.items]
+
+
+def page(per_page=2, **cursors):
+    return keyset_paginate(select(Post), Post.timestamp, Post.id, per_page=per_page, **cursors)
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 1, 1, 12, 30, 15, 250)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+
+def test_after_cursor_walks_to_the_last_page(posts):
+    first = page()
+    assert bodies(first) == ['пост 4', 'пост 3']
+    assert first.has_next and not first.has_prev and first.prev_cursor is None
+
+    # Совпадение времени у постов 3 и 2 разрешается по id: ничего не теряется и не повторяется
+    second = page(after=first.next_cursor)
+    assert bodies(second) == ['пост 2', 'пост 1']
+    assert second.has_next and second.has_prev
+
+    last = page(after=second.next_cursor)
+    assert bodies(last) == ['пост 0']
+    assert not last.has_next and last.next_cursor is None and last.has_prev
+
+
+def test_extra_row_decides_has_next_on_exact_boundary(posts):
+    # Ровно столько элементов, сколько помещается на страницу: следующей страницы нет
+    pagination = page(per_page=5)
+    assert len(pagination.items) == 5 and not pagination.has_next
+
+    pagination = page(per_page=4)
+    assert len(pagination.items) == 4 and pagination.has_next
+
+
+def test_before_cursor_returns_previous_page_in_display_order(posts):
+    second = page(after=page().next_cursor)
+    last = page(after=second.next_cursor)
+
+    previous = page(before=last.prev_cursor)
+    assert bodies(previous) == ['пост 2', 'пост 1']
+    assert previous.has_next and previous.has_prev
+
+    first = page(before=previous.prev_cursor)
+    assert bodies(first) == ['пост 4', 'пост 3']
+    assert first.has_next and not first.has_prev
+
+
+def test_invalid_cursor_is_bad_request(posts):
+    with pytest.raises(BadRequest):
+        page(after='not-a-cursor')
+
+
+def test_timeline_page_number_fallback(app, posts):
+    # Постраничная навигация сохраняет сортировку, заданную в запросе
+    stmt = select(Post).order_by(Post.timestamp.desc(), Post.id.desc())
+    with app.test_request_context('/?page=2'):
+        pagination = paginate_timeline(stmt)
+        assert not getattr(pagination, 'cursor_based', False)
+        assert bodies(pagination) == ['пост 2', 'пост 1']
+        assert pagination.has_next and pagination.has_prev and pagination.total == 5
+
+    with app.test_request_context('/?page=9'):
+        assert bodies(paginate_timeline(stmt)) == []
+
+
+def test_timeline_uses_cursors_by_default(app, posts):
+    with app.test_request_context('/'):
+        first = paginate_timeline(select(Post))
+        assert first.cursor_based and bodies(first) == ['пост 4', 'пост 3']
+
+    with app.test_request_context(f'/?after={first.next_cursor}'):
+        assert bodies(paginate_timeline(select(Post))) == ['пост 2', 'пост 1']
@@ -0,0 +1,148 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app.models import MARKDOWN_RENDERER_VERSION, POST_EXCERPT_LENGTH, Comment, Post
+from app.services.posts import reconcile_comment_counters, rerender_posts
+from app.services.users import create_user
+
+
+@pytest.fixture(scope='function')
+def author(session):
+    user = create_user(password='cat', email='author@example.com', username='author', session=session)
+    session.commit()
+    return user
+
+
+def test_body_html_rendered_on_create(session, author):
+    post = Post(body='**жирный**', author=author)
+    session.add(post)
+    session.commit()
+
+    assert post.body_html == '<p><strong>жирный</strong></p>\n'
+    assert post.body_html_version == MARKDOWN_RENDERER_VERSION
+
+
+def test_body_html_rendered_on_edit(session, author):
+    post = Post(body='старый текст', author=author)
+    session.add(post)
+    session.commit()
+
+    post.body = '*новый* текст'
+    session.commit()
+
+    assert post.body_html == '<p><em>новый</em> текст</p>\n'
+
+
+def test_short_post_excerpt_is_whole_body(session, author):
+    post = Post(body='короткий пост', author=author)
+    session.add(post)
+    session.commit()
+
+    assert post.body_excerpt == 'короткий пост'
+    assert post.body_excerpt_html == post.body_html
+    assert post.body_has_more is False
+
+
+def test_long_post_excerpt_is_truncated_by_word(session, author):
+    post = Post(body='слово ' * POST_EXCERPT_LENGTH, author=author)
+    session.add(post)
+    session.commit()
+
+    assert post.body_has_more is True
+    assert len(post.body_excerpt) <= POST_EXCERPT_LENGTH + 1
+    assert post.body_excerpt.endswith('слово…')
+    assert post.body_excerpt_html == f'<p>{post.body_excerpt}</p>\n'
+
+
+def test_rerender_posts_updates_stale_rows(session, author):
+    posts = [Post(body=f'пост **{i}**', author=author) for i in range(5)]
+    session.add_all(posts)
+    session.commit()
+
+    # Имитируем посты, сохранённые до появления body_html
+    session.execute(update(Post).values(body_html=None, body_html_version=None, body_excerpt=None))
+    session.commit()
+
+    assert rerender_posts(chunk_size=2, workers=2) == 5
+    assert rerender_posts(chunk_size=2, workers=2) == 0
+
+    session.expire_all()
+    for i, post in enumerate(posts):
+        assert post.body_html == f'<p>пост <strong>{i}</strong></p>\n'
+        assert post.body_html_version == MARKDOWN_RENDERER_VERSION
+        assert post.body_excerpt == f'пост **{i}**'
+
+
+def test_comment_counters_follow_comment_changes(session, author):
+    post = Post(body='пост', author=author)
+    session.add(post)
+    session.commit()
+
+    comments = [Comment(body=f'коммент {i}', author=author, post=post) for i in range(3)]
+    session.add_all(comments)
+    session.commit()
+    assert (post.comments_count, post.enabled_comments_count) == (3, 3)
+
+    comments[0].disabled = True
+    session.commit()
+    assert (post.comments_count, post.enabled_comments_count) == (3, 2)
+
+    session.delete(comments[0])
+    session.delete(comments[1])
+    session.commit()
+    assert (post.comments_count, post.enabled_comments_count) == (1, 1)
+
+
+def test_reconcile_comment_counters_fixes_drift(session, author):
+    post = Post(body='пост', author=author)
+    session.add(post)
+    session.add(Comment(body='коммент', author=author, post=post, disabled=True))
+    session.commit()
+
+    session.execute(update(Post).values(comments_count=10, enabled_comments_count=10))
+    session.commit()
+
+    assert reconcile_comment_counters() == 1
+    assert reconcile_comment_counters() == 0
+
+    session.expire_all()
+    assert (post.comments_count, post.enabled_comments_count) == (1, 0)
+
+
+def test_load_comment_previews_returns_latest_visible(session, author):
+    posts = [Post(body=f'пост {i}', author=author) for i in range(2)]
+    session.add_all(posts)
+    for i in range(5):
+        session.add(Comment(body=f'коммент {i}', author=author, post=posts[0], disabled=(i == 4)))
+    session.commit()
+
+    previews = Post.load_comment_previews([post.id for post in posts], limit=3)
+
+    assert [c.body for c in previews[posts[0].id]] == ['коммент 1', 'коммент 2', 'коммент 3']
+    assert previews[posts[1].id] == []
+
+    previews = Post.load_comment_previews([posts[0].id], limit=2, include_disabled=True)
+    assert [c.body for c in previews[posts[0].id]] == ['коммент 3', 'коммент 4']
+
+
+def test_comment_previews_are_ordered_by_creation_time(session, author):
+    post = Post(body='пост', author=author)
+    session.add(post)
+    for i in range(3):
+        # Время создания ставится для каждого комментария, а не один раз при импорте модуля
+        session.add(Comment(body=f'коммент {i}', author=author, post=post))
+        session.commit()
+    comments = session.scalars(post.comments.select().order_by(Comment.id)).all()
+    assert comments[0].created_at < comments[1].created_at < comments[2].created_at
+
+    # Комментарий, импортированный задним числом: id больше, но по времени он самый старый
+    session.add(Comment(body='старый', author=author, post=post,
+                        created_at=comments[0].created_at - timedelta(hours=1)))
+    session.commit()
+
+    previews = Post.load_comment_previews([post.id], limit=3)
+    assert [c.body for c in previews[post.id]] == ['коммент 0', 'коммент 1', 'коммент 2']
+    previews = Post.load_comment_previews([post.id], limit=4)
+    assert [c.body for c in previews[post.id]] == ['старый', 'коммент 0', 'коммент 1', 'коммент 2']
@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+
+from app.models import User
+from app.services.users import create_user
+from app.sql_trace import normalize, parameter_shape
+
+
+@pytest.fixture(scope='module')
+def app_config():
+    """Настройки приложения для тестов этого модуля."""
+    return dict(WTF_CSRF_ENABLED=False, ADMIN_EMAIL='admin@example.com')
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_normalize_and_parameter_shape():
+    assert normalize("SELECT * FROM users\n WHERE id IN (?, ?, ?) AND name = 'bob' LIMIT 10") == \
+        'SELECT * FROM users WHERE id IN (?, ...) AND name = ? LIMIT ?'
+    assert normalize('SELECT anon_1.id FROM t AS anon_1') == 'SELECT anon_1.id FROM t AS anon_1'
+    assert parameter_shape((1, 'secret', None)) == '(int, str[6], None)'
+    assert parameter_shape([(1,), (2,)], executemany=True) == '2 × (int)'
+
+
+def test_slow_queries_are_logged_with_plan(app, session, monkeypatch):
+    trace = app.extensions['sql_trace']
+    trace.clear()
+    monkeypatch.setattr(trace, 'slow_threshold', 0)
+    handler = RecordingHandler()
+    app.logger.addHandler(handler)
+    try:
+        user = create_user(email='user@example.com', username='user', password='cat', confirmed=True)
+        session.commit()
+        session.expire_all()
+        with app.test_request_context('/'):
+            session.scalars(session.get(User, user.id).feed_posts.limit(5)).all()
+    finally:
+        app.logger.removeHandler(handler)
+
+    (stats,) = [stats for stats in trace.top(sort='count') if 'JOIN timeline' in stats.statement]
+    assert stats.endpoints == {'main.index': 1}
+    assert stats.slow == 1 and stats.parameters == '(int, int, int)'
+    assert 'timeline' in stats.plan
+
+    (record,) = [record for record in handler.records if 'JOIN timeline' in record.getMessage()]
+    assert record.name == 'app.sql' and record.levelno == logging.WARNING
+    assert 'main.index' in record.getMessage() and stats.plan in record.getMessage()
+
+
+def test_admin_page(app, session):
+    create_user(email='admin@example.com', username='admin', password='cat', confirmed=True)
+    session.commit()
+    client = app.test_client()
+    assert client.get('/admin/sql').status_code == 302
+
+    client.post('/auth/login', data={'email': 'admin@example.com', 'password': 'cat'})
+    response = client.get('/admin/sql?sort=max')
+    assert response.status_code == 200
+    assert 'FROM users' in response.get_data(as_text=True)
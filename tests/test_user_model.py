@@ -1,40 +1,12 @@
-import pytest
-
-from app import create_app
-from app import db as _db
-from app.models import Role
-from app.services.users import create_user
-
-
-@pytest.fixture(scope='module')
-def app():
-    """Создание фикстуры для всех тестов в этом модуле."""
-    app = create_app('testing')
-    with app.app_context():
-        yield app       # Доступ к app внутри тестов
-
-
-@pytest.fixture(scope='module')
-def db(app):
-    """Фикстура для базы данных (создание и удаление таблиц)."""
-    _db.create_all()
-    Role.insert_roles()
-    yield _db   # Доступ к _db внутри тестов
-    _db.session.remove()
-    _db.drop_all()
-
+from datetime import datetime
 
-@pytest.fixture(scope='function')
-def session(db):
-    # Очистка всех таблиц
-    for table in reversed(db.metadata.sorted_tables):   # гарантирует правильный порядок удаления (учитывая внешние ключи).
-        db.session.execute(table.delete())
-    db.session.commit()
-
-    yield db.session
+import pytest
+from sqlalchemy import update
 
-    db.session.rollback()
-    db.session.remove()
+from app import db as _db, identity_cache
+from app.models import Comment, Permission, Post, Role, User, load_user
+from app.passwords import HashingPool
+from app.services.users import create_user, reconcile_user_counters
 
 
 @pytest.fixture(scope='function')
@@ -66,3 +38,146 @@ def test_password_verification(test_users):
 def test_password_salts_are_random(test_users):
     user_1, user_2 = test_users
     assert user_1.password_hash != user_2.password_hash
+
+
+def test_password_rehashed_on_login_when_method_changes(app, session, test_users):
+    user_1, user_2 = test_users
+    pool = app.extensions['password_hasher']
+    old_hash = user_1.password_hash
+    assert old_hash.startswith('pbkdf2:sha256:1000$')
+
+    method, prefix = pool.method, pool._method_prefix
+    pool.method, pool._method_prefix = 'pbkdf2:sha256:2000', None
+    try:
+        assert not user_1.verify_password('dog')
+        assert user_1.password_hash == old_hash
+
+        # Перехеширование не фиксирует чужие изменения сеанса
+        user_2.about_me = 'не сохранять'
+        assert user_1.verify_password('cat')
+        assert user_1.password_hash.startswith('pbkdf2:sha256:2000$')
+        session.rollback()
+        assert user_2.about_me != 'не сохранять'
+        assert user_1.password_hash.startswith('pbkdf2:sha256:2000$')
+        assert user_1.verify_password('cat')
+    finally:
+        pool.method, pool._method_prefix = method, prefix
+
+
+def test_passwords_hashed_in_process_pool():
+    pool = HashingPool('pbkdf2:sha256:1000', workers=2, max_pending=0)
+    try:
+        hashes = pool.hash_many(['cat', 'dog'])
+        assert pool.verify(hashes[0], 'cat')
+        assert not pool.verify(hashes[1], 'cat')
+        assert pool.verify(pool.hash('cat'), 'cat')
+        # Процессы пула не наследуют состояние потоков приложения
+        assert pool._get_executor()._mp_context.get_start_method() == 'spawn'
+    finally:
+        pool.shutdown()
+
+
+def test_cannot_follow_self(session, test_users):
+    user_1, _ = test_users
+    user_1.follow(user_1)
+    assert not user_1.is_following(user_1)
+    assert (user_1.followers_count, user_1.following_count) == (0, 0)
+
+
+def test_follow_counters(session, test_users):
+    user_1, user_2 = test_users
+
+    user_1.follow(user_2)
+    assert (user_1.following_count, user_2.followers_count) == (1, 1)
+
+    user_1.unfollow(user_2)
+    assert (user_1.following_count, user_2.followers_count) == (0, 0)
+
+
+def test_post_and_comment_counters(session, test_users):
+    user_1, user_2 = test_users
+    post = Post(body='пост', author=user_1)
+    session.add(post)
+    session.add(Comment(body='коммент', author=user_2, post=post))
+    session.commit()
+    assert (user_1.posts_count, user_2.comments_count) == (1, 1)
+
+    # Комментарии удаляются каскадно вместе с постом
+    session.delete(post)
+    session.commit()
+    assert (user_1.posts_count, user_2.comments_count) == (0, 0)
+
+
+def test_reconcile_user_counters_fixes_drift(session, test_users):
+    user_1, user_2 = test_users
+    user_2.follow(user_1)
+    session.execute(update(User).values(followers_count=5, posts_count=3))
+    session.commit()
+
+    assert reconcile_user_counters() == 2
+    assert reconcile_user_counters() == 0
+
+    session.expire_all()
+    assert (user_1.followers_count, user_1.posts_count) == (1, 0)
+    assert (user_2.followers_count, user_2.following_count) == (0, 1)
+
+
+@pytest.fixture(scope='function')
+def user_with_role(session):
+    """Пользователь с ролью по умолчанию."""
+    user = create_user(password='cat', email='user_1@example.com', username='testuser1', session=session)
+    session.commit()
+    return user
+
+
+def test_load_user_uses_identity_cache(session, user_with_role):
+    user_id = user_with_role.id
+    identity_cache.clear()
+    session.remove()
+    load_user(user_id)  # Первый запрос заполняет кеш
+    session.remove()
+
+    queries = []
+
+    def count_query(*args):
+        queries.append(args[2])
+
+    _db.event.listen(_db.engine, 'before_cursor_execute', count_query)
+    try:
+        user = load_user(user_id)
+        assert (user.username, user.role.name, user.can(Permission.COMMENT)) == ('testuser1', 'User', True)
+        assert queries == []
+
+        # Поля вне кеша загружаются из БД при обращении
+        assert user.posts_count == 0
+        assert len(queries) == 1
+    finally:
+        _db.event.remove(_db.engine, 'before_cursor_execute', count_query)
+
+
+def test_last_seen_update_does_not_count_as_cache_hit(session, user_with_role):
+    user_id = user_with_role.id
+    identity_cache.clear()
+    session.remove()
+    load_user(user_id)
+    stats = identity_cache.entries.stats()
+
+    seen_at = datetime(2030, 1, 1)
+    identity_cache.update_last_seen(user_id, seen_at)
+    assert identity_cache.entries.stats() == stats
+    assert load_user(user_id).last_seen == seen_at
+
+
+def test_identity_cache_invalidated_on_role_change(session, user_with_role):
+    user_id = user_with_role.id
+    identity_cache.clear()
+    session.remove()
+    assert not load_user(user_id).is_administrator()
+    session.remove()
+
+    user = session.get(User, user_id)
+    user.role = session.scalar(_db.select(Role).where(Role.name == 'Administrator'))
+    session.commit()
+    session.remove()
+
+    assert load_user(user_id).is_administrator()